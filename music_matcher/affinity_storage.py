@@ -0,0 +1,518 @@
+"""Module that contains the structures used to store users' affinities."""
+
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import NamedTuple
+
+import numpy as np
+
+from music_matcher.sparse_preferences import SparsePreferences
+
+
+class AffinityStorageError(ValueError):
+    '''Exception that will be raised when an affinity storage structure
+       has encountered a wrong value in the parameters of a method.'''
+
+
+class CacheInfo(NamedTuple):
+    '''Statistics of an AffinityCache instance.'''
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    maxsize: int
+
+
+class AffinityCache:
+    '''Bounded cache of affinities with least-recently-used eviction.
+
+       Attributes
+       ----------
+       maxsize : int
+           Maximum number of affinities kept in the cache.
+       hits : int
+           Number of lookups that found the affinity in the cache.
+       misses : int
+           Number of lookups that didn't find the affinity in the cache.
+       evictions : int
+           Number of affinities discarded to make room for newer ones.
+    '''
+
+    def __init__(self, maxsize: int):
+        """
+        AffinityCache constructor.
+
+        Parameters
+        ----------
+        maxsize : int
+            Maximum number of affinities kept in the cache.
+
+        Raises
+        ------
+        AffinityStorageError
+            When maxsize is negative.
+        """
+        if maxsize < 0:
+            raise AffinityStorageError('The maxsize of the cache must not be negative')
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._values = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    @staticmethod
+    def _key(i: int, j: int) -> tuple[int, int]:
+        # Affinities are symmetric, so both orders share the same entry.
+        return (i, j) if i <= j else (j, i)
+
+    def get(self, i: int, j: int):
+        """
+        Return the cached affinity of a pair of rows.
+
+        Parameters
+        ----------
+        i : int
+            Row of the first user.
+        j : int
+            Row of the second user.
+
+        Returns
+        -------
+        float or None
+            The cached affinity, or None if the pair is not in the cache.
+        """
+        key = AffinityCache._key(i, j)
+        value = self._values.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._values.move_to_end(key)
+        return value
+
+    def put(self, i: int, j: int, value: float):
+        """
+        Store the affinity of a pair of rows, evicting the least recently
+        used one if the cache is full.
+
+        Parameters
+        ----------
+        i : int
+            Row of the first user.
+        j : int
+            Row of the second user.
+        value : float
+            Affinity between both users.
+        """
+        if self.maxsize == 0:
+            return
+        key = AffinityCache._key(i, j)
+        self._values[key] = value
+        self._values.move_to_end(key)
+        if len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Discard every cached affinity, keeping the counters."""
+        self._values.clear()
+
+    def discard(self, i: int):
+        """
+        Discard every cached affinity of a row.
+
+        Parameters
+        ----------
+        i : int
+            Row whose affinities are no longer valid.
+        """
+        for key in [key for key in self._values if i in key]:
+            del self._values[key]
+
+    def info(self) -> CacheInfo:
+        """
+        Return the statistics of the cache.
+
+        Returns
+        -------
+        CacheInfo
+            Hits, misses, evictions, current size and maximum size of the cache.
+        """
+        return CacheInfo(self.hits, self.misses, self.evictions,
+                         len(self._values), self.maxsize)
+
+
+class TriangularAffinityMatrix:
+    '''Symmetric affinity matrix that only stores its strict upper triangle.
+
+       The diagonal is always 1 and the lower triangle mirrors the upper one,
+       so only the pairs (i, j) with i < j are kept in a contiguous buffer.
+       The triangle is packed by columns, which places the affinity of the
+       pair (i, j) at the offset j * (j - 1) / 2 + i and keeps the affinities
+       of every new user at the end of the buffer. The buffer grows
+       geometrically, so appending a user is amortized O(size).
+
+       Attributes
+       ----------
+       size : int
+           Number of users in the matrix.
+       dtype : str
+           Floating point type used to store the affinities.
+    '''
+
+    DTYPES = ('float32', 'float16')
+    DEFAULT_BLOCK_SIZE = 1024
+
+    def __init__(self, size: int, dtype: str = 'float32'):
+        """
+        TriangularAffinityMatrix constructor, with every affinity set to 0.
+
+        Parameters
+        ----------
+        size : int
+            Number of users in the matrix.
+        dtype : str
+            Floating point type used to store the affinities, must be one of DTYPES.
+
+        Raises
+        ------
+        AffinityStorageError
+            When the size is negative or the dtype is not valid.
+        """
+        if size < 0:
+            raise AffinityStorageError('The size of the matrix must not be negative')
+        if dtype not in TriangularAffinityMatrix.DTYPES:
+            raise AffinityStorageError('The dtype must be one of the following: '
+                                       f'{TriangularAffinityMatrix.DTYPES}')
+        self.size = size
+        self.dtype = dtype
+        self._buffer = np.zeros(size * (size - 1) // 2, dtype=dtype)
+
+    @classmethod
+    def from_preferences(cls, packed: np.ndarray, dtype: str = 'float32',
+                         block_size: int = DEFAULT_BLOCK_SIZE):
+        """
+        Return the affinity matrix of the users whose preferences are packed in a matrix.
+
+        The columns of the triangle are computed in blocks of block_size, so
+        the full users x users product is never allocated.
+
+        Parameters
+        ----------
+        packed : np.ndarray or SparsePreferences
+            Users x genres matrix with the normalized preferences of every user.
+        dtype : str
+            Floating point type used to store the affinities, must be one of DTYPES.
+        block_size : int
+            Number of columns of the triangle computed at once.
+
+        Returns
+        -------
+        TriangularAffinityMatrix
+            Matrix with the affinity of every pair of users.
+        """
+        matrix = cls(len(packed), dtype)
+        for start in range(0, matrix.size, block_size):
+            end = min(start + block_size, matrix.size)
+            if isinstance(packed, SparsePreferences):
+                matrix.fill_columns(start, packed.block_scores(start, end))
+            else:
+                matrix.fill_columns(start, packed[start:end] @ packed[:end].T)
+        return matrix
+
+    @classmethod
+    def from_buffer(cls, size: int, dtype: str, buffer):
+        """
+        Return a matrix whose affinities are stored in an existing buffer.
+
+        Parameters
+        ----------
+        size : int
+            Number of users in the matrix.
+        dtype : str
+            Floating point type of the affinities, must be one of DTYPES.
+        buffer : Buffer
+            Object exposing the buffer protocol with, at least, the strict
+            upper triangle of the matrix packed by columns.
+
+        Returns
+        -------
+        TriangularAffinityMatrix
+            Matrix backed by the buffer, without copying it.
+        """
+        matrix = cls(0, dtype)
+        matrix.size = size
+        matrix._buffer = np.frombuffer(buffer, dtype=dtype, count=size * (size - 1) // 2)
+        return matrix
+
+    @staticmethod
+    def offset(i, j):
+        """
+        Return the position of the pair (i, j) inside the buffer.
+
+        Parameters
+        ----------
+        i : int or np.ndarray
+            Row (or rows) of the pair, must be lower than j.
+        j : int or np.ndarray
+            Column (or columns) of the pair.
+
+        Returns
+        -------
+        int or np.ndarray
+            Offset of the pair in the buffer.
+        """
+        return j * (j - 1) // 2 + i
+
+    @property
+    def _used(self) -> int:
+        return self.size * (self.size - 1) // 2
+
+    @property
+    def buffer(self) -> np.ndarray:
+        """
+        Return the affinities stored, packed by columns.
+
+        Returns
+        -------
+        np.ndarray
+            View of the strict upper triangle of the matrix.
+        """
+        return self._buffer[:self._used]
+
+    def fill_columns(self, start: int, block: np.ndarray):
+        """
+        Store the affinities of a block of consecutive columns.
+
+        Parameters
+        ----------
+        start : int
+            First column of the block.
+        block : np.ndarray
+            Matrix whose row k holds the affinity of the user start + k with,
+            at least, every user before it.
+        """
+        for k, row in enumerate(block):
+            j = start + k
+            begin = TriangularAffinityMatrix.offset(0, j)
+            self._buffer[begin:begin + j] = row[:j]
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Return the amount of memory used by the stored affinities.
+
+        Returns
+        -------
+        int
+            Size of the buffer in bytes.
+        """
+        return self.buffer.nbytes
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            return self.row(key)
+
+        rows, cols = np.asarray(key[0], dtype=np.int64), np.asarray(key[1], dtype=np.int64)
+        low, high = np.minimum(rows, cols), np.maximum(rows, cols)
+        diagonal = low == high
+        offsets = np.where(diagonal, 0, TriangularAffinityMatrix.offset(low, high))
+        affinities = np.array(self._buffer[offsets], dtype=np.float64)
+        affinities[diagonal] = 1
+        return float(affinities) if affinities.ndim == 0 else affinities
+
+    def row(self, i: int) -> np.ndarray:
+        """
+        Return the affinities of a user with every user in the matrix.
+
+        Parameters
+        ----------
+        i : int
+            Row of the user.
+
+        Returns
+        -------
+        np.ndarray
+            Affinity of the user with every user, including itself.
+        """
+        begin = TriangularAffinityMatrix.offset(0, i)
+        affinities = np.empty(self.size, dtype=np.float64)
+        affinities[:i] = self._buffer[begin:begin + i]
+        affinities[i] = 1
+        cols = np.arange(i + 1, self.size, dtype=np.int64)
+        affinities[i + 1:] = self._buffer[TriangularAffinityMatrix.offset(i, cols)]
+        return affinities
+
+    def set_row(self, i: int, affinities: np.ndarray):
+        """
+        Replace the affinities of a user with every other user.
+
+        Parameters
+        ----------
+        i : int
+            Row of the user.
+        affinities : np.ndarray
+            Affinity of the user with every user. The value at the position i
+            is ignored, since the diagonal is always 1.
+        """
+        begin = TriangularAffinityMatrix.offset(0, i)
+        self._buffer[begin:begin + i] = affinities[:i]
+        cols = np.arange(i + 1, self.size, dtype=np.int64)
+        self._buffer[TriangularAffinityMatrix.offset(i, cols)] = affinities[i + 1:]
+
+    def append(self, affinities: np.ndarray):
+        """
+        Add a new user at the end of the matrix.
+
+        Parameters
+        ----------
+        affinities : np.ndarray
+            Affinity of the new user with every user already in the matrix.
+        """
+        begin, end = self._used, self._used + self.size
+        if end > len(self._buffer):
+            buffer = np.zeros(max(end, 2 * len(self._buffer)), dtype=self.dtype)
+            buffer[:begin] = self._buffer[:begin]
+            self._buffer = buffer
+        self._buffer[begin:end] = affinities[:self.size]
+        self.size += 1
+
+    def remove(self, i: int):
+        """
+        Remove a user from the matrix, moving the following users one row up.
+
+        Parameters
+        ----------
+        i : int
+            Row of the user.
+        """
+        # The columns before i don't include the row i and stay where they are.
+        # The following ones are shifted left, skipping the affinity with i.
+        destination = TriangularAffinityMatrix.offset(0, i)
+        for j in range(i + 1, self.size):
+            begin = TriangularAffinityMatrix.offset(0, j)
+            self._buffer[destination:destination + i] = self._buffer[begin:begin + i]
+            self._buffer[destination + i:destination + j - 1] = \
+                self._buffer[begin + i + 1:begin + j]
+            destination += j - 1
+        self.size -= 1
+
+
+def _fill_block(packed_buffer, output_buffer, shape: tuple[int, int], layout: str, dtype: str,
+                start: int, end: int):
+    num_users, num_genres = shape
+    packed = np.ndarray((num_users, num_genres), dtype=np.float64, buffer=packed_buffer)
+    if layout == 'dense':
+        output = np.ndarray((num_users, num_users), dtype=np.float64, buffer=output_buffer)
+        output[start:end] = packed[start:end] @ packed.T
+    else:
+        matrix = TriangularAffinityMatrix.from_buffer(num_users, dtype, output_buffer)
+        matrix.fill_columns(start, packed[start:end] @ packed[:end].T)
+
+
+def _compute_block(packed_spec: tuple, output_spec: tuple, start: int, end: int):
+    # Runs in a worker process: the preferences are attached by the name of
+    # their shared memory block and the result is mapped from its file, so
+    # only their names and shapes are pickled.
+    packed_name, num_users, num_genres = packed_spec
+    output_path, output_size, layout, dtype = output_spec
+    packed_memory = SharedMemory(name=packed_name)
+    try:
+        output = np.memmap(output_path, dtype=np.uint8, mode='r+', shape=output_size)
+        _fill_block(packed_memory.buf, output, (num_users, num_genres), layout, dtype,
+                    start, end)
+        del output
+    finally:
+        packed_memory.close()
+
+
+def build_affinities_parallel(packed: np.ndarray, layout: str = 'dense', workers: int = 2,
+                              block_size: int = TriangularAffinityMatrix.DEFAULT_BLOCK_SIZE,
+                              dtype: str = 'float32'):
+    """
+    Compute the affinity of every pair of users in a pool of processes.
+
+    The packed preferences are placed in shared memory and the result in a
+    temporary file mapped by every process, and every worker computes a
+    block of block_size rows (or columns of the triangle) writing straight
+    into the result, so no array is pickled. The matrix returned is backed
+    by that mapping rather than copied out of it, and the file is removed as
+    soon as the build ends.
+
+    Parameters
+    ----------
+    packed : np.ndarray
+        Users x genres matrix with the normalized preferences of every user.
+    layout : str
+        'dense' to obtain the full users x users matrix or 'triangular' to
+        obtain a TriangularAffinityMatrix.
+    workers : int
+        Number of worker processes.
+    block_size : int
+        Number of rows computed by every task.
+    dtype : str
+        Floating point type of the affinities when layout is 'triangular'.
+
+    Returns
+    -------
+    np.ndarray or TriangularAffinityMatrix
+        Matrix with the affinity of every pair of users. The diagonal of the
+        dense matrix is set to 1.
+
+    Raises
+    ------
+    AffinityStorageError
+        When the layout or the dtype is not valid.
+    """
+    if layout not in ('dense', 'triangular'):
+        raise AffinityStorageError("The layout must be either 'dense' or 'triangular'")
+    if dtype not in TriangularAffinityMatrix.DTYPES:
+        raise AffinityStorageError('The dtype must be one of the following: '
+                                   f'{TriangularAffinityMatrix.DTYPES}')
+
+    num_users, num_genres = packed.shape
+    if layout == 'dense':
+        output_size = num_users * num_users * np.dtype(np.float64).itemsize
+    else:
+        output_size = num_users * (num_users - 1) // 2 * np.dtype(dtype).itemsize
+    output_size = max(output_size, 1)
+
+    descriptor, output_path = tempfile.mkstemp(prefix='affinities.', suffix='.tmp')
+    os.close(descriptor)
+    packed_memory = SharedMemory(create=True, size=max(packed.nbytes, 1))
+    shared_packed = np.ndarray(packed.shape, dtype=np.float64, buffer=packed_memory.buf)
+    try:
+        shared_packed[:] = packed
+        output = np.memmap(output_path, dtype=np.uint8, mode='w+', shape=output_size)
+        packed_spec = (packed_memory.name, num_users, num_genres)
+        output_spec = (output_path, output_size, layout, dtype)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tasks = [executor.submit(_compute_block, packed_spec, output_spec,
+                                     start, min(start + block_size, num_users))
+                     for start in range(0, num_users, block_size)]
+            for task in tasks:
+                task.result()
+
+        if layout == 'dense':
+            result = np.frombuffer(output, dtype=np.float64,
+                                   count=num_users * num_users).reshape(num_users, num_users)
+            np.fill_diagonal(result, 1)
+        else:
+            result = TriangularAffinityMatrix.from_buffer(num_users, dtype, output)
+    finally:
+        # The view must be gone before closing the block, or close would
+        # raise a BufferError hiding any error of the workers.
+        del shared_packed
+        packed_memory.close()
+        packed_memory.unlink()
+        os.remove(output_path)
+    return result
@@ -0,0 +1,288 @@
+"""
+Module with an approximate nearest neighbour index of the users' genre
+preferences, used to find the best matches of a user without scoring every
+other one.
+
+The affinity of two users is the inner product of their normalized genre
+preferences. Every preference vector x is extended with sqrt(M² - |x|²), being
+M the largest norm, and divided by M, so all of them have unit norm and the
+cosine between an extended vector and a query extended with 0 grows with
+their inner product. The extended vectors are hashed by the signs of their
+projections onto random hyperplanes in several tables, and a query only
+scores, exactly, the users that share a bucket with it in any table.
+"""
+
+from collections.abc import Iterable
+
+import numpy as np
+
+from music_matcher.recommendation_engine import RecommendationEngine
+from music_matcher.user import User
+
+
+class ANNIndexError(ValueError):
+    '''Exception that will be raised when the ANNIndex class
+       has encountered a wrong value in the parameters of a method.'''
+
+
+class ANNIndexTypeError(TypeError):
+    '''Exception that will be raised when an ANNIndex method
+       is called using a parameter with a wrong type.'''
+
+
+def _check_int(name: str, value: int, minimum: int, maximum: int = None):
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ANNIndexTypeError(f'The {name} parameter must be of type int, and not {type(value)}')
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ANNIndexError(f'The {name} parameter must be between {minimum} and {maximum}'
+                            if maximum is not None else
+                            f'The {name} parameter must be at least {minimum}')
+
+
+class ANNIndex:
+    '''Random projection LSH index over the genre preferences of the users.
+
+       More tables and probes find more of the exact best matches at the cost
+       of scoring more candidates, while more bits per table make the buckets
+       smaller. The index is not updated with the engine, it has to be built
+       again after adding, updating or removing users.
+
+       Attributes
+       ----------
+       tables : int
+           Number of hash tables.
+       bits : int
+           Number of hyperplanes, and bits of the hash, of every table.
+       probes : int
+           Default number of buckets looked up in every table by a query.
+    '''
+    DEFAULT_TABLES = 16
+    DEFAULT_BITS = 14
+    MAX_BITS = 62
+
+    def __init__(self, usernames: list[str], preferences: np.ndarray,
+                 tables: int = DEFAULT_TABLES, bits: int = DEFAULT_BITS, probes: int = 1,
+                 seed: int = None):
+        """
+        ANNIndex constructor.
+
+        Parameters
+        ----------
+        usernames : list[str]
+            Username of every row of preferences.
+        preferences : np.ndarray
+            users x genres matrix with the normalized genre preferences.
+        tables : int
+            Number of hash tables.
+        bits : int
+            Number of bits of the hash of every table, up to MAX_BITS.
+        probes : int
+            Default number of buckets looked up in every table: the bucket of
+            the query and those whose hash differs in the bits of the
+            hyperplanes closest to it. Up to bits + 1.
+        seed : int
+            Seed of the random hyperplanes.
+
+        Raises
+        ------
+        ANNIndexTypeError
+            When the type of any of the parameters is not the one expected.
+        ANNIndexError
+            When the preferences don't match the usernames or any of the
+            options is not valid.
+        """
+        _check_int('tables', tables, 1)
+        _check_int('bits', bits, 1, self.MAX_BITS)
+        _check_int('probes', probes, 1, bits + 1)
+        preferences = np.asarray(preferences, dtype=np.float64)
+        if preferences.ndim != 2 or len(preferences) != len(usernames):
+            raise ANNIndexError('preferences must be a matrix with a row per username')
+
+        self.tables = tables
+        self.bits = bits
+        self.probes = probes
+        self._usernames = list(usernames)
+        self._index = {username: i for i, username in enumerate(self._usernames)}
+        self._preferences = preferences
+
+        norms = np.linalg.norm(preferences, axis=1)
+        max_norm = norms.max(initial=0.0) or 1.0
+        extended = np.hstack([preferences, np.sqrt(max_norm ** 2 - norms ** 2)[:, None]])
+        extended /= max_norm
+
+        rng = np.random.default_rng(seed)
+        self._planes = rng.standard_normal((tables, bits, extended.shape[1]))
+        self._weights = np.left_shift(np.uint64(1), np.arange(bits, dtype=np.uint64))
+
+        codes = self._hash(np.einsum('tbd,nd->tnb', self._planes, extended))
+        self._order = np.argsort(codes, axis=1, kind='stable')
+        self._codes = np.take_along_axis(codes, self._order, axis=1)
+
+    @classmethod
+    def from_engine(cls, engine: RecommendationEngine, **options):
+        """
+        Build an index over the users of an engine.
+
+        Parameters
+        ----------
+        engine : RecommendationEngine
+            Engine whose preferences are indexed.
+        **options
+            tables, bits, probes and seed, as in the ANNIndex constructor.
+
+        Returns
+        -------
+        ANNIndex
+            The index built.
+        """
+        if not isinstance(engine, RecommendationEngine):
+            raise ANNIndexTypeError(
+                f'The engine must be of type RecommendationEngine, and not {type(engine)}')
+        return cls(engine.usernames, engine.preference_matrix, **options)
+
+    def _hash(self, projections: np.ndarray) -> np.ndarray:
+        return ((projections > 0).astype(np.uint64) * self._weights).sum(axis=-1,
+                                                                        dtype=np.uint64)
+
+    def _candidates(self, vector: np.ndarray, probes: int) -> np.ndarray:
+        norm = np.linalg.norm(vector)
+        query = np.append(vector / norm if norm else vector, 0.0)
+        projections = self._planes @ query
+        codes = self._hash(projections)
+
+        if probes > 1:
+            closest = np.argsort(np.abs(projections), axis=1)[:, :probes - 1]
+            flipped = codes[:, None] ^ self._weights[closest]
+            codes = np.hstack([codes[:, None], flipped])
+        else:
+            codes = codes[:, None]
+
+        buckets = []
+        for table in range(self.tables):
+            starts = np.searchsorted(self._codes[table], codes[table], side='left')
+            ends = np.searchsorted(self._codes[table], codes[table], side='right')
+            buckets.extend(self._order[table, start:end] for start, end in zip(starts, ends))
+        return np.unique(np.concatenate(buckets))
+
+    def query(self, vector: np.ndarray, k: int, probes: int = None,
+              exclude: int = None) -> list[tuple[str, float]]:
+        """
+        Return the users with the highest affinity with a preference vector
+        amongst those that share a bucket with it.
+
+        Parameters
+        ----------
+        vector : np.ndarray
+            Normalized genre preferences, with the same genres as the index.
+        k : int
+            Maximum number of matches returned.
+        probes : int
+            Buckets looked up in every table, the probes of the index by default.
+        exclude : int
+            Row of a user that is never returned.
+
+        Returns
+        -------
+        list[tuple[str, float]]
+            Username and exact affinity of the best candidates, sorted by
+            descending affinity. There may be less than k of them if the
+            buckets looked up hold less users.
+
+        Raises
+        ------
+        ANNIndexTypeError
+            When k or probes are not an int.
+        ANNIndexError
+            When k is lower than 1 or probes is not valid.
+        """
+        _check_int('k', k, 1)
+        probes = self.probes if probes is None else probes
+        _check_int('probes', probes, 1, self.bits + 1)
+
+        vector = np.asarray(vector, dtype=np.float64)
+        candidates = self._candidates(vector, probes)
+        if exclude is not None:
+            candidates = candidates[candidates != exclude]
+        if not candidates.size:
+            return []
+
+        scores = self._preferences[candidates] @ vector
+        k = min(k, len(candidates))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(self._usernames[candidates[j]], float(scores[j])) for j in best]
+
+    def top_matches(self, user: User, k: int, probes: int = None) -> list[tuple[str, float]]:
+        """
+        Return approximately the k users with the highest affinity with a user.
+
+        Parameters
+        ----------
+        user : User
+            Indexed user whose best matches are requested.
+        k : int
+            Maximum number of matches returned.
+        probes : int
+            Buckets looked up in every table, the probes of the index by default.
+
+        Returns
+        -------
+        list[tuple[str, float]]
+            As in query, never including the user itself.
+
+        Raises
+        ------
+        ANNIndexError
+            When the user is not indexed or k or probes are not valid.
+        """
+        if not isinstance(user, User):
+            raise ANNIndexTypeError(f'The user must be of type User, and not {type(user)}')
+        try:
+            i = self._index[user.username]
+        except KeyError as error:
+            raise ANNIndexError(f'The user {user.username} is not indexed') from error
+        return self.query(self._preferences[i], k, probes, exclude=i)
+
+    def __len__(self) -> int:
+        return len(self._usernames)
+
+
+def measure_recall(index: ANNIndex, engine: RecommendationEngine, users: Iterable[User],
+                   k: int, probes: int = None, tolerance: float = 1e-6) -> float:
+    """
+    Measure the fraction of the exact best matches found by an index.
+
+    A match returned by the index counts as found if its affinity is at least
+    the k-th best affinity returned by the engine, so ties are not penalized.
+
+    Parameters
+    ----------
+    index : ANNIndex
+        Index evaluated.
+    engine : RecommendationEngine
+        Engine with the same users, whose top_matches are the exact ones.
+    users : Iterable[User]
+        Users whose best matches are compared.
+    k : int
+        Number of matches requested.
+    probes : int
+        Buckets looked up in every table, the probes of the index by default.
+    tolerance : float
+        Deviation allowed when comparing the affinities of the engine and the
+        index, which may be stored with less precision by the engine.
+
+    Returns
+    -------
+    float
+        Recall of the index, between 0 and 1.
+    """
+    found = expected = 0
+    for user in users:
+        exact = engine.top_matches(user, k)
+        if not exact:
+            continue
+        threshold = exact[-1][1] - tolerance
+        approximate = index.top_matches(user, k, probes)
+        found += min(len(exact), sum(score >= threshold for _, score in approximate))
+        expected += len(exact)
+    return found / expected if expected else 1.0
@@ -0,0 +1,492 @@
+"""
+Module that measures how the building blocks of the recommendations scale
+with the number of users.
+
+Every benchmark run generates synthetic users, modeled on the song factory
+of the tests, at several scales and measures:
+
+    taxonomy      Time to load the genres yaml file, parsing it and from cache.
+    preferences   Time to compute MusicHistory.genre_preferences of every user.
+    construction  Time and peak memory allocated to build a RecommendationEngine.
+    affinity      Latency percentiles of RecommendationEngine.affinity.
+    top_matches   Latency percentiles of RecommendationEngine.top_matches.
+
+The taxonomy, preferences and construction times are the fastest of several
+runs, to keep the noise of the machine out of them.
+
+The results are plain dictionaries that can be written as JSON and compared
+against the results of a previous run, stored as a baseline, to catch
+regressions.
+"""
+
+import json
+import platform
+import time
+import timeit
+import tracemalloc
+from array import array
+from collections.abc import Callable, Iterable
+from datetime import datetime
+from typing import NamedTuple, Union
+
+import numpy as np
+
+from music_matcher.music_history import MusicHistory, SongEntry
+from music_matcher.recommendation_engine import (RecommendationEngine, Taxonomy,
+                                                 clear_taxonomy_cache)
+from music_matcher.song import CompactSong
+from music_matcher.user import User
+
+DEFAULT_GENRES_PATH = 'music_matcher/data/music_genres.yaml'
+DEFAULT_SCALES = (1000, 10000, 100000)
+PERCENTILES = (50, 90, 99)
+RESULTS_VERSION = 1
+# Suffixes of the metrics that are compared against a baseline, where a
+# higher value is worse.
+COMPARED_SUFFIXES = ('_s', '_ms', '_bytes')
+# Seconds a time or latency must grow over the baseline to be a regression,
+# so the jitter of the steps that take less than a millisecond is ignored.
+MIN_DIFFERENCE_S = 1e-3
+# Times every step is measured, keeping the fastest time.
+DEFAULT_REPEAT = 3
+_EPOCH = int(datetime.fromisoformat('2020-01-01').timestamp())
+
+
+class BenchmarkError(ValueError):
+    '''Exception that will be raised when a benchmark has encountered a
+       wrong value in its parameters or in the results compared.'''
+
+
+class Regression(NamedTuple):
+    '''Metric of a scale that got worse than in the baseline.'''
+    scale: str
+    metric: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        '''
+        Return how many times the metric grew.
+
+        Returns
+        -------
+        float
+            Current value divided by the baseline one.
+        '''
+        return self.current / self.baseline if self.baseline else float('inf')
+
+
+def genre_weights(count: int, skew: float) -> np.ndarray:
+    """
+    Return the probability of every genre of a Zipf-like distribution.
+
+    Parameters
+    ----------
+    count : int
+        Number of genres.
+    skew : float
+        Exponent of the distribution. With 0 every genre is equally likely,
+        and the higher it is, the more the first genres are listened to.
+
+    Returns
+    -------
+    np.ndarray
+        Probability of the genre of every rank, adding up to 1.
+
+    Raises
+    ------
+    BenchmarkError
+        When there are no genres or skew is negative.
+    """
+    if count < 1 or skew < 0:
+        raise BenchmarkError('There must be at least one genre and the skew can not be negative')
+    weights = np.arange(1, count + 1, dtype=np.float64) ** -skew
+    return weights / weights.sum()
+
+
+def synthetic_songs(taxonomy: Taxonomy, songs_per_genre: int = 10) -> dict[str, list[CompactSong]]:
+    """
+    Return songs of every genre and subgenre of a taxonomy.
+
+    Parameters
+    ----------
+    taxonomy : Taxonomy
+        Taxonomy whose genres the songs belong to.
+    songs_per_genre : int
+        Number of songs of every genre.
+
+    Returns
+    -------
+    dict[str, list[CompactSong]]
+        Songs of every genre, in the order of Taxonomy.genre_names.
+    """
+    genre_ids = taxonomy.genre_ids
+    return {genre: [CompactSong(f'{genre} song {i}', genre, f'{genre} artist {i % 3}',
+                                1950 + (7*i) % 70, genre_ids)
+                    for i in range(songs_per_genre)]
+            for genre in taxonomy.genre_names}
+
+
+def synthetic_users(taxonomy: Taxonomy, count: int, skew: float = 1.0,
+                    songs_per_user: int = 20, songs_per_genre: int = 10,
+                    seed: int = 0) -> list[User]:
+    """
+    Return users with random music histories.
+
+    Every user listens to songs_per_user songs, although the same song may be
+    drawn more than once, and plays every song a geometrically distributed
+    number of times. The genre of every song follows genre_weights over the
+    genres of the taxonomy, in a random order fixed by the seed.
+
+    Parameters
+    ----------
+    taxonomy : Taxonomy
+        Taxonomy whose genres the songs belong to.
+    count : int
+        Number of users.
+    skew : float
+        Skew of the genres listened, see genre_weights.
+    songs_per_user : int
+        Number of songs drawn for every user.
+    songs_per_genre : int
+        Number of different songs of every genre.
+    seed : int
+        Seed of the random numbers.
+
+    Returns
+    -------
+    list[User]
+        The users generated, with usernames in the order of the list.
+    """
+    rng = np.random.default_rng(seed)
+    songs = list(synthetic_songs(taxonomy, songs_per_genre).values())
+    ranks = rng.permutation(len(songs))
+    genres = ranks[rng.choice(len(songs), size=(count, songs_per_user),
+                              p=genre_weights(len(songs), skew))]
+    indices = rng.integers(songs_per_genre, size=(count, songs_per_user))
+    plays = rng.geometric(0.3, size=(count, songs_per_user))
+
+    users = []
+    for user in range(count):
+        entries = {}
+        for genre, index, amount in zip(genres[user].tolist(), indices[user].tolist(),
+                                        plays[user].tolist()):
+            song = songs[genre][index]
+            times_played = entries.setdefault(song, array('q'))
+            times_played.extend(range(_EPOCH, _EPOCH + amount))
+        history = MusicHistory([SongEntry(song, times_played)
+                                for song, times_played in entries.items()])
+        users.append(User(f'user{user:07d}', '2000-01-01', f'User {user}', 'O', history))
+    return users
+
+
+def latency_percentiles(function: Callable, arguments: Iterable) -> dict[str, float]:
+    """
+    Call a function with every argument and return the percentiles of its latency.
+
+    Parameters
+    ----------
+    function : Callable
+        Function measured, called with a single argument.
+    arguments : Iterable
+        Argument of every call.
+
+    Returns
+    -------
+    dict[str, float]
+        Latency of every percentile in PERCENTILES, as p<percentile>_ms.
+    """
+    latencies = []
+    for argument in arguments:
+        start = time.perf_counter()
+        function(argument)
+        latencies.append(time.perf_counter() - start)
+    values = np.percentile(np.array(latencies) * 1000, PERCENTILES) if latencies \
+        else np.zeros(len(PERCENTILES))
+    return {f'p{percentile}_ms': float(value) for percentile, value in zip(PERCENTILES, values)}
+
+
+def peak_memory(function: Callable) -> int:
+    """
+    Return the peak memory allocated while a function is called.
+
+    The memory is traced by tracemalloc, which also follows the arrays
+    allocated by NumPy, so the function is usually slower than when called
+    without tracing it.
+
+    Parameters
+    ----------
+    function : Callable
+        Function measured, called without arguments.
+
+    Returns
+    -------
+    int
+        Peak of the bytes allocated by the function and not freed yet.
+    """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    return peak - baseline
+
+
+def _elapsed(function: Callable, repeat: int, setup: Callable = lambda: None) -> float:
+    return min(timeit.repeat(function, setup, repeat=repeat, number=1))
+
+
+def benchmark_taxonomy(genres_yaml: str = DEFAULT_GENRES_PATH,
+                       repeat: int = DEFAULT_REPEAT) -> dict[str, float]:
+    """
+    Measure the time to load a genres yaml file.
+
+    Parameters
+    ----------
+    genres_yaml : str
+        Genres yaml file loaded.
+    repeat : int
+        Times every load is measured, keeping the fastest one.
+
+    Returns
+    -------
+    dict[str, float]
+        Seconds to load the file parsing it, load_s, and from the cache of
+        taxonomies, cached_load_s.
+    """
+    load = _elapsed(lambda: RecommendationEngine.load_yaml_file(genres_yaml), repeat,
+                    clear_taxonomy_cache)
+    cached_load = _elapsed(lambda: RecommendationEngine.load_yaml_file(genres_yaml), repeat)
+    return {'load_s': load, 'cached_load_s': cached_load}
+
+
+def benchmark_scale(taxonomy: Taxonomy, count: int, skew: float = 1.0, queries: int = 200,
+                    k: int = 10, storage: str = 'none', seed: int = 0,
+                    repeat: int = DEFAULT_REPEAT) -> dict[str, float]:
+    """
+    Measure the preferences, construction and queries of an engine with synthetic users.
+
+    Parameters
+    ----------
+    taxonomy : Taxonomy
+        Taxonomy used by the users and the engine.
+    count : int
+        Number of users.
+    skew : float
+        Skew of the genres listened, see genre_weights.
+    queries : int
+        Number of affinity and top_matches queries measured.
+    k : int
+        Number of matches requested by every top_matches query.
+    storage : str
+        Storage mode of the engine, one of RecommendationEngine.STORAGE_MODES.
+        'dense' and 'triangular' need memory quadratic in the number of users.
+    seed : int
+        Seed of the users and of the queries.
+    repeat : int
+        Times the preferences and the construction are measured, keeping
+        the fastest one.
+
+    Returns
+    -------
+    dict[str, float]
+        Seconds to compute the genre preferences of every user, preferences_s,
+        and to build the engine, construction_s, peak bytes allocated while
+        building it, construction_peak_bytes, and latency percentiles of the
+        affinity and top_matches queries.
+    """
+    users = synthetic_users(taxonomy, count, skew, seed=seed)
+    results = {
+        'users': count,
+        'preferences_s': _elapsed(lambda: [user.music_history.genre_preferences
+                                           for user in users], repeat),
+    }
+
+    engines = []
+    results['construction_s'] = _elapsed(lambda: engines.append(
+        RecommendationEngine(taxonomy, users, storage=storage)), repeat, engines.clear)
+    engine = engines.pop()
+    results['construction_peak_bytes'] = peak_memory(
+        lambda: RecommendationEngine(taxonomy, users, storage=storage))
+
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(count, size=(queries, 2)).tolist()
+    results.update({f'affinity_{name}': value for name, value in latency_percentiles(
+        engine.affinity, ((users[i], users[j]) for i, j in pairs)).items()})
+    results.update({f'top_matches_{name}': value for name, value in latency_percentiles(
+        lambda user: engine.top_matches(user, k), (users[i] for i, _ in pairs)).items()})
+    return results
+
+
+def run_benchmark(genres_yaml: str = DEFAULT_GENRES_PATH,
+                  scales: Iterable[int] = DEFAULT_SCALES, skew: float = 1.0,
+                  queries: int = 200, k: int = 10, storage: str = 'none',
+                  seed: int = 0, repeat: int = DEFAULT_REPEAT) -> dict:
+    """
+    Run every benchmark.
+
+    Parameters
+    ----------
+    genres_yaml : str
+        Genres yaml file used by the users and the engines.
+    scales : Iterable[int]
+        Numbers of users measured.
+    skew, queries, k, storage, seed, repeat
+        Same as in benchmark_scale.
+
+    Returns
+    -------
+    dict
+        Options of the run, versions of Python and NumPy, results of
+        benchmark_taxonomy under 'taxonomy' and results of benchmark_scale
+        of every scale under 'scales', keyed by the number of users as str.
+
+    Raises
+    ------
+    BenchmarkError
+        When any scale is lower than RecommendationEngine.MIN_NUM_USERS.
+    """
+    scales = list(scales)
+    if any(scale < RecommendationEngine.MIN_NUM_USERS for scale in scales):
+        raise BenchmarkError('Every scale must have at least '
+                             f'{RecommendationEngine.MIN_NUM_USERS} users')
+    taxonomy_results = benchmark_taxonomy(genres_yaml, repeat)
+    taxonomy = RecommendationEngine.load_yaml_file(genres_yaml)
+    return {
+        'version': RESULTS_VERSION,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'options': {'genres_yaml': genres_yaml, 'skew': skew, 'queries': queries, 'k': k,
+                    'storage': storage, 'seed': seed, 'repeat': repeat},
+        'taxonomy': taxonomy_results,
+        'scales': {str(scale): benchmark_scale(taxonomy, scale, skew, queries, k, storage, seed,
+                                               repeat)
+                   for scale in scales},
+    }
+
+
+def save_results(results: dict, path: str):
+    """
+    Write the results of a benchmark as JSON.
+
+    Parameters
+    ----------
+    results : dict
+        Results returned by run_benchmark.
+    path : str
+        Path of the file written.
+    """
+    with open(path, 'w', encoding='utf-8') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+        results_file.write('\n')
+
+
+def load_results(path: str) -> dict:
+    """
+    Read the results of a benchmark written by save_results.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file read.
+
+    Returns
+    -------
+    dict
+        The results.
+
+    Raises
+    ------
+    BenchmarkError
+        When the file doesn't hold results of a compatible version.
+    """
+    with open(path, 'r', encoding='utf-8') as results_file:
+        results = json.load(results_file)
+    if not isinstance(results, dict) or results.get('version') != RESULTS_VERSION:
+        raise BenchmarkError(f'The {path} file does not hold results of version {RESULTS_VERSION}')
+    return results
+
+
+def _metrics(results: dict) -> dict[tuple[str, str], float]:
+    sections = {'taxonomy': results.get('taxonomy', {}), **results.get('scales', {})}
+    return {(section, metric): value
+            for section, metrics in sections.items() for metric, value in metrics.items()
+            if metric.endswith(COMPARED_SUFFIXES)}
+
+
+def compare_results(results: dict, baseline: dict, tolerance: float = 0.25,
+                    min_difference: float = MIN_DIFFERENCE_S) -> list[Regression]:
+    """
+    Return the metrics that got worse than in a baseline.
+
+    Only the times, latencies and memory measured in both results are compared.
+
+    Parameters
+    ----------
+    results : dict
+        Results of the current run.
+    baseline : dict
+        Results of a previous run.
+    tolerance : float
+        Fraction a metric can grow over the baseline before it's a regression.
+    min_difference : float
+        Seconds a time or latency must also grow over the baseline before
+        it's a regression.
+
+    Returns
+    -------
+    list[Regression]
+        Every metric that grew more than the tolerance, sorted by scale and metric.
+
+    Raises
+    ------
+    BenchmarkError
+        When the tolerance or the minimum difference is negative.
+    """
+    if tolerance < 0 or min_difference < 0:
+        raise BenchmarkError('The tolerance and the minimum difference can not be negative')
+    current, previous = _metrics(results), _metrics(baseline)
+    regressions = []
+    for (section, metric), value in sorted(current.items()):
+        before = previous.get((section, metric))
+        if metric.endswith('_ms'):
+            floor = min_difference * 1000
+        else:
+            floor = min_difference if metric.endswith('_s') else 0
+        if before is not None and value > before * (1 + tolerance) and value - before > floor:
+            regressions.append(Regression(section, metric, before, value))
+    return regressions
+
+
+def format_results(results: dict, regressions: Union[list[Regression], None] = None) -> str:
+    """
+    Return a readable summary of the results of a benchmark.
+
+    Parameters
+    ----------
+    results : dict
+        Results returned by run_benchmark.
+    regressions : list[Regression]
+        Regressions found by compare_results, listed after the results.
+
+    Returns
+    -------
+    str
+        One line per metric and regression.
+    """
+    lines = [f'taxonomy {metric}: {value:.6f}'
+             for metric, value in sorted(results['taxonomy'].items())]
+    for scale, metrics in results['scales'].items():
+        lines.extend(f'{scale} users {metric}: {value:.6g}'
+                     for metric, value in sorted(metrics.items()) if metric != 'users')
+    lines.extend(f'REGRESSION {regression.scale} {regression.metric}: {regression.baseline:.6g}'
+                 f' -> {regression.current:.6g} (x{regression.ratio:.2f})'
+                 for regression in regressions or [])
+    return '\n'.join(lines)
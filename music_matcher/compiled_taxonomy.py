@@ -0,0 +1,205 @@
+"""
+Module that compiles genres yaml files into a binary format that can be
+loaded without parsing any yaml.
+
+The compiled file is laid out as follows, with every integer stored in
+little-endian byte order and every section aligned to 4 bytes:
+
+    magic         8 bytes, MAGIC
+    header        4 uint32: version size, number of names, number of basic
+                  genres and number of subgenre -> parent pairs
+    version       utf-8 encoded version of the taxonomy
+    name offsets  uint32[names + 1], offset of every name in the name table
+    name table    utf-8 encoded names of the genres and subgenres, indexed by
+                  their id as in Taxonomy.genre_names
+    parents       uint32[pairs, 2], id of every subgenre and of its basic genre
+"""
+
+import mmap
+import re
+import struct
+
+import numpy as np
+from yaml import safe_load, YAMLError
+
+from music_matcher.recommendation_engine import (Genre, RecommendationEngine, RecommendationError,
+                                                 RecommendationFileError,
+                                                 RecommendationParsingError, Taxonomy)
+
+MAGIC = b'MMTAX\x00\x01\x00'
+_HEADER = struct.Struct('<4I')
+_VERSION_LINE = re.compile(r'^version\s*:')
+
+
+def _padding(size: int) -> bytes:
+    return b'\x00' * (-size % 4)
+
+
+def _version_string(version) -> str:
+    return str(version)
+
+
+def compile_taxonomy(genres_yaml: str, compiled_path: str) -> Taxonomy:
+    """
+    Compile a genres yaml file into the binary format.
+
+    Parameters
+    ----------
+    genres_yaml : str
+        Path of the genres yaml file.
+    compiled_path : str
+        Path where the compiled taxonomy will be written.
+
+    Returns
+    -------
+    Taxonomy
+        The taxonomy compiled.
+
+    Raises
+    ------
+    RecommendationParsingError
+        When the format of the genres_yaml file is not valid.
+    RecommendationFileError
+        When any of the files could not be opened.
+    """
+    taxonomy = RecommendationEngine.load_yaml_file(genres_yaml)
+    names = taxonomy.genre_names
+    ids = taxonomy.genre_ids
+
+    version = _version_string(taxonomy.version).encode('utf-8')
+    encoded_names = [name.encode('utf-8') for name in names]
+    offsets = np.cumsum([0] + [len(name) for name in encoded_names], dtype='<u4')
+    name_table = b''.join(encoded_names)
+    parents = np.array(sorted((ids[subgenre], ids[genre.basic_genre])
+                              for genre in taxonomy.genres for subgenre in genre.subgenres),
+                       dtype='<u4').reshape(-1, 2)
+
+    try:
+        with open(compiled_path, 'wb') as compiled_file:
+            compiled_file.write(MAGIC)
+            compiled_file.write(_HEADER.pack(len(version), len(names),
+                                             len(taxonomy.genres), len(parents)))
+            compiled_file.write(version + _padding(len(version)))
+            compiled_file.write(offsets.tobytes())
+            compiled_file.write(name_table + _padding(len(name_table)))
+            compiled_file.write(parents.tobytes())
+    except OSError as error:
+        raise RecommendationFileError(f'Error while writing the {compiled_path}'
+                                      f' file: {error}') from error
+    return taxonomy
+
+
+def _read_sections(buffer) -> tuple[str, list[str], int, list[list[int]]]:
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise RecommendationParsingError('The file is not a compiled taxonomy')
+
+    position = len(MAGIC)
+    version_size, names_count, basic_count, parents_count = _HEADER.unpack_from(buffer, position)
+    position += _HEADER.size
+    version = bytes(buffer[position:position + version_size]).decode('utf-8')
+    position += version_size + len(_padding(version_size))
+
+    offsets = np.frombuffer(buffer, dtype='<u4', count=names_count + 1, offset=position).tolist()
+    position += 4 * (names_count + 1)
+    name_table = bytes(buffer[position:position + offsets[-1]])
+    names = [name_table[begin:end].decode('utf-8') for begin, end in zip(offsets, offsets[1:])]
+    position += offsets[-1] + len(_padding(offsets[-1]))
+
+    parents = np.frombuffer(buffer, dtype='<u4', count=2 * parents_count,
+                            offset=position).reshape(-1, 2).tolist()
+    return version, names, basic_count, parents
+
+
+def read_yaml_version(genres_yaml: str) -> str:
+    """
+    Return the version of a genres yaml file as compile_taxonomy writes it.
+
+    Only the line of the top level 'version' key is parsed, so the rest of
+    the file is never loaded.
+
+    Parameters
+    ----------
+    genres_yaml : str
+        Path of the genres yaml file.
+
+    Returns
+    -------
+    str
+        Version of the file.
+
+    Raises
+    ------
+    RecommendationParsingError
+        When the file has no valid version key.
+    RecommendationFileError
+        When the file could not be opened.
+    """
+    try:
+        with open(genres_yaml, 'r', encoding='utf-8') as genres_file:
+            for line in genres_file:
+                if _VERSION_LINE.match(line):
+                    return _version_string(safe_load(line)['version'])
+    except OSError as error:
+        raise RecommendationFileError(f'Error while opening the {genres_yaml}'
+                                      f' file: {error}') from error
+    except YAMLError as error:
+        raise RecommendationParsingError(
+            f'Error while loading the version of the {genres_yaml} file: {error}') from error
+    raise RecommendationParsingError(f'The {genres_yaml} file has no version key')
+
+
+def load_compiled_taxonomy(compiled_path: str, genres_yaml: str = None) -> Taxonomy:
+    """
+    Load a taxonomy compiled with compile_taxonomy.
+
+    The file is memory-mapped and read without parsing any yaml, apart from
+    the line with the version of genres_yaml when it's given.
+
+    Parameters
+    ----------
+    compiled_path : str
+        Path of the compiled taxonomy.
+    genres_yaml : str
+        Path of the genres yaml file the taxonomy was compiled from. If it's
+        given, the version of the compiled taxonomy must match its version,
+        as read by read_yaml_version.
+
+    Returns
+    -------
+    Taxonomy
+        The taxonomy loaded.
+
+    Raises
+    ------
+    RecommendationParsingError
+        When the compiled file is not valid or the genres_yaml file has no
+        valid version key.
+    RecommendationFileError
+        When any of the files could not be opened.
+    RecommendationError
+        When the version of the compiled taxonomy doesn't match the version
+        of the genres_yaml file.
+    """
+    try:
+        with open(compiled_path, 'rb') as compiled_file, \
+                mmap.mmap(compiled_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            version, names, basic_count, parents = _read_sections(buffer)
+    except (struct.error, ValueError, IndexError) as error:
+        raise RecommendationParsingError(
+            f'Error while loading the {compiled_path} file: {error}') from error
+    except OSError as error:
+        raise RecommendationFileError(f'Error while opening the {compiled_path}'
+                                      f' file: {error}') from error
+
+    if genres_yaml is not None:
+        yaml_version = read_yaml_version(genres_yaml)
+        if yaml_version != version:
+            raise RecommendationError(
+                f'The version of the compiled taxonomy {version} does not match '
+                f'the version of the {genres_yaml} file {yaml_version}')
+
+    subgenres = [set() for _ in range(basic_count)]
+    for subgenre, basic_genre in parents:
+        subgenres[basic_genre].add(names[subgenre])
+    genres = frozenset(Genre(names[i], frozenset(subgenres[i])) for i in range(basic_count))
+    return Taxonomy(genres, version)
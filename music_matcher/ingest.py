@@ -0,0 +1,207 @@
+"""
+Module that reads exports of the songs played by the users and turns them
+into genre preferences without building User, MusicHistory or Song objects.
+
+Every row of an export is a reproduction (or several of them) of a song by
+a user. JSON Lines exports have an object per line and CSV exports a header
+row, both with the following fields:
+
+    username  Username of the user who played the song.
+    genre     Music genre of the song, or several of them separated by ';'.
+    plays     Optional, number of times the song was played. Defaults to 1.
+
+Any other field, such as the title, artist, year or timestamp of the song,
+is ignored. Files whose content is compressed with gzip are decompressed
+transparently.
+"""
+
+import csv
+import gzip
+import io
+import json
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from typing import NamedTuple, Union
+
+from music_matcher.music_history import attribute_reproductions
+from music_matcher.recommendation_engine import RecommendationEngine, Taxonomy
+from music_matcher.song import split_genres
+
+FORMATS = ('jsonl', 'csv')
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+class IngestError(ValueError):
+    '''Exception that will be raised when an export has encountered a
+       wrong value while being read.'''
+
+
+class Play(NamedTuple):
+    '''Reproductions of a song of a genre by a user.'''
+    username: str
+    genre: str
+    plays: int
+
+
+def _guess_format(path: str) -> str:
+    name = path[:-len('.gz')] if path.endswith('.gz') else path
+    if name.endswith(('.jsonl', '.json', '.ndjson')):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    raise IngestError(f'The format of the {path} file could not be guessed from its name')
+
+
+def _open_text(path: str) -> io.TextIOBase:
+    with open(path, 'rb') as raw_file:
+        compressed = raw_file.read(len(_GZIP_MAGIC)) == _GZIP_MAGIC
+    if compressed:
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')  # pylint: disable=consider-using-with
+
+
+def _to_play(record: dict, line: int) -> Play:
+    try:
+        username, genre = record['username'], record['genre']
+        plays = record.get('plays')
+        plays = 1 if plays in (None, '') else int(plays)
+    except (KeyError, TypeError, ValueError) as error:
+        raise IngestError(f'Wrong record in line {line}: {error}') from error
+    if not isinstance(username, str) or not isinstance(genre, str) or plays < 0:
+        raise IngestError(f'Wrong record in line {line}: {record}')
+    return Play(username, genre, plays)
+
+
+def read_plays(path: str, file_format: str = None) -> Iterator[Play]:
+    """
+    Yield the reproductions of an export, one row at a time.
+
+    Parameters
+    ----------
+    path : str
+        Path of the export, optionally compressed with gzip.
+    file_format : str
+        One of FORMATS. If it's not given, it's guessed from the extension
+        of the file.
+
+    Yields
+    ------
+    Play
+        Username, genre and number of reproductions of every row.
+
+    Raises
+    ------
+    IngestError
+        When the format is not valid or any row is wrong.
+    OSError
+        When the file could not be opened.
+    """
+    file_format = file_format or _guess_format(path)
+    if file_format not in FORMATS:
+        raise IngestError(f'The format must be one of the following: {FORMATS}')
+
+    with _open_text(path) as text_file:
+        if file_format == 'csv':
+            for line, record in enumerate(csv.DictReader(text_file), start=2):
+                yield _to_play(record, line)
+            return
+
+        for line, content in enumerate(text_file, start=1):
+            if not content.strip():
+                continue
+            try:
+                record = json.loads(content)
+            except ValueError as error:
+                raise IngestError(f'Wrong JSON in line {line}: {error}') from error
+            if not isinstance(record, dict):
+                raise IngestError(f'Wrong record in line {line}: {record}')
+            yield _to_play(record, line)
+
+
+def _preferences(counts: Counter) -> dict[str:float]:
+    total = sum(counts.values())
+    return {genre: plays/total for genre, plays in counts.items()} if total else {}
+
+
+def aggregate_preferences(plays: Iterable[Play],
+                          grouped: bool = True) -> Iterator[tuple[str, dict[str:float]]]:
+    """
+    Aggregate reproductions into the genre preferences of every user.
+
+    The preferences are computed as in MusicHistory.genre_preferences, so
+    the reproductions of a song with several genres are split evenly among
+    them.
+
+    Parameters
+    ----------
+    plays : Iterable[Play]
+        Reproductions, as yielded by read_plays.
+    grouped : bool
+        If set to True, the reproductions of every user must be contiguous:
+        each user is yielded as soon as the next one starts, so only the
+        genres of one user are held in memory. Otherwise, the genres of every
+        user are counted before yielding any of them.
+
+    Yields
+    ------
+    tuple[str, dict[str:float]]
+        Username and genre preferences of every user.
+
+    Raises
+    ------
+    IngestError
+        When grouped is True and the reproductions of a user are not contiguous.
+    """
+    if not grouped:
+        counts = {}
+        for play in plays:
+            attribute_reproductions(counts.setdefault(play.username, Counter()),
+                                    split_genres(play.genre), play.plays)
+        for username, user_counts in counts.items():
+            yield username, _preferences(user_counts)
+        return
+
+    finished = set()
+    username, user_counts = None, Counter()
+    for play in plays:
+        if play.username != username:
+            if username is not None:
+                finished.add(username)
+                yield username, _preferences(user_counts)
+            if play.username in finished:
+                raise IngestError(f'The reproductions of {play.username} are not contiguous,'
+                                  ' read the file with grouped=False')
+            username, user_counts = play.username, Counter()
+        attribute_reproductions(user_counts, split_genres(play.genre), play.plays)
+    if username is not None:
+        yield username, _preferences(user_counts)
+
+
+def load_engine(genres_yaml: Union[str, Taxonomy], path: str, file_format: str = None,
+                grouped: bool = True, **engine_options) -> RecommendationEngine:
+    """
+    Build a RecommendationEngine straight from an export.
+
+    Parameters
+    ----------
+    genres_yaml : str or Taxonomy
+        Genres yaml file, or Taxonomy, used by the engine.
+    path : str
+        Path of the export, optionally compressed with gzip.
+    file_format : str
+        One of FORMATS, guessed from the extension of the file if not given.
+    grouped : bool
+        If the reproductions of every user are contiguous in the export, see
+        aggregate_preferences.
+    **engine_options
+        Options passed to RecommendationEngine.from_preferences, such as the
+        storage mode.
+
+    Returns
+    -------
+    RecommendationEngine
+        Engine with every user of the export.
+    """
+    return RecommendationEngine.from_preferences(
+        genres_yaml, aggregate_preferences(read_plays(path, file_format), grouped),
+        **engine_options)
@@ -0,0 +1,248 @@
+"""
+Module with opt-in timing hooks for the recommendation pipeline.
+
+The functions decorated with instrumented report how long every call took
+to the recorder enabled, if any. A recorder is any callable that takes the
+name of the operation and its duration in seconds, such as a Stats object,
+which aggregates the durations into histograms that can be dumped as JSON
+or in the Prometheus text format:
+
+    stats = instrumentation.enable()
+    engine = RecommendationEngine(genres_yaml, users)
+    print(stats.to_prometheus())
+    instrumentation.disable()
+
+While no recorder is enabled, every instrumented call only checks that
+there is none before calling the function decorated. Code too hot to be
+decorated can check active_recorder itself, as RecommendationEngine.affinity
+does.
+"""
+
+import json
+import threading
+from bisect import bisect_left
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+
+# Upper bounds, in seconds, of the buckets of the histograms.
+DEFAULT_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3,
+                   2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Recorder = Callable[[str, float], None]
+
+# Recorder enabled, or None while the instrumentation is disabled. It must
+# only be changed through enable and disable.
+active_recorder = None
+
+
+class InstrumentationError(ValueError):
+    '''Exception that will be raised when the instrumentation has
+       encountered a wrong value in the parameters of a function.'''
+
+
+class Stats:
+    '''Histograms of the durations of every operation recorded.
+
+       A Stats object is a recorder: calling it with the name of an operation
+       and a duration adds the duration to the histogram of the operation.
+       It can be called from several threads at once.
+
+       Attributes
+       ----------
+       buckets : tuple[float]
+           Sorted upper bounds of the buckets of the histograms, in seconds.
+    '''
+
+    def __init__(self, buckets: tuple[float] = DEFAULT_BUCKETS):
+        """
+        Stats constructor.
+
+        Parameters
+        ----------
+        buckets : tuple[float]
+            Upper bounds of the buckets of the histograms, in seconds. A last
+            bucket without upper bound is always added.
+
+        Raises
+        ------
+        InstrumentationError
+            When the buckets are empty or not strictly increasing.
+        """
+        buckets = tuple(float(bound) for bound in buckets)
+        if not buckets or any(lower >= upper for lower, upper in zip(buckets, buckets[1:])):
+            raise InstrumentationError('The buckets must be a non empty increasing sequence')
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = {
+                    'count': 0, 'sum': 0.0, 'min': seconds, 'max': seconds,
+                    'buckets': [0] * (len(self.buckets) + 1)}
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['min'] = min(histogram['min'], seconds)
+            histogram['max'] = max(histogram['max'], seconds)
+            histogram['buckets'][bisect_left(self.buckets, seconds)] += 1
+
+    def reset(self):
+        """Forget every duration recorded."""
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self) -> dict[str, dict]:
+        """
+        Return the histograms of every operation recorded.
+
+        Returns
+        -------
+        dict[str, dict]
+            Count, sum, min and max of the durations of every operation, and
+            cumulative count of the durations up to every bucket, keyed by
+            its upper bound as str and '+Inf' for the last one.
+        """
+        bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+        with self._lock:
+            snapshot = {}
+            for name, histogram in sorted(self._histograms.items()):
+                cumulative, buckets = 0, {}
+                for bound, count in zip(bounds, histogram['buckets']):
+                    cumulative += count
+                    buckets[bound] = cumulative
+                snapshot[name] = {'count': histogram['count'], 'sum': histogram['sum'],
+                                  'min': histogram['min'], 'max': histogram['max'],
+                                  'buckets': buckets}
+        return snapshot
+
+    def to_json(self) -> str:
+        """
+        Return the histograms as JSON.
+
+        Returns
+        -------
+        str
+            JSON object returned by snapshot.
+        """
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix: str = 'music_matcher') -> str:
+        """
+        Return the histograms in the Prometheus text exposition format.
+
+        Every operation is a series of a single histogram named
+        <prefix>_duration_seconds, with the name of the operation in the
+        operation label.
+
+        Parameters
+        ----------
+        prefix : str
+            Prefix of the name of the metric.
+
+        Returns
+        -------
+        str
+            The histogram, ending with a line break.
+        """
+        metric = f'{prefix}_duration_seconds'
+        lines = [f'# HELP {metric} Duration of the instrumented operations.',
+                 f'# TYPE {metric} histogram']
+        for name, histogram in self.snapshot().items():
+            label = 'operation="' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+            lines.extend(f'{metric}_bucket{{{label},le="{bound}"}} {count}'
+                         for bound, count in histogram['buckets'].items())
+            lines.append(f'{metric}_sum{{{label}}} {histogram["sum"]!r}')
+            lines.append(f'{metric}_count{{{label}}} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def enable(recorder: Recorder = None) -> Recorder:
+    """
+    Start reporting the duration of every instrumented call to a recorder.
+
+    Parameters
+    ----------
+    recorder : Callable[[str, float], None]
+        Callable that receives the name of every operation and its duration
+        in seconds. A new Stats object by default.
+
+    Returns
+    -------
+    Callable[[str, float], None]
+        The recorder enabled.
+
+    Raises
+    ------
+    InstrumentationError
+        When the recorder is not callable.
+    """
+    global active_recorder  # pylint: disable=global-statement
+    recorder = Stats() if recorder is None else recorder
+    if not callable(recorder):
+        raise InstrumentationError(f'The recorder must be callable, and not {type(recorder)}')
+    active_recorder = recorder
+    return recorder
+
+
+def disable():
+    """Stop reporting the duration of the instrumented calls."""
+    global active_recorder  # pylint: disable=global-statement
+    active_recorder = None
+
+
+@contextmanager
+def recording(recorder: Recorder = None) -> Iterator[Recorder]:
+    """
+    Enable a recorder within a with block, restoring the previous one after it.
+
+    Parameters
+    ----------
+    recorder : Callable[[str, float], None]
+        Recorder enabled, a new Stats object by default.
+
+    Yields
+    ------
+    Callable[[str, float], None]
+        The recorder enabled.
+    """
+    previous = active_recorder
+    try:
+        yield enable(recorder)
+    finally:
+        if previous is None:
+            disable()
+        else:
+            enable(previous)
+
+
+def instrumented(name: str) -> Callable:
+    """
+    Return a decorator that reports the duration of every call of a function.
+
+    Parameters
+    ----------
+    name : str
+        Name of the operation reported.
+
+    Returns
+    -------
+    Callable
+        The decorator.
+    """
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            recorder = active_recorder
+            if recorder is None:
+                return function(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                recorder(name, perf_counter() - start)
+        return wrapper
+    return decorator
@@ -1,8 +1,15 @@
 """Module that represents a user profile."""
-from datetime import datetime
+from array import array
+from collections import Counter
+from collections.abc import Iterable
+from datetime import datetime, timedelta
 from dataclasses import dataclass
+from typing import Union
 
-from music_matcher.song import Song
+import numpy as np
+
+from music_matcher.song import SONG_TYPES, Song
+from music_matcher.song_catalog import SongCatalog
 
 
 class SongEntryTypeError(TypeError):
@@ -12,9 +19,15 @@ class SongEntryTypeError(TypeError):
 
 @dataclass
 class SongEntry:
-    '''Song with metadata to save into a user music history.'''
+    '''Song with metadata to save into a user music history.
+
+       The reproductions can be kept as a list of datetime or, in a compact
+       form, as epoch seconds in an array('q') or a one dimensional int64
+       NumPy array. Compact reproductions are validated by their type code
+       or dtype, without going through every item, and entries are compared
+       by their epoch seconds when any of them is compact.'''
     song: Song
-    times_played: list[datetime]
+    times_played: Union[list[datetime], array, np.ndarray]
 
     def __post_init__(self):
         """Part of the constructor not initialized by the
@@ -25,17 +38,37 @@ class SongEntry:
         SongEntryTypeError
             If any of the parameters has  an incorrect type.
         """
-        if not isinstance(self.song, Song):
-            raise SongEntryTypeError('The type of song must be Song and '
+        if not isinstance(self.song, SONG_TYPES):
+            raise SongEntryTypeError('The type of song must be Song or CompactSong and '
                                      f'not {type(self.song)}')
+        if isinstance(self.times_played, array):
+            if self.times_played.typecode != 'q':
+                raise SongEntryTypeError('The type code of times_played must be q'
+                                         f' and not {self.times_played.typecode}')
+            return
+        if isinstance(self.times_played, np.ndarray):
+            if self.times_played.dtype != np.int64 or self.times_played.ndim != 1:
+                raise SongEntryTypeError('times_played must be a one dimensional int64 array'
+                                         f' and not {self.times_played.dtype}'
+                                         f'[{self.times_played.ndim}D]')
+            return
         if not isinstance(self.times_played, list):
-            raise SongEntryTypeError('The type of times_played must be list'
-                                     f' of datetime and not {type(self.times_played)}')
+            raise SongEntryTypeError('The type of times_played must be list of datetime, '
+                                     f'array or int64 ndarray and not {type(self.times_played)}')
         for timestamp in self.times_played:
             if not isinstance(timestamp, datetime):
                 raise SongEntryTypeError('The type of every item in times_played must be'
                                          f' datetime and not {type(timestamp)}')
 
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, SongEntry):
+            return NotImplemented
+        if self.song != other.song:
+            return False
+        if not self.is_compact and not other.is_compact:
+            return self.times_played == other.times_played
+        return np.array_equal(self.epoch_seconds, other.epoch_seconds)
+
     @property
     def genre(self):
         '''
@@ -48,6 +81,18 @@ class SongEntry:
         '''
         return self.song.genre
 
+    @property
+    def genres(self) -> tuple[str, ...]:
+        '''
+        Return the music genres listed in the genre of the song.
+
+        Returns
+        -------
+        tuple[str, ...]
+            The music genres of the song, split when the song was created.
+        '''
+        return self.song.genres
+
     @property
     def amount_reproductions(self) -> int:
         '''
@@ -60,6 +105,248 @@ class SongEntry:
         '''
         return len(self.times_played)
 
+    @property
+    def is_compact(self) -> bool:
+        '''
+        Return if the reproductions are kept as epoch seconds.
+
+        Returns
+        -------
+        bool
+            True if times_played is an array('q') or an int64 ndarray.
+        '''
+        return not isinstance(self.times_played, list)
+
+    @property
+    def epoch_seconds(self) -> np.ndarray:
+        '''
+        Return the moments when the song was played as epoch seconds.
+
+        Reproductions kept in a NumPy array are returned without being
+        copied, and the ones kept in an array('q') are copied in one go.
+
+        Returns
+        -------
+        np.ndarray
+            int64 array with the epoch seconds of every reproduction.
+        '''
+        if isinstance(self.times_played, np.ndarray):
+            return self.times_played
+        if isinstance(self.times_played, array):
+            return np.frombuffer(self.times_played, dtype=np.int64).copy()
+        return np.fromiter((int(timestamp.timestamp()) for timestamp in self.times_played),
+                           dtype=np.int64, count=len(self.times_played))
+
+    def compact(self):
+        '''
+        Keep the reproductions as an array('q') of epoch seconds.
+
+        The seconds fraction of every reproduction is discarded.
+        '''
+        if not isinstance(self.times_played, array):
+            self.times_played = array('q', self.epoch_seconds.tobytes())
+
+    def add_play(self, timestamp: datetime):
+        '''
+        Register a new reproduction of the song.
+
+        Parameters
+        ----------
+        timestamp : datetime
+            Moment when the song was played. Compact reproductions keep it
+            as epoch seconds, and a NumPy array is turned into an array('q')
+            first, so every reproduction is added in amortized constant time.
+
+        Raises
+        ------
+        SongEntryTypeError
+            If timestamp is not a datetime.
+        '''
+        if not isinstance(timestamp, datetime):
+            raise SongEntryTypeError('The type of timestamp must be'
+                                     f' datetime and not {type(timestamp)}')
+        if isinstance(self.times_played, np.ndarray):
+            self.compact()
+        if isinstance(self.times_played, array):
+            self.times_played.append(int(timestamp.timestamp()))
+        else:
+            self.times_played.append(timestamp)
+
+
+class CatalogEntry:
+    '''Song of a SongCatalog and moments it was played, to save into a user
+       music history.
+
+       Unlike SongEntry, the song is shared with every other entry of the
+       catalog, and the reproductions are always kept as epoch seconds in an
+       array('q').'''
+    __slots__ = ('catalog', 'song_id', 'times_played')
+
+    def __init__(self, catalog: SongCatalog, song_id: int, times_played: array = None):
+        '''
+        CatalogEntry class constructor.
+
+        Parameters
+        ----------
+        catalog : SongCatalog
+            Catalog where the song is registered.
+        song_id : int
+            Id of the song in the catalog.
+        times_played : array
+            array('q') with the epoch seconds of every reproduction of the
+            song, an empty one by default.
+
+        Raises
+        ------
+        SongEntryTypeError
+            If any of the parameters has an incorrect type.
+        SongCatalogError
+            If there is no song with that id in the catalog.
+        '''
+        if not isinstance(catalog, SongCatalog):
+            raise SongEntryTypeError('The type of catalog must be SongCatalog'
+                                     f' and not {type(catalog)}')
+        if times_played is None:
+            times_played = array('q')
+        if not isinstance(times_played, array) or times_played.typecode != 'q':
+            raise SongEntryTypeError("times_played must be an array('q')"
+                                     f' and not {times_played!r}')
+        catalog[song_id]  # pylint: disable=pointless-statement
+        self.catalog = catalog
+        self.song_id = song_id
+        self.times_played = times_played
+
+    @property
+    def song(self):
+        '''
+        Return the song of the entry.
+
+        Returns
+        -------
+        CompactSong
+            The song shared through the catalog.
+        '''
+        return self.catalog[self.song_id]
+
+    @property
+    def genre(self):
+        '''
+        Return the music genre of the song.
+
+        Returns
+        -------
+        str
+            The music genre of the song.
+        '''
+        return self.song.genre
+
+    @property
+    def genres(self) -> tuple[str, ...]:
+        '''
+        Return the music genres listed in the genre of the song.
+
+        Returns
+        -------
+        tuple[str, ...]
+            The music genres of the song, split when the song was created.
+        '''
+        return self.song.genres
+
+    @property
+    def amount_reproductions(self) -> int:
+        '''
+        Return the amount of times the song was played.
+
+        Returns
+        -------
+        int
+            Amount of times the song was played.
+        '''
+        return len(self.times_played)
+
+    @property
+    def is_compact(self) -> bool:
+        '''
+        Return if the reproductions are kept as epoch seconds.
+
+        Returns
+        -------
+        bool
+            Always True.
+        '''
+        return True
+
+    @property
+    def epoch_seconds(self) -> np.ndarray:
+        '''
+        Return the moments when the song was played as epoch seconds.
+
+        Returns
+        -------
+        np.ndarray
+            int64 array with the epoch seconds of every reproduction.
+        '''
+        return np.frombuffer(self.times_played, dtype=np.int64).copy()
+
+    def add_play(self, timestamp: datetime):
+        '''
+        Register a new reproduction of the song.
+
+        Parameters
+        ----------
+        timestamp : datetime
+            Moment when the song was played, kept as epoch seconds.
+
+        Raises
+        ------
+        SongEntryTypeError
+            If timestamp is not a datetime.
+        '''
+        if not isinstance(timestamp, datetime):
+            raise SongEntryTypeError('The type of timestamp must be'
+                                     f' datetime and not {type(timestamp)}')
+        self.times_played.append(int(timestamp.timestamp()))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CatalogEntry):
+            return NotImplemented
+        return (self.catalog, self.song_id, self.times_played) == \
+            (other.catalog, other.song_id, other.times_played)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f'CatalogEntry(song_id={self.song_id}, times_played={self.times_played!r})'
+
+
+ENTRY_TYPES = (SongEntry, CatalogEntry)
+
+
+def attribute_reproductions(counts: Counter, genres: tuple[str, ...], amount):
+    '''
+    Add an amount of reproductions to the counts of some genres.
+
+    Parameters
+    ----------
+    counts : Counter
+        Reproductions per genre, updated in place.
+    genres : tuple[str, ...]
+        Genres of the song played, as returned by split_genres.
+    amount : int or float
+        Reproductions, split evenly among the genres.
+    '''
+    if len(genres) == 1:
+        counts[genres[0]] += amount
+        return
+    share = amount / len(genres)
+    for genre in genres:
+        counts[genre] += share
+
+
+class MusicHistoryError(ValueError):
+    '''Exception that will be raised when the MusicHistory class
+       has encountered a wrong value in the parameters of a method.'''
+
 
 class MusicHistoryTypeError(Exception):
     '''Exception that will be raised when a MusicHistory method
@@ -68,14 +355,25 @@ class MusicHistoryTypeError(Exception):
 
 class MusicHistory:
     '''A class representing the music history of an user.'''
-    def __init__(self, songs_played: list[SongEntry]):
+    def __init__(self, songs_played: list[SongEntry], incremental: bool = False,
+                 catalog: SongCatalog = None):
         '''
         MusicHistory class constructor.
 
             Attributes
             ----------
-            songs_played : list of SongEntry
+            songs_played : list of SongEntry or CatalogEntry
                     List of all songs played by an user.
+            incremental : bool
+                    If set to True, the reproductions per genre and the total
+                    amount of reproductions are kept up to date as entries are
+                    added, so genre_preferences doesn't need to go through
+                    every entry. The entries must then be added through
+                    add_entry instead of modifying them directly.
+            catalog : SongCatalog
+                    If it's given, the songs played are registered in it and
+                    record_play stores them as CatalogEntry, sharing the songs
+                    with every other music history of the catalog.
         '''
         if not isinstance(songs_played, list):
             raise MusicHistoryTypeError(
@@ -83,12 +381,151 @@ class MusicHistory:
                 f' and not {type(songs_played)}')
 
         for song in songs_played:
-            if not isinstance(song, SongEntry):
+            if not isinstance(song, ENTRY_TYPES):
                 raise MusicHistoryTypeError(
-                    'The type of every songs_played item must be SongEntry'
+                    'The type of every songs_played item must be SongEntry or CatalogEntry'
                     f' and not {type(song)}')
+        if catalog is not None and not isinstance(catalog, SongCatalog):
+            raise MusicHistoryTypeError(
+                f'The type of catalog must be SongCatalog and not {type(catalog)}')
 
         self._songs_played = songs_played
+        self._catalog = catalog
+        self._entries = {}
+        for entry in songs_played:
+            self._entries.setdefault(self._entry_key(entry), entry)
+        self._genre_counts = None
+        self._total_entries = 0
+        if incremental:
+            self._genre_counts = self._count_genres()
+            self._total_entries = sum(x.amount_reproductions for x in songs_played)
+
+    @property
+    def incremental(self) -> bool:
+        '''
+        Return whether the reproductions per genre are kept up to date.
+
+        Returns
+        -------
+        bool
+            True if the MusicHistory was created in incremental mode.
+        '''
+        return self._genre_counts is not None
+
+    @property
+    def catalog(self) -> SongCatalog:
+        '''
+        Return the catalog where the songs played are registered.
+
+        Returns
+        -------
+        SongCatalog
+            The catalog, or None if the songs are not shared.
+        '''
+        return self._catalog
+
+    def _song_key(self, song):
+        if self._catalog is None:
+            return song.key
+        return self._catalog.register(song)
+
+    def _entry_key(self, entry):
+        if isinstance(entry, CatalogEntry) and entry.catalog is self._catalog:
+            return entry.song_id
+        return self._song_key(entry.song)
+
+    def _count_genres(self) -> Counter:
+        counts = Counter()
+        for entry in self._songs_played:
+            attribute_reproductions(counts, entry.genres, entry.amount_reproductions)
+        return counts
+
+    def add_entry(self, song_entry: SongEntry):
+        '''
+        Add a new entry to the music history.
+
+        Parameters
+        ----------
+        song_entry : SongEntry or CatalogEntry
+            Entry that will be added.
+
+        Raises
+        ------
+        MusicHistoryTypeError
+            If song_entry is not a SongEntry or CatalogEntry.
+        '''
+        if not isinstance(song_entry, ENTRY_TYPES):
+            raise MusicHistoryTypeError('The type of song_entry must be SongEntry or '
+                                        f'CatalogEntry and not {type(song_entry)}')
+
+        self._songs_played.append(song_entry)
+        self._entries.setdefault(self._entry_key(song_entry), song_entry)
+        if self._genre_counts is not None:
+            attribute_reproductions(self._genre_counts, song_entry.genres,
+                                    song_entry.amount_reproductions)
+            self._total_entries += song_entry.amount_reproductions
+
+    def record_play(self, song: Song, timestamp: datetime):
+        '''
+        Register a new reproduction of a song.
+
+        The entry of the song is found through an index of the songs in the
+        music history, and it's created if the song had never been played.
+        With a catalog, the song is registered in it and the new entry is a
+        CatalogEntry.
+
+        Parameters
+        ----------
+        song : Song or CompactSong
+            Song played.
+        timestamp : datetime
+            Moment when the song was played.
+
+        Raises
+        ------
+        MusicHistoryTypeError
+            If song is not a Song or CompactSong, or timestamp is not a datetime.
+        '''
+        if not isinstance(song, SONG_TYPES):
+            raise MusicHistoryTypeError('The type of song must be Song or CompactSong'
+                                        f' and not {type(song)}')
+        if not isinstance(timestamp, datetime):
+            raise MusicHistoryTypeError(
+                f'The type of timestamp must be datetime and not {type(timestamp)}')
+
+        key = self._song_key(song)
+        entry = self._entries.get(key)
+        if entry is None:
+            if self._catalog is None:
+                entry = SongEntry(song, [timestamp])
+            else:
+                entry = CatalogEntry(self._catalog, key,
+                                     array('q', [int(timestamp.timestamp())]))
+            self._songs_played.append(entry)
+            self._entries[key] = entry
+        else:
+            entry.add_play(timestamp)
+
+        if self._genre_counts is not None:
+            attribute_reproductions(self._genre_counts, entry.genres, 1)
+            self._total_entries += 1
+
+    def record_plays(self, plays: Iterable[tuple[Song, datetime]]):
+        '''
+        Register several reproductions at once.
+
+        Parameters
+        ----------
+        plays : Iterable[tuple[Song, datetime]]
+            Pairs of song played and moment when it was played.
+
+        Raises
+        ------
+        MusicHistoryTypeError
+            If any song is not a Song or any timestamp is not a datetime.
+        '''
+        for song, timestamp in plays:
+            self.record_play(song, timestamp)
 
     def __len__(self) -> int:
         return len(self._songs_played)
@@ -107,7 +544,7 @@ class MusicHistory:
         set[str]
             Set with all the music genres listened by the user.
         '''
-        return {x.genre for x in self._songs_played}
+        return {genre for x in self._songs_played for genre in x.genres}
 
     @property
     def total_entries(self) -> int:
@@ -119,7 +556,9 @@ class MusicHistory:
         int
             Total amount of songs played by the user.
         '''
-        return sum([len(x.times_played) for x in self._songs_played])
+        if self._genre_counts is not None:
+            return self._total_entries
+        return sum(x.amount_reproductions for x in self._songs_played)
 
     @property
     def genre_preferences(self) -> dict[str:float]:
@@ -127,6 +566,9 @@ class MusicHistory:
         Return a dictionary containing information about the music genres
         listened the most by the user.
 
+        The reproductions of a song with several genres are split evenly
+        among them.
+
         Returns
         -------
         dict[str:float]
@@ -134,10 +576,81 @@ class MusicHistory:
             and the value a number representing the percentage of listening
             time that the user spent listening to that genre.
         """
-        total_entries = self.total_entries
-        preferences = {k: 0 for k in self.genres_listened}
-        return dict(map(lambda x: (x[0], sum(
-            [song.amount_reproductions for song in self._songs_played
-             if song.genre == x[0]
-             ])/total_entries), preferences.items())
-            )
+        if self._genre_counts is not None:
+            counts, total_entries = self._genre_counts, self._total_entries
+        else:
+            counts = self._count_genres()
+            total_entries = self.total_entries
+        return {genre: reproductions/total_entries for genre, reproductions in counts.items()}
+
+    def weighted_genre_preferences(self, since: datetime = None, half_life: timedelta = None,
+                                   now: datetime = None) -> dict[str:float]:
+        """
+        Return the genre preferences of the user giving more weight to the
+        latest reproductions.
+
+        The reproductions of every entry are handled as a sorted array of
+        epoch seconds: the window is found through binary search and the
+        decay weights are computed at once for the whole window. The result
+        has the same format as genre_preferences, so it can be given to
+        RecommendationEngine.from_preferences.
+
+        Parameters
+        ----------
+        since : datetime
+            If it's given, only the reproductions from that moment on are
+            taken into account.
+        half_life : timedelta
+            If it's given, every reproduction is weighted by 0.5 ** (age / half_life),
+            being its age the time elapsed from it to now.
+        now : datetime
+            Moment the ages are measured from, the current time by default.
+
+        Returns
+        -------
+        dict[str:float]
+            A dictionary where the key is the name of the music genre
+            and the value the weighted share of reproductions of that genre.
+            It's empty if there are no reproductions in the window.
+
+        Raises
+        ------
+        MusicHistoryTypeError
+            If any of the parameters has an incorrect type.
+        MusicHistoryError
+            If half_life is not positive.
+        """
+        if since is not None and not isinstance(since, datetime):
+            raise MusicHistoryTypeError(f'The type of since must be datetime and not {type(since)}')
+        if half_life is not None and not isinstance(half_life, timedelta):
+            raise MusicHistoryTypeError(
+                f'The type of half_life must be timedelta and not {type(half_life)}')
+        if now is not None and not isinstance(now, datetime):
+            raise MusicHistoryTypeError(f'The type of now must be datetime and not {type(now)}')
+        if half_life is not None and half_life <= timedelta(0):
+            raise MusicHistoryError('half_life must be positive')
+        if since is None and half_life is None:
+            return self.genre_preferences
+
+        start = since.timestamp() if since is not None else None
+        if half_life is not None:
+            now = (now or datetime.now()).timestamp()
+            half_life = half_life.total_seconds()
+
+        weights = Counter()
+        for entry in self._songs_played:
+            seconds = entry.epoch_seconds
+            if seconds.size > 1 and (seconds[1:] < seconds[:-1]).any():
+                seconds = np.sort(seconds)
+            if start is not None:
+                seconds = seconds[np.searchsorted(seconds, start):]
+            if not seconds.size:
+                continue
+            if half_life is not None:
+                weight = float(np.exp2(np.minimum(seconds - now, 0) / half_life).sum())
+            else:
+                weight = seconds.size
+            attribute_reproductions(weights, entry.genres, weight)
+
+        total = sum(weights.values())
+        return {genre: weight/total for genre, weight in weights.items()} if total else {}
@@ -1,9 +1,29 @@
 """Module that represents a RecommendationEngine."""
 
+import json
+import os
+import stat
+import struct
+import tempfile
+from collections.abc import Iterable, Mapping
 from dataclasses import dataclass
+from functools import lru_cache
+from time import perf_counter
+from typing import NamedTuple, Union
 
-from yaml import safe_load, YAMLError
+import numpy as np
+from yaml import load, YAMLError
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
+from music_matcher.affinity_storage import (AffinityCache, CacheInfo, TriangularAffinityMatrix,
+                                            build_affinities_parallel)
+from music_matcher import instrumentation
+from music_matcher.instrumentation import instrumented
+from music_matcher.song import GENRE_SEPARATOR, split_genres
+from music_matcher.sparse_preferences import SparsePreferences
 from music_matcher.user import User
 
 
@@ -37,40 +57,308 @@ class Genre:
     subgenres: frozenset[str]
 
 
+@lru_cache(maxsize=32)
+def build_genre_lookup(genres: frozenset[Genre]) -> dict[str:str]:
+    """
+    Return a dictionary that maps every genre and subgenre to its basic genre.
+
+    A basic genre always maps to itself. When a subgenre belongs to several
+    basic genres, it's mapped to the first one in alphabetical order. The
+    result is cached, so every engine that shares the same set of genres
+    shares the same dictionary too.
+
+    Parameters
+    ----------
+    genres : frozenset[Genre]
+        Genres and subgenres loaded from a genres yaml file.
+
+    Returns
+    -------
+    dict[str:str]
+        Dictionary where the key is the name of a genre or subgenre and the
+        value the name of its basic genre.
+    """
+    lookup = {}
+    for genre in sorted(genres, key=lambda genre: genre.basic_genre, reverse=True):
+        for subgenre in genre.subgenres:
+            lookup[subgenre] = genre.basic_genre
+    lookup.update({genre.basic_genre: genre.basic_genre for genre in genres})
+    return lookup
+
+
+@lru_cache(maxsize=32)
+def _genre_names(genres: frozenset[Genre]) -> tuple[str]:
+    basic_genres = sorted(genre.basic_genre for genre in genres)
+    subgenres = {subgenre for genre in genres for subgenre in genre.subgenres}
+    return tuple(basic_genres + sorted(subgenres.difference(basic_genres)))
+
+
+@lru_cache(maxsize=32)
+def _genre_ids(genres: frozenset[Genre]) -> dict[str:int]:
+    return {name: i for i, name in enumerate(_genre_names(genres))}
+
+
+@lru_cache(maxsize=32)
+def _basic_genre_columns(genres: frozenset[Genre]) -> dict[str:int]:
+    columns = {name: i for i, name in enumerate(sorted(genre.basic_genre for genre in genres))}
+    return {name: columns[basic_genre] for name, basic_genre in build_genre_lookup(genres).items()}
+
+
+@lru_cache(maxsize=32)
+def build_genre_embedding(genres: frozenset[Genre], sibling_weight: float = 0.5) -> np.ndarray:
+    """
+    Return a factor E of the genre similarity kernel K = E·Eᵀ.
+
+    Every genre and subgenre has a row, indexed by its id as in
+    Taxonomy.genre_names, with sqrt(1 - sibling_weight) in its own column and
+    sqrt(sibling_weight / n) in the column of each of the n basic genres it
+    belongs to. So a genre scores 1 with itself, sibling_weight with its
+    basic genre and with the rest of the subgenres of the same basic genre,
+    a fraction of it with subgenres that only share some of their basic
+    genres, and 0 with unrelated ones. Being a product E·Eᵀ, the kernel is
+    positive semidefinite. The result is cached and read-only.
+
+    Parameters
+    ----------
+    genres : frozenset[Genre]
+        Genres and subgenres loaded from a genres yaml file.
+    sibling_weight : float
+        Similarity of two different genres of the same basic genre, between 0 and 1.
+
+    Returns
+    -------
+    np.ndarray
+        genres x (genres + basic genres) matrix.
+    """
+    ids = _genre_ids(genres)
+    basic_genres = sorted(genres, key=lambda genre: genre.basic_genre)
+    groups = {name: [] for name in ids}
+    for column, genre in enumerate(basic_genres, start=len(ids)):
+        for name in genre.subgenres | {genre.basic_genre}:
+            groups[name].append(column)
+
+    embedding = np.zeros((len(ids), len(ids) + len(basic_genres)), dtype=np.float64)
+    embedding[np.arange(len(ids)), np.arange(len(ids))] = np.sqrt(1 - sibling_weight)
+    for name, columns in groups.items():
+        embedding[ids[name], columns] = np.sqrt(sibling_weight / len(columns))
+    embedding.flags.writeable = False
+    return embedding
+
+
+@lru_cache(maxsize=32)
+def build_genre_kernel(genres: frozenset[Genre], sibling_weight: float = 0.5) -> np.ndarray:
+    """
+    Return the similarity of every pair of genres and subgenres.
+
+    Parameters
+    ----------
+    genres : frozenset[Genre]
+        Genres and subgenres loaded from a genres yaml file.
+    sibling_weight : float
+        Similarity of two different genres of the same basic genre.
+
+    Returns
+    -------
+    np.ndarray
+        Read-only genres x genres matrix K = E·Eᵀ, being E the matrix
+        returned by build_genre_embedding, indexed by the genre ids.
+    """
+    embedding = build_genre_embedding(genres, sibling_weight)
+    kernel = embedding @ embedding.T
+    kernel.flags.writeable = False
+    return kernel
+
+
+class Taxonomy(NamedTuple):
+    '''
+    Genres and version loaded from a genres yaml file.
+
+    Attributes
+    ----------
+    genres : frozenset[Genre]
+        Genres and subgenres of the taxonomy.
+    version : str
+        Version of the taxonomy.
+    '''
+    genres: frozenset[Genre]
+    version: str
+
+    @property
+    def basic_genres(self) -> list[str]:
+        '''
+        Return the basic genres of the taxonomy in alphabetical order.
+
+        Returns
+        -------
+        list[str]
+            Names of the basic genres.
+        '''
+        return sorted(genre.basic_genre for genre in self.genres)
+
+    @property
+    def lookup(self) -> dict[str:str]:
+        '''
+        Return the dictionary that maps every genre and subgenre to its basic genre.
+
+        Returns
+        -------
+        dict[str:str]
+            The dictionary returned by build_genre_lookup.
+        '''
+        return build_genre_lookup(self.genres)
+
+    @property
+    def genre_names(self) -> tuple[str]:
+        '''
+        Return every genre and subgenre of the taxonomy, indexed by their id.
+
+        The basic genres come first, in alphabetical order, so the id of a
+        basic genre is also its column in the packed preferences. The rest of
+        the subgenres follow, in alphabetical order too.
+
+        Returns
+        -------
+        tuple[str]
+            Names of the genres and subgenres.
+        '''
+        return _genre_names(self.genres)
+
+    @property
+    def genre_ids(self) -> dict[str:int]:
+        '''
+        Return the id of every genre and subgenre of the taxonomy.
+
+        Returns
+        -------
+        dict[str:int]
+            Dictionary where the key is the name of a genre or subgenre and
+            the value its position in genre_names.
+        '''
+        return _genre_ids(self.genres)
+
+    def kernel(self, sibling_weight: float = 0.5) -> np.ndarray:
+        '''
+        Return the similarity of every pair of genres and subgenres.
+
+        Parameters
+        ----------
+        sibling_weight : float
+            Similarity of two different genres of the same basic genre.
+
+        Returns
+        -------
+        np.ndarray
+            The matrix returned by build_genre_kernel.
+        '''
+        return build_genre_kernel(self.genres, sibling_weight)
+
+
+# Taxonomies already parsed, by real path, along with the modification time
+# and size of the file when it was parsed.
+_TAXONOMY_CACHE: dict[str, tuple[tuple[int, int], Taxonomy]] = {}
+
+
+# Layout of the files written by RecommendationEngine.save: the magic bytes,
+# the size of a JSON header as an uint64 and the header itself, followed by
+# the arrays, aligned so they can be memory-mapped.
+ENGINE_MAGIC = b'MMENG\x00\x01\x00'
+_ENGINE_HEADER_SIZE = struct.Struct('<Q')
+_ENGINE_ALIGNMENT = 64
+
+
+def _align(size: int) -> int:
+    return -(-size // _ENGINE_ALIGNMENT) * _ENGINE_ALIGNMENT
+
+
+def _file_mode(path: str) -> int:
+    # Permissions of the file that will be replaced or, if there's none, the
+    # ones open would create it with, instead of the 0600 of mkstemp.
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def clear_taxonomy_cache():
+    """Forget every taxonomy parsed, so they are read again from their files."""
+    _TAXONOMY_CACHE.clear()
+
+
 class RecommendationEngine:
     """Calculate the affinity of users based on  their most listened genres."""
 
     MIN_NUM_USERS = 2
+    STORAGE_MODES = ('dense', 'none', 'lazy', 'triangular')
+    RESOLUTIONS = ('basic', 'subgenre')
+    DEFAULT_CACHE_SIZE = 65536
 
-    def __init__(self, genres_yaml: str, users: list[User]):
+    def __init__(self, genres_yaml: Union[str, Taxonomy], users: list[User],
+                 storage: str = 'dense',
+                 cache_size: int = DEFAULT_CACHE_SIZE, dtype: str = 'float32',
+                 workers: int = 1,
+                 block_size: int = TriangularAffinityMatrix.DEFAULT_BLOCK_SIZE,
+                 sparse: bool = False, resolution: str = 'basic',
+                 sibling_weight: float = 0.5):
         """
         RecommendationEngine constructor.
 
         Parameters
         ----------
-        genres_yaml : str
+        genres_yaml : str or Taxonomy
             File containing information about the valid genres and their
-            respective subgenres.
+            respective subgenres, or a Taxonomy already loaded from it.
         users : list[User]
             Set contaning the users whose affinity should be calculated.
+        storage : str
+            How the affinities are stored, must be one of STORAGE_MODES.
+            'dense' precomputes the full users x users affinity matrix, while
+            'none' never allocates it and computes every affinity on demand
+            from the packed preferences. 'lazy' does the same but keeps the
+            affinities computed in a bounded LRU cache. 'triangular' precomputes
+            every affinity but only stores the strict upper triangle of the matrix.
+        cache_size : int
+            Maximum number of affinities cached when storage is 'lazy'.
+        dtype : str
+            Floating point type of the affinities stored when storage is
+            'triangular', must be one of TriangularAffinityMatrix.DTYPES.
+        workers : int
+            Number of processes used to compute the affinities when storage
+            is 'dense' or 'triangular'. With more than one worker, the
+            affinities are computed by blocks of rows in a process pool that
+            shares the packed preferences through shared memory.
+        block_size : int
+            Number of rows of the affinity matrix computed at once.
+        sparse : bool
+            If set to True, the preferences are stored as a SparsePreferences
+            matrix with only the genres listened by every user, and every
+            affinity is computed from the genres that both users listen to.
+            It can't be used with more than one worker.
+        resolution : str
+            Level of the taxonomy the affinities are computed at, must be one
+            of RESOLUTIONS. 'basic' collapses every subgenre into its basic
+            genre, while 'subgenre' keeps them apart and scores every pair of
+            genres with the kernel K of Taxonomy.kernel, so the affinities
+            are P·K·Pᵀ being P the preferences of the users at subgenre level.
+        sibling_weight : float
+            Similarity of two different genres of the same basic genre when
+            resolution is 'subgenre', between 0 and 1.
 
         Raises
         ------
         RecommendationTypeError
             When the type of any of the parameters is not the one expected.
         RecommendationError
-            When the number of users is less than MIN_NUM_USERS.
+            When the number of users is less than MIN_NUM_USERS or the
+            storage mode, cache size, dtype, workers, block size, resolution
+            or sibling weight are not valid.
         """
         if not isinstance(users, list):
             raise RecommendationTypeError(
                 'The users parameter must be of type list,'
                 f' and not {type(users)}')
 
-        if not isinstance(genres_yaml, str):
-            raise RecommendationTypeError(
-                'The genres_yaml parameter must be of type str,'
-                f' and not {type(genres_yaml)}')
-
         for user in users:
             if not isinstance(user, User):
                 raise RecommendationTypeError(
@@ -82,19 +370,273 @@ class RecommendationEngine:
                 'The minimum number of users needed is '
                 f'{RecommendationEngine.MIN_NUM_USERS}')
 
-        self._genres, self._yaml_version = RecommendationEngine.load_yaml_file(genres_yaml)
+        self._configure(storage, cache_size, dtype, workers, block_size, sparse, resolution,
+                        sibling_weight)
+        self._set_taxonomy(genres_yaml)
 
-        self._preferences = [(user.username,
-                              self._normalize_preferences(user.music_history.genre_preferences))
-                             for user in sorted(users)]
+        usernames = []
+        rows = []
+        for user in sorted(users):
+            usernames.append(user.username)
+            rows.append(self._user_vector(user))
+        self._set_users(usernames, self._pack_rows(rows))
 
         self._initialize_affinity_matrix()
 
     @classmethod
-    def load_yaml_file(cls, genres_yaml: str) -> set[Genre]:
+    def from_preferences(cls, genres_yaml: Union[str, Taxonomy],
+                         preferences: Iterable[tuple[str, Mapping[str, float]]],
+                         storage: str = 'dense', cache_size: int = DEFAULT_CACHE_SIZE,
+                         dtype: str = 'float32', workers: int = 1,
+                         block_size: int = TriangularAffinityMatrix.DEFAULT_BLOCK_SIZE,
+                         sparse: bool = False, resolution: str = 'basic',
+                         sibling_weight: float = 0.5):
+        """
+        Return an engine built from the genre preferences of every user.
+
+        The preferences are consumed one user at a time, so they can come
+        from a generator that never holds every user in memory, and only the
+        genre ids and weights of every user are kept until they are packed
+        at once. The rows of the engine follow the order of the preferences.
+
+        Parameters
+        ----------
+        genres_yaml : str or Taxonomy
+            File containing information about the valid genres and their
+            respective subgenres, or a Taxonomy already loaded from it.
+        preferences : Iterable[tuple[str, Mapping[str, float]]]
+            Pairs of username and genre preferences of that user, as returned
+            by MusicHistory.genre_preferences or, to favour their latest
+            reproductions, by MusicHistory.weighted_genre_preferences.
+        storage, cache_size, dtype, workers, block_size, sparse, resolution, sibling_weight
+            Same as in the RecommendationEngine constructor.
+
+        Returns
+        -------
+        RecommendationEngine
+            The engine built.
+
+        Raises
+        ------
+        RecommendationTypeError
+            When the type of any of the parameters is not the one expected.
+        RecommendationError
+            When the number of users is less than MIN_NUM_USERS, any username
+            is repeated or any of the options is not valid.
+        """
+        engine = cls.__new__(cls)
+        engine._configure(storage, cache_size, dtype, workers, block_size, sparse, resolution,
+                          sibling_weight)
+        engine._set_taxonomy(genres_yaml)
+
+        usernames, rows, columns, weights, seen = [], [], [], [], set()
+        lookup = engine._genre_columns()
+        for username, user_preferences in preferences:
+            if not isinstance(username, str) or not isinstance(user_preferences, Mapping):
+                raise RecommendationTypeError(
+                    'Every item in preferences must be a pair of str and Mapping,'
+                    f' and not {type(username)} and {type(user_preferences)}')
+            if username in seen:
+                raise RecommendationError(f'The user {username} is repeated')
+            seen.add(username)
+            row = len(usernames)
+            usernames.append(username)
+            for column, percentage in engine._resolve_preferences(user_preferences, lookup):
+                rows.append(row)
+                columns.append(column)
+                weights.append(percentage)
+
+        if not len(usernames) >= RecommendationEngine.MIN_NUM_USERS:
+            raise RecommendationError(
+                'The minimum number of users needed is '
+                f'{RecommendationEngine.MIN_NUM_USERS}')
+
+        engine._set_users(usernames, engine._pack_coordinates(len(usernames), rows, columns,
+                                                              weights))
+        engine._initialize_affinity_matrix()
+        return engine
+
+    @classmethod
+    def from_matrix(cls, genres_yaml: Union[str, Taxonomy], usernames: Iterable[str],
+                    matrix: np.ndarray, storage: str = 'dense',
+                    cache_size: int = DEFAULT_CACHE_SIZE, dtype: str = 'float32',
+                    workers: int = 1,
+                    block_size: int = TriangularAffinityMatrix.DEFAULT_BLOCK_SIZE,
+                    sparse: bool = False, resolution: str = 'basic',
+                    sibling_weight: float = 0.5):
+        """
+        Return an engine built from a matrix with the genre preferences of every user.
+
+        The matrix is packed as a whole, without going through the
+        preferences of every user.
+
+        Parameters
+        ----------
+        genres_yaml : str or Taxonomy
+            File containing information about the valid genres and their
+            respective subgenres, or a Taxonomy already loaded from it.
+        usernames : Iterable[str]
+            Username of every row of the matrix.
+        matrix : np.ndarray
+            users x genres matrix with the genre preferences of every user.
+            Its columns are the basic genres in alphabetical order, as in
+            Taxonomy.basic_genres, or, when resolution is 'subgenre', every
+            genre and subgenre in the order of Taxonomy.genre_names. The
+            matrix is copied.
+        storage, cache_size, dtype, workers, block_size, sparse, resolution, sibling_weight
+            Same as in the RecommendationEngine constructor.
+
+        Returns
+        -------
+        RecommendationEngine
+            The engine built, with the rows in the order of the matrix.
+
+        Raises
+        ------
+        RecommendationTypeError
+            When the type of any of the parameters is not the one expected.
+        RecommendationError
+            When the number of users is less than MIN_NUM_USERS, any username
+            is repeated, the shape of the matrix doesn't match the usernames
+            and the genres or any of the options is not valid.
+        """
+        engine = cls.__new__(cls)
+        engine._configure(storage, cache_size, dtype, workers, block_size, sparse, resolution,
+                          sibling_weight)
+        engine._set_taxonomy(genres_yaml)
+
+        usernames = list(usernames)
+        for username in usernames:
+            if not isinstance(username, str):
+                raise RecommendationTypeError(
+                    f'Every username must be of type str, and not {type(username)}')
+        if len(set(usernames)) != len(usernames):
+            raise RecommendationError('The usernames are repeated')
+        if not len(usernames) >= RecommendationEngine.MIN_NUM_USERS:
+            raise RecommendationError(
+                'The minimum number of users needed is '
+                f'{RecommendationEngine.MIN_NUM_USERS}')
+
+        try:
+            matrix = np.array(matrix, dtype=np.float64)
+        except (TypeError, ValueError) as error:
+            raise RecommendationTypeError(
+                f'The matrix must be a numeric array: {error}') from error
+        genres = engine._genre_count()
+        if matrix.shape != (len(usernames), genres):
+            raise RecommendationError(
+                f'The matrix must have a row per username and {genres} columns,'
+                f' and not shape {matrix.shape}')
+
+        engine._set_users(usernames, engine._pack_matrix(matrix))
+        engine._initialize_affinity_matrix()
+        return engine
+
+    def _configure(self, storage: str, cache_size: int, dtype: str, workers: int,
+                   block_size: int, sparse: bool = False, resolution: str = 'basic',
+                   sibling_weight: float = 0.5):
+        if not isinstance(storage, str):
+            raise RecommendationTypeError(
+                'The storage parameter must be of type str,'
+                f' and not {type(storage)}')
+
+        if storage not in RecommendationEngine.STORAGE_MODES:
+            raise RecommendationError(
+                'The storage mode must be one of the following: '
+                f'{RecommendationEngine.STORAGE_MODES}')
+        self._storage = storage
+
+        RecommendationEngine._check_int('cache_size', cache_size, 0)
+        self._cache = AffinityCache(cache_size) if storage == 'lazy' else None
+
+        if not isinstance(dtype, str):
+            raise RecommendationTypeError(
+                'The dtype parameter must be of type str,'
+                f' and not {type(dtype)}')
+
+        if dtype not in TriangularAffinityMatrix.DTYPES:
+            raise RecommendationError(
+                'The dtype must be one of the following: '
+                f'{TriangularAffinityMatrix.DTYPES}')
+        self._dtype = dtype
+
+        RecommendationEngine._check_int('workers', workers, 1)
+        RecommendationEngine._check_int('block_size', block_size, 1)
+        self._workers = workers
+        self._block_size = block_size
+
+        if not isinstance(sparse, bool):
+            raise RecommendationTypeError(
+                'The sparse parameter must be of type bool,'
+                f' and not {type(sparse)}')
+        if sparse and workers > 1:
+            raise RecommendationError('Sparse preferences can only be used with one worker')
+        self._sparse = sparse
+
+        if not isinstance(resolution, str):
+            raise RecommendationTypeError(
+                'The resolution parameter must be of type str,'
+                f' and not {type(resolution)}')
+        if resolution not in RecommendationEngine.RESOLUTIONS:
+            raise RecommendationError(
+                'The resolution must be one of the following: '
+                f'{RecommendationEngine.RESOLUTIONS}')
+        self._resolution = resolution
+
+        if not isinstance(sibling_weight, (int, float)) or isinstance(sibling_weight, bool):
+            raise RecommendationTypeError(
+                'The sibling_weight parameter must be of type float,'
+                f' and not {type(sibling_weight)}')
+        if not 0 <= sibling_weight <= 1:
+            raise RecommendationError('The sibling_weight must be between 0 and 1')
+        self._sibling_weight = float(sibling_weight)
+
+    def _set_taxonomy(self, genres_yaml: Union[str, Taxonomy]):
+        if not isinstance(genres_yaml, (str, Taxonomy)):
+            raise RecommendationTypeError(
+                'The genres_yaml parameter must be of type str or Taxonomy,'
+                f' and not {type(genres_yaml)}')
+
+        if isinstance(genres_yaml, Taxonomy):
+            self._taxonomy = genres_yaml
+        else:
+            self._taxonomy = RecommendationEngine.load_yaml_file(genres_yaml)
+        self._genres, self._yaml_version = self._taxonomy
+        self._genre_names = self._taxonomy.basic_genres
+        if self._resolution == 'subgenre':
+            self._embedding = build_genre_embedding(frozenset(self._genres),
+                                                    self._sibling_weight)
+            self._columns = self._embedding.shape[1]
+        else:
+            self._embedding = None
+            self._columns = len(self._genre_names)
+
+    def _set_users(self, usernames: list[str], packed: Union[np.ndarray, SparsePreferences]):
+        self._usernames = usernames
+        self._packed = packed
+        self._index = {}
+        for i, username in enumerate(self._usernames):
+            self._index.setdefault(username, i)
+
+    @staticmethod
+    def _check_int(name: str, value: int, minimum: int):
+        if not isinstance(value, int):
+            raise RecommendationTypeError(
+                f'The {name} parameter must be of type int, and not {type(value)}')
+        if value < minimum:
+            raise RecommendationError(f'The {name} parameter must be at least {minimum}')
+
+    @classmethod
+    @instrumented('load_yaml_file')
+    def load_yaml_file(cls, genres_yaml: str) -> Taxonomy:
         """
         Return a set of Genres and the version of a genres yaml file.
 
+        Every file is parsed once per process: the taxonomy is cached and
+        reused as long as the modification time and size of the file don't
+        change. The lookup table used to normalize the preferences of the
+        users is built along with the genres, see build_genre_lookup.
+
         Parameters
         ----------
         genres_yaml : str
@@ -102,10 +644,9 @@ class RecommendationEngine:
 
         Returns
         -------
-        genres : set[Genres]
-            Set with the genres and subgenres loaded from the file.
-        version : str
-            Version of the genres_yaml file.
+        Taxonomy
+            Named tuple with the set of genres and subgenres loaded from the
+            file and the version of the genres_yaml file.
 
         Raises
         ------
@@ -114,34 +655,66 @@ class RecommendationEngine:
         RecommendationFileError
             When the file could not be opened.
         """
+        try:
+            stat = os.stat(genres_yaml)
+        except OSError as error:
+            raise RecommendationFileError(f'Error while opening the {genres_yaml}'
+                                          f' file: {error}') from error
+
+        path = os.path.realpath(genres_yaml)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = _TAXONOMY_CACHE.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        taxonomy = cls._parse_yaml_file(genres_yaml)
+        _TAXONOMY_CACHE[path] = (signature, taxonomy)
+        return taxonomy
+
+    @classmethod
+    def _parse_yaml_file(cls, genres_yaml: str) -> Taxonomy:
         try:
             with open(genres_yaml, 'r', encoding='utf-8') as genres_file:
-                yaml_file = safe_load(genres_file)
+                yaml_file = load(genres_file, Loader=SafeLoader)
                 try:
-                    genres = {Genre(genre, frozenset(subgenres[0]['subgenres']))
-                              for x in yaml_file['genres']
-                              for genre, subgenres in x.items()}
+                    genres = frozenset(Genre(genre, frozenset(subgenres[0]['subgenres']))
+                                       for x in yaml_file['genres']
+                                       for genre, subgenres in x.items())
                     version = yaml_file['version']
+                    build_genre_lookup(genres)
                 except (TypeError, IndexError) as error:
                     raise RecommendationParsingError(
                         'Error while parsing the yaml file, check that it has '
                         f'a valid syntax: {error}') from error
         except OSError as error:
             raise RecommendationFileError(f'Error while opening the {genres_yaml}'
-                                          ' file: {error}') from error
+                                          f' file: {error}') from error
         except YAMLError as error:
             raise(RecommendationParsingError(
                 f"Error while loading the {genres_yaml} file: {error}")) from error
 
-        return genres, version
+        return Taxonomy(genres, version)
+
+    def _resolve_preferences(self, preferences: Mapping[str, float],
+                             lookup: Mapping[str, Union[str, int]] = None
+                             ) -> Iterable[tuple[Union[str, int], float]]:
+        if lookup is None:
+            lookup = build_genre_lookup(frozenset(self._genres))
+        for user_genre, percentage in preferences.items():
+            target = lookup.get(user_genre)
+            if target is not None:
+                yield target, percentage
+            elif GENRE_SEPARATOR in user_genre:
+                genres = split_genres(user_genre)
+                for genre in genres:
+                    target = lookup.get(genre)
+                    if target is not None:
+                        yield target, percentage / len(genres)
 
     def _normalize_preferences(self, preferences: dict[str:float]) -> dict[str:float]:
         normalized = {genre.basic_genre: 0.0 for genre in self._genres}
-        for user_genre, percentage in preferences.items():
-            for genre in self._genres:
-                if user_genre == genre.basic_genre or user_genre in genre.subgenres:
-                    normalized[genre.basic_genre] += percentage
-                    break
+        for basic_genre, percentage in self._resolve_preferences(preferences):
+            normalized[basic_genre] += percentage
         return normalized
 
     @classmethod
@@ -153,25 +726,191 @@ class RecommendationEngine:
 
         return sum(affinity_list)
 
-    def _initialize_affinity_matrix(self) -> list[list[float]]:
-        num_users = len(self._preferences)
-        self._matrix = [[0] * num_users for _ in range(num_users)]
-        for i in range(num_users):
-            self._matrix[i][i] = 1
-        for i in range(num_users):
-            preference_1 = self._preferences[i]
-            for j in range(i+1, num_users):
-                preference_2 = self._preferences[j]
-                affinity = RecommendationEngine._calculate_affinity(preference_1[1],
-                                                                    preference_2[1])
-                self._matrix[i][j] = affinity
-                self._matrix[j][i] = affinity
+    def _pack_rows(self, rows: list) -> Union[np.ndarray, SparsePreferences]:
+        """
+        Pack the preferences of every user into a users x genres matrix.
+
+        The columns follow the alphabetical order of the basic genres, which is
+        the same order used by _calculate_affinity. When the resolution is
+        'subgenre', the rows are the preferences already multiplied by the
+        genre embedding, see _preferences_vector.
+
+        Parameters
+        ----------
+        rows : list
+            Preferences of every user, in the order of the rows, as returned
+            by _preferences_vector.
+
+        Returns
+        -------
+        np.ndarray or SparsePreferences
+            Matrix where the row i holds the preferences of the user i.
+        """
+        if self._sparse:
+            return SparsePreferences.from_rows(rows, self._columns)
+        return np.array(rows, dtype=np.float64).reshape(len(rows), self._columns)
+
+    def _genre_columns(self) -> Mapping[str, int]:
+        if self._embedding is not None:
+            return self._taxonomy.genre_ids
+        return _basic_genre_columns(frozenset(self._genres))
+
+    def _genre_count(self) -> int:
+        return len(self._genre_names) if self._embedding is None else len(self._embedding)
+
+    def _pack_matrix(self, matrix: np.ndarray) -> Union[np.ndarray, SparsePreferences]:
+        if self._embedding is not None:
+            matrix = matrix @ self._embedding
+        return SparsePreferences.from_dense(matrix) if self._sparse else matrix
+
+    @instrumented('pack_preferences')
+    def _pack_coordinates(self, users: int, rows: list[int], columns: list[int],
+                          weights: list[float]) -> Union[np.ndarray, SparsePreferences]:
+        """
+        Pack the preferences of every user, given as the weight of every
+        genre listened by every user, into a users x genres matrix.
+
+        Parameters
+        ----------
+        users : int
+            Number of users.
+        rows, columns : list[int]
+            User and genre column, as returned by _genre_columns, of every weight.
+        weights : list[float]
+            Weights, added up when a user has several of the same column.
+
+        Returns
+        -------
+        np.ndarray or SparsePreferences
+            Matrix where the row i holds the preferences of the user i, as
+            returned by _pack_rows.
+        """
+        genres = self._genre_count()
+        rows = np.array(rows, dtype=np.int64)
+        columns = np.array(columns, dtype=np.int64)
+        weights = np.array(weights, dtype=np.float64)
+        if self._sparse and self._embedding is None:
+            return SparsePreferences.from_coordinates(rows, columns, weights, (users, genres))
+        matrix = np.bincount(rows * genres + columns, weights=weights,
+                             minlength=users * genres).reshape(users, genres)
+        return self._pack_matrix(matrix)
+
+    @instrumented('build_affinities')
+    def _initialize_affinity_matrix(self):
+        if self._storage in ('none', 'lazy'):
+            self._matrix = None
+            return
+        if self._sparse and self._storage == 'dense':
+            self._matrix = self._packed.gram()
+            np.fill_diagonal(self._matrix, 1)
+            return
+        if self._workers > 1:
+            self._matrix = build_affinities_parallel(self._packed, self._storage, self._workers,
+                                                     self._block_size, self._dtype)
+            return
+        if self._storage == 'triangular':
+            self._matrix = TriangularAffinityMatrix.from_preferences(self._packed, self._dtype,
+                                                                     self._block_size)
+            return
+        # Every affinity is the dot product of two rows of the packed matrix,
+        # so all of them can be obtained at once with P·Pᵀ.
+        self._matrix = self._packed @ self._packed.T
+        np.fill_diagonal(self._matrix, 1)
 
     def _find_index(self, user: User) -> int:
-        for i, elem in enumerate(self._preferences):
-            if user.username == elem[0]:
-                return i
-        raise RecommendationError(f'The user specified {user.username} does not exists.')
+        try:
+            return self._index[user.username]
+        except KeyError as error:
+            raise RecommendationError(
+                f'The user specified {user.username} does not exists.') from error
+
+    def _pair_affinity(self, i: int, j: int) -> float:
+        if self._matrix is not None:
+            return float(self._matrix[i, j])
+        if i == j:
+            return 1.0
+        if self._cache is None:
+            return self._dot(i, j)
+
+        affinity = self._cache.get(i, j)
+        if affinity is None:
+            affinity = self._dot(i, j)
+            self._cache.put(i, j, affinity)
+        return affinity
+
+    def _pairs_affinity(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        if self._matrix is not None:
+            return self._matrix[rows, cols]
+        if self._cache is not None:
+            pairs = zip(rows.tolist(), cols.tolist())
+            return np.fromiter((self._pair_affinity(i, j) for i, j in pairs),
+                               dtype=np.float64, count=len(rows))
+        if self._sparse:
+            computed = self._packed.dots(rows, cols)
+        else:
+            computed = np.einsum('ij,ij->i', self._packed[rows], self._packed[cols])
+        computed[rows == cols] = 1
+        return computed
+
+    def _dot(self, i: int, j: int) -> float:
+        if self._sparse:
+            return self._packed.dot(i, j)
+        return float(self._packed[i] @ self._packed[j])
+
+    def _scores(self, i: int) -> np.ndarray:
+        if self._sparse:
+            return self._packed.row_scores(i)
+        return self._packed @ self._packed[i]
+
+    def _row_scores(self, i: int) -> np.ndarray:
+        if self._matrix is not None:
+            return np.array(self._matrix[i], dtype=np.float64)
+        return self._scores(i)
+
+    @property
+    def usernames(self) -> list[str]:
+        """
+        Return the usernames of the users, in the order of the rows.
+
+        Returns
+        -------
+        list[str]
+            Copy of the usernames.
+        """
+        return list(self._usernames)
+
+    @property
+    def preference_matrix(self) -> np.ndarray:
+        """
+        Return the normalized genre preferences of every user.
+
+        Returns
+        -------
+        np.ndarray
+            Read-only users x basic genres matrix, with a row per user in the
+            order of usernames and the basic genres in alphabetical order.
+            With sparse preferences, it's a dense copy of them. When the
+            resolution is 'subgenre', the columns are the ones of the genre
+            embedding returned by build_genre_embedding.
+        """
+        if self._sparse:
+            return self._packed.to_dense()
+        view = self._packed.view()
+        view.flags.writeable = False
+        return view
+
+    @property
+    def cache_info(self) -> CacheInfo:
+        """
+        Return the statistics of the affinity cache used in the 'lazy' storage mode.
+
+        Returns
+        -------
+        CacheInfo or None
+            Hits, misses, evictions and size of the cache, or None if the
+            engine doesn't use a cache.
+        """
+        return self._cache.info() if self._cache is not None else None
 
     def affinity(self, users: tuple[User, User]) -> float:
         """
@@ -192,11 +931,408 @@ class RecommendationEngine:
         RecommendationError
             When any of the users specified is not amongst the available data.
         """
+        # Checked inline rather than with instrumented, which would double
+        # the cost of the lookups when the instrumentation is disabled.
+        recorder = instrumentation.active_recorder
+        if recorder is not None:
+            start = perf_counter()
         try:
             i = self._find_index(users[0])
             j = self._find_index(users[1])
-            return self._matrix[i][j]
+            affinity = self._pair_affinity(i, j)
 
         except IndexError as error:
             raise RecommendationError('The users specified doesn\'t exist'
                                       f'in the database: {error}') from error
+        if recorder is not None:
+            recorder('affinity', perf_counter() - start)
+        return affinity
+
+    def affinities(self, pairs: Iterable[tuple[User, User]]) -> np.ndarray:
+        """
+        Return the affinity of several pairs of users at once.
+
+        Parameters
+        ----------
+        pairs : Iterable[tuple[User, User]]
+            Pairs of users whose affinity is requested.
+
+        Returns
+        -------
+        np.ndarray
+            Array with the affinity of every pair, in the same order as pairs.
+
+        Raises
+        ------
+        RecommendationError
+            When any of the users specified is not amongst the available data.
+        """
+        rows, cols = [], []
+        for user_1, user_2 in pairs:
+            rows.append(self._find_index(user_1))
+            cols.append(self._find_index(user_2))
+        return self._pairs_affinity(np.array(rows, dtype=np.intp),
+                                    np.array(cols, dtype=np.intp))
+
+    def top_matches(self, user: User, k: int) -> list[tuple[str, float]]:
+        """
+        Return the k users with the highest affinity with a given user.
+
+        The user is scored against every other one and only the k best scores
+        are selected and sorted, so the cost is linear in the number of users.
+
+        Parameters
+        ----------
+        user : User
+            User whose best matches are requested.
+        k : int
+            Maximum number of matches returned.
+
+        Returns
+        -------
+        list[tuple[str, float]]
+            Username and affinity of the best matches, sorted by descending
+            affinity. The user itself is never included.
+
+        Raises
+        ------
+        RecommendationTypeError
+            When k is not an int.
+        RecommendationError
+            When the user is not amongst the available data or k is lower than 1.
+        """
+        if not isinstance(k, int):
+            raise RecommendationTypeError(f'The k parameter must be of type int, and not {type(k)}')
+        if k < 1:
+            raise RecommendationError('The k parameter must be greater than 0')
+
+        i = self._find_index(user)
+        scores = self._row_scores(i)
+        scores[i] = -np.inf
+        k = min(k, len(scores) - 1)
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(self._usernames[j], float(scores[j])) for j in best]
+
+    def _check_user(self, user: User):
+        if not isinstance(user, User):
+            raise RecommendationTypeError(f'The user must be of type User, and not {type(user)}')
+
+    @instrumented('normalize_preferences')
+    def _preferences_vector(self, preferences: Mapping[str, float]):
+        if self._embedding is not None:
+            # With the kernel factored as K = E·Eᵀ, the affinities P·K·Pᵀ are
+            # the products of the rows of P·E, so every storage mode works
+            # with them as with the basic genres.
+            vector = np.zeros(len(self._embedding), dtype=np.float64)
+            for genre_id, percentage in self._resolve_preferences(preferences,
+                                                                  self._taxonomy.genre_ids):
+                vector[genre_id] += percentage
+            vector = vector @ self._embedding
+            if self._sparse:
+                indices = np.flatnonzero(vector)
+                return indices.astype(np.int32), vector[indices]
+            return vector
+        if self._sparse:
+            genre_ids = self._taxonomy.genre_ids
+            weights = {}
+            for basic_genre, percentage in self._resolve_preferences(preferences):
+                genre_id = genre_ids[basic_genre]
+                weights[genre_id] = weights.get(genre_id, 0.0) + percentage
+            indices = sorted(genre_id for genre_id, weight in weights.items() if weight)
+            return (np.array(indices, dtype=np.int32),
+                    np.array([weights[genre_id] for genre_id in indices], dtype=np.float64))
+        normalized = self._normalize_preferences(preferences)
+        return np.array([normalized[genre] for genre in self._genre_names], dtype=np.float64)
+
+    def _user_vector(self, user: User):
+        return self._preferences_vector(user.music_history.genre_preferences)
+
+    def _refresh_affinities(self, i: int):
+        if self._cache is not None:
+            self._cache.discard(i)
+        if self._matrix is None:
+            return
+
+        affinities = self._scores(i)
+        affinities[i] = 1
+        if isinstance(self._matrix, TriangularAffinityMatrix):
+            self._matrix.set_row(i, affinities)
+        else:
+            self._matrix[i, :] = affinities
+            self._matrix[:, i] = affinities
+
+    def update_user(self, user: User):
+        """
+        Recompute the affinities of a user whose music history has changed.
+
+        Only the preferences of the user and their affinities with every
+        other user are recomputed, which takes O(users x genres).
+
+        Parameters
+        ----------
+        user : User
+            User whose music history has changed.
+
+        Raises
+        ------
+        RecommendationTypeError
+            When user is not a User.
+        RecommendationError
+            When the user is not amongst the available data.
+        """
+        self._check_user(user)
+        i = self._find_index(user)
+        if self._sparse:
+            self._packed.set_row(i, *self._user_vector(user))
+        else:
+            self._packed[i] = self._user_vector(user)
+        self._refresh_affinities(i)
+
+    def add_user(self, user: User):
+        """
+        Add a new user to the engine and compute their affinities.
+
+        The preferences of the user are appended to the packed preferences,
+        and only their affinities with the rest of the users are computed.
+        The 'dense' storage mode keeps spare rows and columns that grow
+        geometrically, so the affinity matrix is only copied when they run out.
+
+        Parameters
+        ----------
+        user : User
+            User that will be added.
+
+        Raises
+        ------
+        RecommendationTypeError
+            When user is not a User.
+        RecommendationError
+            When there's already a user with the same username.
+        """
+        self._check_user(user)
+        if user.username in self._index:
+            raise RecommendationError(f'The user specified {user.username} already exists.')
+
+        i = len(self._usernames)
+        if self._sparse:
+            self._packed.append(*self._user_vector(user))
+        else:
+            self._packed = np.vstack((self._packed, self._user_vector(user)))
+        self._usernames.append(user.username)
+        self._index[user.username] = i
+
+        if self._matrix is None:
+            return
+        affinities = self._scores(i)
+        affinities[i] = 1
+        if isinstance(self._matrix, TriangularAffinityMatrix):
+            self._matrix.append(affinities)
+        else:
+            self._append_dense_affinities(affinities)
+
+    def _append_dense_affinities(self, affinities: np.ndarray):
+        # The dense matrix grown by add_user is the top left corner of a
+        # larger buffer, so any other matrix is moved into one first.
+        i = len(self._matrix)
+        buffer = self._matrix.base
+        if not (isinstance(buffer, np.ndarray) and buffer.ndim == 2 and min(buffer.shape) > i
+                and buffer.strides == self._matrix.strides
+                and buffer.ctypes.data == self._matrix.ctypes.data):
+            capacity = max(i + 1, i * 3 // 2)
+            buffer = np.empty((capacity, capacity), dtype=self._matrix.dtype)
+            buffer[:i, :i] = self._matrix
+        self._matrix = buffer[:i + 1, :i + 1]
+        self._matrix[i, :] = affinities
+        self._matrix[:, i] = affinities
+
+    def remove_user(self, username: str):
+        """
+        Remove a user from the engine.
+
+        Parameters
+        ----------
+        username : str
+            Username of the user that will be removed.
+
+        Raises
+        ------
+        RecommendationTypeError
+            When username is not a str.
+        RecommendationError
+            When the user is not amongst the available data or the engine
+            would be left with less than MIN_NUM_USERS.
+        """
+        if not isinstance(username, str):
+            raise RecommendationTypeError(
+                f'The username must be of type str, and not {type(username)}')
+        if username not in self._index:
+            raise RecommendationError(f'The user specified {username} does not exists.')
+        if len(self._usernames) <= RecommendationEngine.MIN_NUM_USERS:
+            raise RecommendationError(
+                'The minimum number of users needed is '
+                f'{RecommendationEngine.MIN_NUM_USERS}')
+
+        i = self._index.pop(username)
+        del self._usernames[i]
+        if self._sparse:
+            self._packed.remove(i)
+        else:
+            self._packed = np.delete(self._packed, i, axis=0)
+        for j in range(i, len(self._usernames)):
+            self._index[self._usernames[j]] = j
+
+        # Every row after i is shifted, so the cached pairs are no longer valid.
+        if self._cache is not None:
+            self._cache.clear()
+        if isinstance(self._matrix, TriangularAffinityMatrix):
+            self._matrix.remove(i)
+        elif self._matrix is not None:
+            self._matrix = np.delete(np.delete(self._matrix, i, axis=0), i, axis=1)
+
+    def save(self, path: str):
+        """
+        Save the engine into a file that can be memory-mapped by open.
+
+        The file holds the packed preferences, the usernames in the order of
+        the rows, the version of the taxonomy, the storage options and, when
+        the storage mode precomputes them, the affinities.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file that will be written.
+
+        Raises
+        ------
+        RecommendationFileError
+            When the file could not be written.
+        """
+        if self._sparse:
+            arrays = dict(self._packed.arrays)
+        else:
+            arrays = {'packed': np.ascontiguousarray(self._packed)}
+        if isinstance(self._matrix, TriangularAffinityMatrix):
+            arrays['affinities'] = self._matrix.buffer
+        elif self._matrix is not None:
+            arrays['affinities'] = np.ascontiguousarray(self._matrix)
+
+        sections, offset = {}, 0
+        for name, array in arrays.items():
+            sections[name] = {'offset': offset, 'dtype': array.dtype.str,
+                              'shape': list(array.shape)}
+            offset = _align(offset + array.nbytes)
+        header = json.dumps({
+            'version': self._yaml_version,
+            'genres': self._genre_names,
+            'storage': self._storage,
+            'dtype': self._dtype,
+            'cache_size': (self._cache.maxsize if self._cache is not None
+                           else RecommendationEngine.DEFAULT_CACHE_SIZE),
+            'sparse': self._sparse,
+            'resolution': self._resolution,
+            'sibling_weight': self._sibling_weight,
+            'usernames': self._usernames,
+            'sections': sections,
+        }).encode('utf-8')
+
+        # The file is written next to path and then moved onto it, so the
+        # engines that have the previous file memory-mapped, this one
+        # included, keep reading it instead of a truncated one.
+        preamble = len(ENGINE_MAGIC) + _ENGINE_HEADER_SIZE.size + len(header)
+        temp_path = None
+        try:
+            descriptor, temp_path = tempfile.mkstemp(
+                prefix=f'.{os.path.basename(path)}.', suffix='.tmp',
+                dir=os.path.dirname(os.path.abspath(path)))
+            with os.fdopen(descriptor, 'wb') as engine_file:
+                engine_file.write(ENGINE_MAGIC)
+                engine_file.write(_ENGINE_HEADER_SIZE.pack(len(header)))
+                engine_file.write(header)
+                engine_file.write(b'\x00' * (_align(preamble) - preamble))
+                for array in arrays.values():
+                    engine_file.write(array.tobytes())
+                    engine_file.write(b'\x00' * (_align(array.nbytes) - array.nbytes))
+            os.chmod(temp_path, _file_mode(path))
+            os.replace(temp_path, path)
+        except OSError as error:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise RecommendationFileError(f'Error while writing the {path}'
+                                          f' file: {error}') from error
+
+    @classmethod
+    def open(cls, path: str, genres_yaml: Union[str, Taxonomy]):
+        """
+        Return an engine saved with save, memory-mapping its arrays.
+
+        The arrays are mapped copy-on-write: they are read from the page
+        cache, shared by every process that opens the same file, and are
+        never written back to it.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file written by save.
+        genres_yaml : str or Taxonomy
+            Genres yaml file, or Taxonomy, that the engine must use. Its
+            version must match the version of the saved engine.
+
+        Returns
+        -------
+        RecommendationEngine
+            The engine saved in the file.
+
+        Raises
+        ------
+        RecommendationFileError
+            When the file could not be opened.
+        RecommendationParsingError
+            When the file was not written by save.
+        RecommendationError
+            When the version or the genres of the taxonomy don't match the
+            ones of the saved engine.
+        """
+        try:
+            with open(path, 'rb') as engine_file:
+                if engine_file.read(len(ENGINE_MAGIC)) != ENGINE_MAGIC:
+                    raise RecommendationParsingError(f'The {path} file is not a saved engine')
+                header_size, = _ENGINE_HEADER_SIZE.unpack(
+                    engine_file.read(_ENGINE_HEADER_SIZE.size))
+                header = json.loads(engine_file.read(header_size).decode('utf-8'))
+        except (struct.error, ValueError) as error:
+            raise RecommendationParsingError(
+                f'Error while loading the {path} file: {error}') from error
+        except OSError as error:
+            raise RecommendationFileError(f'Error while opening the {path}'
+                                          f' file: {error}') from error
+
+        engine = cls.__new__(cls)
+        engine._configure(header['storage'], header['cache_size'], header['dtype'], 1,
+                          TriangularAffinityMatrix.DEFAULT_BLOCK_SIZE, header.get('sparse', False),
+                          header.get('resolution', 'basic'), header.get('sibling_weight', 0.5))
+        engine._set_taxonomy(genres_yaml)
+        if engine._yaml_version != header['version']:
+            raise RecommendationError(
+                f'The version of the saved engine {header["version"]} does not match '
+                f'the version of the genres {engine._yaml_version}')
+        if engine._genre_names != header['genres']:
+            raise RecommendationError('The genres of the saved engine do not match the genres'
+                                      ' of the taxonomy')
+
+        data_start = _align(len(ENGINE_MAGIC) + _ENGINE_HEADER_SIZE.size + header_size)
+        arrays = {name: np.memmap(path, mode='c', dtype=section['dtype'],
+                                  offset=data_start + section['offset'],
+                                  shape=tuple(section['shape']))
+                  for name, section in header['sections'].items()}
+        if engine._sparse:
+            engine._set_users(header['usernames'], SparsePreferences(
+                arrays['indptr'], arrays['indices'], arrays['data'], engine._columns))
+        else:
+            engine._set_users(header['usernames'], arrays['packed'])
+        if engine._storage == 'triangular':
+            engine._matrix = TriangularAffinityMatrix.from_buffer(
+                len(engine._usernames), engine._dtype, arrays['affinities'])
+        else:
+            engine._matrix = arrays.get('affinities')
+        return engine
@@ -2,7 +2,12 @@
 A module that represents all information related to music metadata.
 """
 
-from dataclasses import dataclass
+import sys
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+GENRE_SEPARATOR = ';'
 
 
 class SongError(ValueError):
@@ -15,6 +20,57 @@ class SongTypeError(TypeError):
        is called using a parameter with a wrong type.'''
 
 
+def _validate(title: str, genre: str, artist: str, year: int):
+    """
+    Check the attributes of a song.
+
+    Raises
+    ------
+    SongTypeError
+        If any of the attributes has an incorrect type.
+    SongError
+        If the year is not a valid year.
+    """
+    if not isinstance(title, str):
+        raise SongTypeError('The title must be of str type')
+
+    if not isinstance(genre, str):
+        raise SongTypeError('The genre must be of str type')
+
+    if not isinstance(artist, str):
+        raise SongTypeError('The artist must be of str type')
+
+    if not isinstance(year, int):
+        raise SongTypeError('The year must be of int type')
+    if year < 0:
+        raise SongError('The year attribute must be a valid year')
+
+
+@lru_cache(maxsize=65536)
+def split_genres(genre: str) -> tuple[str, ...]:
+    """
+    Split a string with genres separated by GENRE_SEPARATOR.
+
+    The genres are stripped and interned, and the result is cached, so every
+    song with the same genre string shares the same tuple and it's only
+    split once.
+
+    Parameters
+    ----------
+    genre : str
+        Genres separated by GENRE_SEPARATOR.
+
+    Returns
+    -------
+    tuple[str, ...]
+        Genres listed, without repetitions and in the same order. If none is
+        listed, the genre string itself.
+    """
+    genres = dict.fromkeys(sys.intern(name.strip()) for name in genre.split(GENRE_SEPARATOR)
+                           if name.strip())
+    return tuple(genres) or (sys.intern(genre),)
+
+
 @dataclass
 class Song:
     '''A class representing the information of a song.
@@ -30,27 +86,152 @@ class Song:
            The singer or band who composed the song.
        year : int
            The year when the song was released.
+       genres : tuple[str, ...]
+           Genres listed in genre, as returned by split_genres when the song
+           is created.
     '''
     title: str
     genre: str
     artist: str
     year: int
+    genres: tuple[str, ...] = field(init=False, repr=False, compare=False)
 
     def __post_init__(self):
         """Part of the constructor not initialized by the
            dataclass construction.
 
         """
-        if not isinstance(self.title, str):
-            raise SongTypeError('The title must be of str type')
+        _validate(self.title, self.genre, self.artist, self.year)
+        self.genres = split_genres(self.genre)
+
+    @property
+    def key(self) -> tuple[str, str, int]:
+        '''
+        Return the values that identify the song.
+
+        Returns
+        -------
+        tuple[str, str, int]
+            Title, artist and year of the song.
+        '''
+        return (self.title, self.artist, self.year)
+
+
+class CompactSong:
+    '''A memory efficient and immutable representation of a song.
+
+       It has the same attributes and validation as Song, but its instances
+       have no __dict__ and the genre and artist strings are interned, so
+       every song of the same genre or artist shares a single copy of them.
+       Being immutable, its instances can be safely shared and hashed.
+
+       Attributes
+       ----------
+       title : str
+           It's the title of the song.
+       genre : str
+           The song's music genre. It should be a string with genres separated
+           by a ';' symbol.
+       artist : str
+           The singer or band who composed the song.
+       year : int
+           The year when the song was released.
+       genres : tuple[str, ...]
+           Genres listed in genre, as returned by split_genres.
+       genre_id : int
+           Id of the genre in the genre ids given when the song was created,
+           or None if they weren't given or don't include the genre.
+    '''
+    __slots__ = ('title', 'genre', 'artist', 'year', 'genres', 'genre_id')
+    title: str
+    genre: str
+    artist: str
+    year: int
+    genres: tuple[str, ...]
+    genre_id: int
+
+    def __init__(self, title: str, genre: str, artist: str, year: int,
+                 genre_ids: Mapping[str, int] = None):
+        """
+        CompactSong constructor.
+
+        Parameters
+        ----------
+        title, genre, artist, year
+            Same as in Song.
+        genre_ids : Mapping[str, int]
+            Optional mapping from genre names to ids, such as the genre_ids
+            of a Taxonomy, used to resolve the genre_id of the song.
+
+        Raises
+        ------
+        SongTypeError
+            If any of the parameters has an incorrect type.
+        SongError
+            If the year is not a valid year.
+        """
+        _validate(title, genre, artist, year)
+        object.__setattr__(self, 'title', title)
+        object.__setattr__(self, 'genre', sys.intern(genre))
+        object.__setattr__(self, 'artist', sys.intern(artist))
+        object.__setattr__(self, 'year', year)
+        object.__setattr__(self, 'genres', split_genres(genre))
+        object.__setattr__(self, 'genre_id',
+                           genre_ids.get(genre) if genre_ids is not None else None)
+
+    @classmethod
+    def from_song(cls, song: Song, genre_ids: Mapping[str, int] = None):
+        """
+        Return the compact representation of a song.
+
+        Parameters
+        ----------
+        song : Song
+            Song that will be converted.
+        genre_ids : Mapping[str, int]
+            Optional mapping from genre names to ids.
+
+        Returns
+        -------
+        CompactSong
+            Song with the same attributes.
+        """
+        return cls(song.title, song.genre, song.artist, song.year, genre_ids)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'CompactSong is immutable, {name} cannot be set')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'CompactSong is immutable, {name} cannot be deleted')
+
+    def __reduce__(self):
+        genre_ids = None if self.genre_id is None else {self.genre: self.genre_id}
+        return (CompactSong, (self.title, self.genre, self.artist, self.year, genre_ids))
+
+    def __repr__(self) -> str:
+        return (f'CompactSong(title={self.title!r}, genre={self.genre!r}, '
+                f'artist={self.artist!r}, year={self.year!r})')
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, (Song, CompactSong)):
+            return NotImplemented
+        return (self.title, self.genre, self.artist, self.year) == \
+            (other.title, other.genre, other.artist, other.year)
+
+    def __hash__(self) -> int:
+        return hash((self.title, self.genre, self.artist, self.year))
+
+    @property
+    def key(self) -> tuple[str, str, int]:
+        '''
+        Return the values that identify the song.
 
-        if not isinstance(self.genre, str):
-            raise SongTypeError('The genre must be of str type')
+        Returns
+        -------
+        tuple[str, str, int]
+            Title, artist and year of the song.
+        '''
+        return (self.title, self.artist, self.year)
 
-        if not isinstance(self.artist, str):
-            raise SongTypeError('The artist must be of str type')
 
-        if not isinstance(self.year, int):
-            raise SongTypeError('The year must be of int type')
-        if self.year < 0:
-            raise SongError('The year attribute must be a valid year')
+SONG_TYPES = (Song, CompactSong)
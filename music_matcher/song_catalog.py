@@ -0,0 +1,126 @@
+"""Module that keeps a registry of the songs shared by every music history."""
+from collections.abc import Mapping
+from typing import Union
+
+from music_matcher.song import SONG_TYPES, CompactSong, Song
+
+
+class SongCatalogError(ValueError):
+    '''Exception that will be raised when the SongCatalog class
+       has encountered a wrong value in the parameters of a method.'''
+
+
+class SongCatalogTypeError(TypeError):
+    '''Exception that will be raised when a SongCatalog method
+       is called using a parameter with a wrong type.'''
+
+
+class SongCatalog:
+    '''A registry of songs deduplicated by their title, artist and year.
+
+       Every song registered gets an integer id, and the catalog keeps a single
+       immutable CompactSong for it that can be shared by every music history.
+       When songs with the same key but different genres are registered, the
+       genre of the first one is kept.
+    '''
+    def __init__(self, genre_ids: Mapping[str, int] = None):
+        '''
+        SongCatalog class constructor.
+
+            Attributes
+            ----------
+            genre_ids : Mapping[str, int]
+                    Optional mapping from genre names to ids, such as the
+                    genre_ids of a Taxonomy, used to resolve the genre_id of
+                    the songs registered.
+        '''
+        self._genre_ids = genre_ids
+        self._songs = []
+        self._ids = {}
+
+    def register(self, song: Union[Song, CompactSong]) -> int:
+        '''
+        Add a song to the catalog if it wasn't already in it.
+
+        Parameters
+        ----------
+        song : Song or CompactSong
+            Song that will be registered.
+
+        Returns
+        -------
+        int
+            Id of the song in the catalog.
+
+        Raises
+        ------
+        SongCatalogTypeError
+            If song is not a Song or CompactSong.
+        '''
+        if not isinstance(song, SONG_TYPES):
+            raise SongCatalogTypeError('The type of song must be Song or CompactSong'
+                                       f' and not {type(song)}')
+        key = song.key
+        song_id = self._ids.get(key)
+        if song_id is None:
+            song_id = len(self._songs)
+            self._songs.append(CompactSong(song.title, song.genre, song.artist, song.year,
+                                           self._genre_ids))
+            self._ids[key] = song_id
+        return song_id
+
+    def song_id(self, song: Union[Song, CompactSong]) -> int:
+        '''
+        Return the id of a song already registered.
+
+        Parameters
+        ----------
+        song : Song or CompactSong
+            Song whose id will be returned.
+
+        Returns
+        -------
+        int
+            Id of the song in the catalog.
+
+        Raises
+        ------
+        SongCatalogError
+            If the song is not in the catalog.
+        '''
+        try:
+            return self._ids[song.key]
+        except KeyError as error:
+            raise SongCatalogError(f'The song {song} is not in the catalog') from error
+
+    def canonical(self, song: Union[Song, CompactSong]) -> CompactSong:
+        '''
+        Return the shared instance of a song, registering it if needed.
+
+        Parameters
+        ----------
+        song : Song or CompactSong
+            Song whose shared instance will be returned.
+
+        Returns
+        -------
+        CompactSong
+            The instance of the song kept by the catalog.
+        '''
+        return self._songs[self.register(song)]
+
+    def __getitem__(self, song_id: int) -> CompactSong:
+        if not isinstance(song_id, int) or isinstance(song_id, bool):
+            raise SongCatalogTypeError(f'The type of song_id must be int and not {type(song_id)}')
+        if not 0 <= song_id < len(self._songs):
+            raise SongCatalogError(f'There is no song with id {song_id} in the catalog')
+        return self._songs[song_id]
+
+    def __contains__(self, song) -> bool:
+        return isinstance(song, SONG_TYPES) and song.key in self._ids
+
+    def __len__(self) -> int:
+        return len(self._songs)
+
+    def __repr__(self) -> str:
+        return f'SongCatalog({len(self._songs)} songs)'
@@ -0,0 +1,389 @@
+"""
+Module with a sparse representation of the users' genre preferences.
+
+Most users only listen to a few of the genres of a fine-grained taxonomy, so
+their preferences are stored in compressed sparse row (CSR) format: the row
+of the user i holds the ids of the genres it listens to, sorted, in
+indices[indptr[i]:indptr[i + 1]] and their weights in the same positions of
+data. Every affinity is computed from the genres actually listened to.
+"""
+
+from collections.abc import Iterable
+
+import numpy as np
+
+
+class SparsePreferencesError(ValueError):
+    '''Exception that will be raised when the SparsePreferences class
+       has encountered a wrong value in the parameters of a method.'''
+
+
+class SparsePreferences:
+    '''Users x genres matrix of preferences in compressed sparse row format.
+
+       Attributes
+       ----------
+       genres : int
+           Number of columns of the matrix.
+    '''
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, genres: int):
+        """
+        SparsePreferences constructor.
+
+        Parameters
+        ----------
+        indptr : np.ndarray
+            int64 array with the position of the first genre of every row,
+            followed by the number of genres stored.
+        indices : np.ndarray
+            int32 array with the genre ids of every row, sorted within the row.
+        data : np.ndarray
+            float64 array with the weight of every genre id.
+        genres : int
+            Number of columns of the matrix.
+
+        Raises
+        ------
+        SparsePreferencesError
+            When the arrays are not consistent.
+        """
+        if len(indptr) < 1 or indptr[0] != 0 or indptr[-1] != len(indices) \
+                or len(indices) != len(data):
+            raise SparsePreferencesError('The indptr, indices and data arrays are not consistent')
+        self.genres = genres
+        self._indptr = indptr
+        self._indices = indices
+        self._data = data
+        self._row_ids = None
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple[np.ndarray, np.ndarray]], genres: int):
+        """
+        Return the matrix with some rows.
+
+        Parameters
+        ----------
+        rows : Iterable[tuple[np.ndarray, np.ndarray]]
+            Sorted genre ids and weights of every row.
+        genres : int
+            Number of columns of the matrix.
+
+        Returns
+        -------
+        SparsePreferences
+            The matrix built.
+        """
+        indices, data, lengths = [], [], [0]
+        for row_indices, row_data in rows:
+            indices.append(row_indices)
+            data.append(row_data)
+            lengths.append(len(row_indices))
+        return cls(np.cumsum(lengths, dtype=np.int64),
+                   np.concatenate(indices).astype(np.int32) if indices
+                   else np.empty(0, dtype=np.int32),
+                   np.concatenate(data).astype(np.float64) if data
+                   else np.empty(0, dtype=np.float64),
+                   genres)
+
+    @classmethod
+    def from_dense(cls, matrix: np.ndarray):
+        """
+        Return the sparse representation of a dense matrix.
+
+        Parameters
+        ----------
+        matrix : np.ndarray
+            Users x genres matrix.
+
+        Returns
+        -------
+        SparsePreferences
+            Matrix with the non zero values of the dense one.
+        """
+        rows, columns = np.nonzero(matrix)
+        indptr = np.zeros(len(matrix) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(matrix)), out=indptr[1:])
+        return cls(indptr, columns.astype(np.int32),
+                   np.asarray(matrix[rows, columns], dtype=np.float64), matrix.shape[1])
+
+    @classmethod
+    def from_coordinates(cls, rows: np.ndarray, columns: np.ndarray, data: np.ndarray,
+                         shape: tuple[int, int]):
+        """
+        Return the matrix with the weights of some positions.
+
+        Parameters
+        ----------
+        rows, columns : np.ndarray
+            Row and column of every weight, in any order. The weights of the
+            same position are added up.
+        data : np.ndarray
+            Weights.
+        shape : tuple[int, int]
+            Number of rows and of columns of the matrix.
+
+        Returns
+        -------
+        SparsePreferences
+            The matrix built, without the positions whose weight is zero.
+        """
+        keys, inverse = np.unique(np.asarray(rows, dtype=np.int64) * shape[1]
+                                  + np.asarray(columns, dtype=np.int64), return_inverse=True)
+        data = np.bincount(inverse.ravel(), weights=data, minlength=len(keys))
+        nonzero = data != 0
+        keys, data = keys[nonzero], data[nonzero]
+        indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // shape[1], minlength=shape[0]), out=indptr[1:])
+        return cls(indptr, (keys % shape[1]).astype(np.int32), data.astype(np.float64),
+                   shape[1])
+
+    @property
+    def arrays(self) -> dict[str:np.ndarray]:
+        '''
+        Return the arrays that hold the matrix.
+
+        Returns
+        -------
+        dict[str:np.ndarray]
+            The indptr, indices and data arrays.
+        '''
+        return {'indptr': self._indptr, 'indices': self._indices, 'data': self._data}
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        '''
+        Return the shape of the matrix.
+
+        Returns
+        -------
+        tuple[int, int]
+            Number of users and of genres.
+        '''
+        return (len(self), self.genres)
+
+    @property
+    def nnz(self) -> int:
+        '''
+        Return the number of weights stored.
+
+        Returns
+        -------
+        int
+            Number of genres listened, summed over every user.
+        '''
+        return len(self._data)
+
+    @property
+    def nbytes(self) -> int:
+        '''
+        Return the amount of memory used by the matrix.
+
+        Returns
+        -------
+        int
+            Size of its arrays in bytes.
+        '''
+        return self._indptr.nbytes + self._indices.nbytes + self._data.nbytes
+
+    def __len__(self) -> int:
+        return len(self._indptr) - 1
+
+    def row(self, i: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the genre ids and weights of a row.
+
+        Parameters
+        ----------
+        i : int
+            Row requested.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            Views of the sorted genre ids and of their weights.
+        """
+        start, end = self._indptr[i], self._indptr[i + 1]
+        return self._indices[start:end], self._data[start:end]
+
+    def to_dense(self) -> np.ndarray:
+        """
+        Return the matrix as a dense array.
+
+        Returns
+        -------
+        np.ndarray
+            float64 users x genres matrix.
+        """
+        dense = np.zeros(self.shape, dtype=np.float64)
+        dense[self._rows(), self._indices] = self._data
+        return dense
+
+    def _rows(self) -> np.ndarray:
+        if self._row_ids is None:
+            self._row_ids = np.repeat(np.arange(len(self), dtype=np.int64),
+                                      np.diff(self._indptr))
+        return self._row_ids
+
+    def dot(self, i: int, j: int) -> float:
+        """
+        Return the dot product of two rows.
+
+        The genres in common are found by binary search of the genres of the
+        row i in the genres of the row j.
+
+        Parameters
+        ----------
+        i, j : int
+            Rows multiplied.
+
+        Returns
+        -------
+        float
+            Dot product of the rows.
+        """
+        indices_i, data_i = self.row(i)
+        indices_j, data_j = self.row(j)
+        if not len(indices_i) or not len(indices_j):
+            return 0.0
+        positions = np.minimum(np.searchsorted(indices_j, indices_i), len(indices_j) - 1)
+        common = indices_j[positions] == indices_i
+        return float(data_i[common] @ data_j[positions[common]])
+
+    def _gather(self, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        starts = self._indptr[rows]
+        lengths = self._indptr[rows + 1] - starts
+        pairs = np.repeat(np.arange(len(rows), dtype=np.int64), lengths)
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.arange(lengths.sum(), dtype=np.int64) - np.repeat(offsets - starts, lengths)
+        return pairs, self._indices[positions], self._data[positions]
+
+    def dots(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """
+        Return the dot products of several pairs of rows at once.
+
+        Parameters
+        ----------
+        rows, cols : np.ndarray
+            Rows of every pair.
+
+        Returns
+        -------
+        np.ndarray
+            float64 array with the dot product of every pair.
+        """
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        pairs_a, genres_a, data_a = self._gather(rows)
+        pairs_b, genres_b, data_b = self._gather(cols)
+        if not len(genres_a) or not len(genres_b):
+            return np.zeros(len(rows), dtype=np.float64)
+
+        # Every (pair, genre) key is sorted, so the genres in common can be
+        # found by binary search of one side in the other one.
+        keys_a = pairs_a * self.genres + genres_a
+        keys_b = pairs_b * self.genres + genres_b
+        positions = np.minimum(np.searchsorted(keys_b, keys_a), len(keys_b) - 1)
+        common = keys_b[positions] == keys_a
+        return np.bincount(pairs_a[common], weights=data_a[common] * data_b[positions[common]],
+                           minlength=len(rows))
+
+    def row_scores(self, i: int, end: int = None) -> np.ndarray:
+        """
+        Return the dot product of a row with every row.
+
+        Parameters
+        ----------
+        i : int
+            Row multiplied.
+        end : int
+            If it's given, only the rows before it are multiplied.
+
+        Returns
+        -------
+        np.ndarray
+            float64 array with the dot product of the row i with every row.
+        """
+        end = len(self) if end is None else end
+        stop = self._indptr[end]
+        query = np.zeros(self.genres, dtype=np.float64)
+        indices, data = self.row(i)
+        query[indices] = data
+        return np.bincount(self._rows()[:stop],
+                           weights=self._data[:stop] * query[self._indices[:stop]],
+                           minlength=end)
+
+    def block_scores(self, start: int, end: int) -> np.ndarray:
+        """
+        Return the dot products of a block of consecutive rows with every
+        row up to the end of the block.
+
+        Parameters
+        ----------
+        start, end : int
+            First row of the block and row after the last one.
+
+        Returns
+        -------
+        np.ndarray
+            (end - start) x end matrix of dot products.
+        """
+        return np.array([self.row_scores(i, end) for i in range(start, end)],
+                        dtype=np.float64).reshape(end - start, end)
+
+    def gram(self) -> np.ndarray:
+        """
+        Return the product of the matrix with its transpose.
+
+        Returns
+        -------
+        np.ndarray
+            users x users matrix of dot products.
+        """
+        return self.block_scores(0, len(self))
+
+    def set_row(self, i: int, indices: np.ndarray, data: np.ndarray):
+        """
+        Replace the genres and weights of a row.
+
+        Parameters
+        ----------
+        i : int
+            Row replaced.
+        indices, data : np.ndarray
+            Sorted genre ids and weights of the row.
+        """
+        start, end = self._indptr[i], self._indptr[i + 1]
+        self._indices = np.concatenate((self._indices[:start], indices, self._indices[end:])
+                                       ).astype(np.int32)
+        self._data = np.concatenate((self._data[:start], data, self._data[end:])
+                                    ).astype(np.float64)
+        self._indptr = self._indptr.copy()
+        self._indptr[i + 1:] += len(indices) - (end - start)
+        self._row_ids = None
+
+    def append(self, indices: np.ndarray, data: np.ndarray):
+        """
+        Add a new row after the last one.
+
+        Parameters
+        ----------
+        indices, data : np.ndarray
+            Sorted genre ids and weights of the row.
+        """
+        self._indices = np.concatenate((self._indices, indices)).astype(np.int32)
+        self._data = np.concatenate((self._data, data)).astype(np.float64)
+        self._indptr = np.append(self._indptr, self._indptr[-1] + len(indices))
+        self._row_ids = None
+
+    def remove(self, i: int):
+        """
+        Remove a row, shifting the following ones.
+
+        Parameters
+        ----------
+        i : int
+            Row removed.
+        """
+        self.set_row(i, np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64))
+        self._indptr = np.delete(self._indptr, i + 1)
+        self._row_ids = None
@@ -0,0 +1,213 @@
+'''Tests for the affinity_storage.py file.'''
+
+import tracemalloc
+
+import numpy as np
+import pytest
+from assertpy import assert_that
+
+import music_matcher.affinity_storage as st
+
+
+def test_affinity_cache_init_ko():
+    """Test that AffinityCache's constructor is raising exception with a negative size."""
+    with pytest.raises(st.AffinityStorageError):
+        st.AffinityCache(-1)
+
+
+def test_affinity_cache_symmetric():
+    """Test that AffinityCache returns the same value for both orders of a pair."""
+    cache = st.AffinityCache(4)
+    cache.put(3, 1, 0.25)
+    assert_that(cache.get(1, 3)).is_equal_to(0.25)
+    assert_that(cache.get(3, 1)).is_equal_to(0.25)
+    assert_that(cache.info()).is_equal_to(st.CacheInfo(2, 0, 0, 1, 4))
+
+
+def test_affinity_cache_lru_eviction():
+    """Test that AffinityCache evicts the least recently used affinity."""
+    cache = st.AffinityCache(2)
+    cache.put(0, 1, 0.1)
+    cache.put(0, 2, 0.2)
+    cache.get(0, 1)
+    cache.put(0, 3, 0.3)
+
+    assert_that(cache.get(0, 2)).is_none()
+    assert_that(cache.get(0, 1)).is_equal_to(0.1)
+    assert_that(cache.get(0, 3)).is_equal_to(0.3)
+    assert_that(cache.info()).is_equal_to(st.CacheInfo(3, 1, 1, 2, 2))
+
+
+def test_affinity_cache_disabled():
+    """Test that an AffinityCache of size 0 never stores anything."""
+    cache = st.AffinityCache(0)
+    cache.put(0, 1, 0.1)
+    assert_that(cache).is_length(0)
+    assert_that(cache.get(0, 1)).is_none()
+
+
+@pytest.fixture
+def packed_preferences() -> np.ndarray:
+    '''Return the packed preferences of a few users.
+
+    Returns
+    -------
+    np.ndarray
+        Users x genres matrix of preferences.
+    '''
+    return np.array([[0.5, 0.5, 0.0],
+                     [0.1, 0.2, 0.7],
+                     [0.0, 1.0, 0.0],
+                     [0.3, 0.3, 0.4],
+                     [1.0, 0.0, 0.0]])
+
+
+@pytest.mark.parametrize('size,dtype', [
+    (-1, 'float32'),
+    (3, 'float64'),
+])
+def test_triangular_matrix_init_ko(size: int, dtype: str):
+    '''
+    Test that TriangularAffinityMatrix's constructor is raising exception with wrong parameters.
+
+    Parameters
+    ----------
+    size : int
+        Number of users in the matrix.
+    dtype : str
+        Floating point type of the matrix.
+    '''
+    with pytest.raises(st.AffinityStorageError):
+        st.TriangularAffinityMatrix(size, dtype)
+
+
+@pytest.mark.parametrize('dtype,tolerance', [('float32', 1e-6), ('float16', 1e-3)])
+@pytest.mark.parametrize('block_size', [1, 2, 1024])
+def test_triangular_matrix_from_preferences(packed_preferences: np.ndarray, dtype: str,
+                                            tolerance: float, block_size: int):
+    '''
+    Test that TriangularAffinityMatrix holds the same affinities as the full matrix.
+
+    Parameters
+    ----------
+    packed_preferences : fixture
+        Users x genres matrix of preferences.
+    dtype : str
+        Floating point type of the matrix.
+    tolerance : float
+        Maximum deviation allowed for the dtype.
+    block_size : int
+        Number of columns computed at once.
+    '''
+    expected = packed_preferences @ packed_preferences.T
+    np.fill_diagonal(expected, 1)
+    matrix = st.TriangularAffinityMatrix.from_preferences(packed_preferences, dtype, block_size)
+    size = len(packed_preferences)
+
+    assert_that(matrix.nbytes).is_equal_to(size * (size - 1) // 2 * np.dtype(dtype).itemsize)
+    for i in range(size):
+        assert_that(np.abs(matrix[i] - expected[i]).max()).is_less_than(tolerance)
+        for j in range(size):
+            assert_that(matrix[i, j]).is_close_to(expected[i, j], tolerance)
+
+    rows, cols = np.array([0, 4, 2, 3]), np.array([4, 0, 2, 1])
+    assert_that(np.abs(matrix[rows, cols] - expected[rows, cols]).max()).is_less_than(tolerance)
+
+
+def test_affinity_cache_discard():
+    """Test that AffinityCache's discard method only drops the pairs of a row."""
+    cache = st.AffinityCache(4)
+    cache.put(0, 1, 0.1)
+    cache.put(2, 1, 0.2)
+    cache.put(0, 2, 0.3)
+    cache.discard(1)
+    assert_that(cache).is_length(1)
+    assert_that(cache.get(2, 0)).is_equal_to(0.3)
+
+
+def test_triangular_matrix_resize(packed_preferences: np.ndarray):
+    '''
+    Test that TriangularAffinityMatrix keeps its affinities when users are added or removed.
+
+    Parameters
+    ----------
+    packed_preferences : fixture
+        Users x genres matrix of preferences.
+    '''
+    expected = packed_preferences @ packed_preferences.T
+    np.fill_diagonal(expected, 1)
+    matrix = st.TriangularAffinityMatrix.from_preferences(packed_preferences[:2])
+    for i in range(2, len(packed_preferences)):
+        matrix.append(expected[i])
+    matrix.remove(1)
+    expected = np.delete(np.delete(expected, 1, axis=0), 1, axis=1)
+
+    assert_that(matrix).is_length(len(expected))
+    for i, row in enumerate(expected):
+        assert_that(np.abs(matrix[i] - row).max()).is_less_than(1e-6)
+
+
+@pytest.mark.parametrize('layout', ['dense', 'triangular'])
+@pytest.mark.parametrize('block_size', [1, 2, 1024])
+def test_build_affinities_parallel(packed_preferences: np.ndarray, layout: str,
+                                   block_size: int):
+    '''
+    Test that the affinities computed in a process pool match the full matrix.
+
+    Parameters
+    ----------
+    packed_preferences : fixture
+        Users x genres matrix of preferences.
+    layout : str
+        Layout of the matrix computed.
+    block_size : int
+        Number of rows computed by every task.
+    '''
+    expected = packed_preferences @ packed_preferences.T
+    np.fill_diagonal(expected, 1)
+    matrix = st.build_affinities_parallel(packed_preferences, layout, 2, block_size)
+    for i, row in enumerate(expected):
+        assert_that(np.abs(matrix[i] - row).max()).is_less_than(1e-6)
+
+
+def test_build_affinities_parallel_ko(packed_preferences: np.ndarray, monkeypatch):
+    '''
+    Test that build_affinities_parallel rejects unknown layouts and dtypes
+    before allocating any shared memory.
+
+    Parameters
+    ----------
+    packed_preferences : fixture
+        Users x genres matrix of preferences.
+    monkeypatch : fixture
+        Fixture used to forbid the shared memory.
+    '''
+    def shared_memory(*_, **__):
+        raise AssertionError('The shared memory was allocated')
+
+    monkeypatch.setattr(st, 'SharedMemory', shared_memory)
+    with pytest.raises(st.AffinityStorageError):
+        st.build_affinities_parallel(packed_preferences, 'lazy')
+    with pytest.raises(st.AffinityStorageError):
+        st.build_affinities_parallel(packed_preferences, 'triangular', dtype='float64')
+
+
+@pytest.mark.parametrize('layout', ['dense', 'triangular'])
+def test_build_affinities_parallel_mapped(layout: str):
+    '''
+    Test that the affinities computed in a process pool aren't copied into the heap.
+
+    Parameters
+    ----------
+    layout : str
+        Layout of the matrix computed.
+    '''
+    packed = np.random.default_rng(5).random((1000, 8))
+    tracemalloc.start()
+    try:
+        matrix = st.build_affinities_parallel(packed, layout, 2, 256)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert_that(peak).is_less_than(len(packed) * (len(packed) - 1) // 2 * 4)
+    assert_that(float(matrix[3][7])).is_close_to(float(packed[3] @ packed[7]), 1e-6)
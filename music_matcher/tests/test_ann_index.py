@@ -0,0 +1,132 @@
+'''Tests for the ann_index.py file.'''
+
+import numpy as np
+import pytest
+from assertpy import assert_that
+
+import music_matcher.ann_index as ann
+import music_matcher.recommendation_engine as rec
+from music_matcher.music_history import MusicHistory
+from music_matcher.user import User
+
+
+GENRES_PATH = 'music_matcher/data/music_genres.yaml'
+
+
+@pytest.fixture(scope='module')
+def sample_engine() -> rec.RecommendationEngine:
+    '''Return an engine with 500 users with random genre preferences.
+
+    Returns
+    -------
+    rec.RecommendationEngine
+        Engine with the users u0 to u499.
+    '''
+    basic_genres = rec.RecommendationEngine.load_yaml_file(GENRES_PATH).basic_genres
+    rng = np.random.default_rng(7)
+    preferences = rng.dirichlet(np.full(len(basic_genres), 0.3), size=500)
+    return rec.RecommendationEngine.from_preferences(
+        GENRES_PATH, ((f'u{i}', dict(zip(basic_genres, row))) for i, row in enumerate(preferences)))
+
+
+def sample_user(username: str) -> User:
+    '''Return a user with an empty music history.
+
+    Parameters
+    ----------
+    username : str
+        Username of the user.
+
+    Returns
+    -------
+    User
+        The user.
+    '''
+    return User(username, '2000-01-01', username, 'NB', MusicHistory([]))
+
+
+def test_ann_index_top_matches(sample_engine):
+    '''
+    Test that ANNIndex returns exact affinities of other users, sorted by affinity.
+
+    Parameters
+    ----------
+    sample_engine : fixture
+        Fixture that returns an engine with random users.
+    '''
+    index = ann.ANNIndex.from_engine(sample_engine, tables=8, bits=6, probes=3, seed=1)
+    user = sample_user('u3')
+    matches = index.top_matches(user, 10)
+
+    assert_that(index).is_length(500)
+    assert_that(matches).is_length(10)
+    assert_that([username for username, _ in matches]).does_not_contain('u3')
+    scores = [score for _, score in matches]
+    assert_that(scores).is_equal_to(sorted(scores, reverse=True))
+    for username, score in matches:
+        assert_that(score).is_close_to(
+            sample_engine.affinity((user, sample_user(username))), 1e-6)
+
+
+def test_ann_index_recall(sample_engine):
+    '''
+    Test that looking up more buckets finds more of the exact best matches.
+
+    Parameters
+    ----------
+    sample_engine : fixture
+        Fixture that returns an engine with random users.
+    '''
+    index = ann.ANNIndex.from_engine(sample_engine, tables=16, bits=8, seed=1)
+    users = [sample_user(f'u{i}') for i in range(0, 500, 10)]
+    single_probe = ann.measure_recall(index, sample_engine, users, 5)
+    multi_probe = ann.measure_recall(index, sample_engine, users, 5, probes=9)
+
+    assert_that(multi_probe).is_greater_than_or_equal_to(single_probe)
+    assert_that(multi_probe).is_greater_than(0.9)
+    assert_that(ann.measure_recall(index, sample_engine, [], 5)).is_equal_to(1.0)
+
+
+@pytest.mark.parametrize('options,expected_exception', [
+    ({'tables': 0}, ann.ANNIndexError),
+    ({'bits': 63}, ann.ANNIndexError),
+    ({'bits': 4, 'probes': 6}, ann.ANNIndexError),
+    ({'tables': 2.0}, ann.ANNIndexTypeError),
+])
+def test_ann_index_init_ko(sample_engine, options: dict, expected_exception: Exception):
+    '''
+    Test that ANNIndex's constructor rejects wrong options.
+
+    Parameters
+    ----------
+    sample_engine : fixture
+        Fixture that returns an engine with random users.
+    options : dict
+        Options given to the constructor.
+    expected_exception : Exception
+        Exception that should have been raised.
+    '''
+    with pytest.raises(expected_exception):
+        ann.ANNIndex.from_engine(sample_engine, **options)
+
+
+def test_ann_index_top_matches_ko(sample_engine):
+    '''
+    Test that ANNIndex's top_matches rejects unknown users and wrong parameters.
+
+    Parameters
+    ----------
+    sample_engine : fixture
+        Fixture that returns an engine with random users.
+    '''
+    index = ann.ANNIndex.from_engine(sample_engine, bits=4, seed=1)
+    with pytest.raises(ann.ANNIndexError):
+        index.top_matches(sample_user('unknown'), 5)
+    with pytest.raises(ann.ANNIndexError):
+        index.top_matches(sample_user('u1'), 0)
+    with pytest.raises(ann.ANNIndexError):
+        index.top_matches(sample_user('u1'), 5, probes=6)
+    with pytest.raises(ann.ANNIndexTypeError):
+        index.top_matches('u1', 5)
+    with pytest.raises(ann.ANNIndexTypeError):
+        ann.ANNIndex.from_engine(None)
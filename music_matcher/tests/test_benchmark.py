@@ -0,0 +1,162 @@
+'''Tests for the benchmark.py file.'''
+
+import pytest
+from assertpy import assert_that
+
+from music_matcher import benchmark as bench
+from music_matcher.recommendation_engine import RecommendationEngine
+
+
+GENRES_PATH = 'music_matcher/data/music_genres.yaml'
+
+
+@pytest.mark.parametrize('skew', [0.0, 1.0, 2.5])
+def test_benchmark_genre_weights(skew: float, float_tolerance: float):
+    """
+    Test that the genre weights are a distribution that decreases with the skew.
+
+    Parameters
+    ----------
+    skew : float
+        Skew of the distribution.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    weights = bench.genre_weights(10, skew)
+    assert_that(float(weights.sum())).is_close_to(1.0, float_tolerance)
+    assert_that(weights.tolist()).is_equal_to(sorted(weights.tolist(), reverse=True))
+    assert_that(weights[0] == weights[-1]).is_equal_to(skew == 0)
+
+
+@pytest.mark.parametrize('count,skew', [(0, 1.0), (10, -1.0)])
+def test_benchmark_genre_weights_ko(count: int, skew: float):
+    """
+    Test that the genre weights reject wrong parameters.
+
+    Parameters
+    ----------
+    count : int
+        Number of genres.
+    skew : float
+        Skew of the distribution.
+    """
+    with pytest.raises(bench.BenchmarkError):
+        bench.genre_weights(count, skew)
+
+
+def test_benchmark_synthetic_users():
+    """Test that the synthetic users are reproducible and follow the skew."""
+    taxonomy = RecommendationEngine.load_yaml_file(GENRES_PATH)
+    users = bench.synthetic_users(taxonomy, 50, skew=3.0, seed=7)
+    again = bench.synthetic_users(taxonomy, 50, skew=3.0, seed=7)
+    assert_that(users).is_length(50)
+    assert_that([user.music_history.genre_preferences for user in users]).is_equal_to(
+        [user.music_history.genre_preferences for user in again])
+    assert_that(len({user.username for user in users})).is_equal_to(50)
+
+    listened = {genre for user in users for genre in user.music_history.genres_listened}
+    uniform = {genre for user in bench.synthetic_users(taxonomy, 50, skew=0.0, seed=7)
+               for genre in user.music_history.genres_listened}
+    assert_that(listened.issubset(taxonomy.genre_ids)).is_true()
+    assert_that(len(listened)).is_less_than(len(uniform))
+
+
+def test_benchmark_run(tmp_path):
+    """
+    Test that a small benchmark reports every metric and can be saved and loaded.
+
+    Parameters
+    ----------
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    """
+    results = bench.run_benchmark(GENRES_PATH, scales=[20, 40], queries=5, k=3)
+    assert_that(results['scales']).contains_only('20', '40')
+    assert_that(results['taxonomy']).contains_only('load_s', 'cached_load_s')
+    assert_that(results['scales']['40']).contains(
+        'preferences_s', 'construction_s', 'construction_peak_bytes', 'affinity_p50_ms',
+        'affinity_p99_ms', 'top_matches_p90_ms')
+    assert_that(results['scales']['40']['construction_peak_bytes']).is_positive()
+    assert_that(results['options']['repeat']).is_equal_to(bench.DEFAULT_REPEAT)
+
+    results_path = str(tmp_path / 'benchmark.json')
+    bench.save_results(results, results_path)
+    assert_that(bench.load_results(results_path)).is_equal_to(results)
+    assert_that(bench.format_results(results)).contains('40 users construction_s')
+
+
+def test_benchmark_run_ko(tmp_path):
+    """
+    Test that the benchmark rejects scales too small and results of other versions.
+
+    Parameters
+    ----------
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    """
+    with pytest.raises(bench.BenchmarkError):
+        bench.run_benchmark(GENRES_PATH, scales=[1])
+    results_path = tmp_path / 'benchmark.json'
+    results_path.write_text('{"version": 0}')
+    with pytest.raises(bench.BenchmarkError):
+        bench.load_results(str(results_path))
+
+
+@pytest.mark.parametrize('current,tolerance,expected', [
+    (1.2, 0.25, []),
+    (1.5, 0.25, [bench.Regression('1000', 'construction_s', 1.0, 1.5)]),
+    (1.2, 0.1, [bench.Regression('1000', 'construction_s', 1.0, 1.2)]),
+    (0.5, 0.0, []),
+])
+def test_benchmark_compare(current: float, tolerance: float, expected: list):
+    """
+    Test that only the metrics that grew more than the tolerance are regressions.
+
+    Parameters
+    ----------
+    current : float
+        Construction time of the current results.
+    tolerance : float
+        Fraction the metrics can grow.
+    expected : list[bench.Regression]
+        Regressions that should be found.
+    """
+    baseline = {'taxonomy': {'load_s': 1.0},
+                'scales': {'1000': {'users': 1000, 'construction_s': 1.0},
+                           '10000': {'construction_s': 1.0}}}
+    results = {'taxonomy': {'load_s': 1.0},
+               'scales': {'1000': {'users': 1000, 'construction_s': current},
+                          '100000': {'construction_s': 100.0}}}
+    assert_that(bench.compare_results(results, baseline, tolerance)).is_equal_to(expected)
+    with pytest.raises(bench.BenchmarkError):
+        bench.compare_results(results, baseline, -1.0)
+    with pytest.raises(bench.BenchmarkError):
+        bench.compare_results(results, baseline, 0.25, -1.0)
+
+
+@pytest.mark.parametrize('metric,baseline,current,regressed', [
+    ('load_s', 0.0002, 0.0009, False),
+    ('load_s', 0.0002, 0.002, True),
+    ('affinity_p50_ms', 0.01, 0.5, False),
+    ('affinity_p50_ms', 0.01, 1.5, True),
+    ('construction_peak_bytes', 100, 200, True),
+])
+def test_benchmark_compare_min_difference(metric: str, baseline: float, current: float,
+                                          regressed: bool):
+    """
+    Test that times and latencies must grow more than MIN_DIFFERENCE_S to be regressions.
+
+    Parameters
+    ----------
+    metric : str
+        Name of the metric compared.
+    baseline : float
+        Value of the metric in the baseline.
+    current : float
+        Value of the metric in the current results.
+    regressed : bool
+        If the metric should be a regression.
+    """
+    regressions = bench.compare_results({'taxonomy': {metric: current}},
+                                        {'taxonomy': {metric: baseline}})
+    assert_that(bool(regressions)).is_equal_to(regressed)
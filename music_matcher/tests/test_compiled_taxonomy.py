@@ -0,0 +1,139 @@
+'''Tests for the compiled_taxonomy.py file.'''
+
+import pytest
+from assertpy import assert_that
+
+import music_matcher.compiled_taxonomy as ct
+import music_matcher.recommendation_engine as rec
+
+
+GENRES_PATH = 'music_matcher/data/music_genres.yaml'
+
+
+@pytest.fixture
+def compiled_path(tmp_path) -> str:
+    '''Return the path of the compiled version of the genres yaml file.
+
+    Parameters
+    ----------
+    tmp_path : fixture
+        Temporary directory unique to the test.
+
+    Returns
+    -------
+    str
+        Path of the compiled taxonomy.
+    '''
+    path = str(tmp_path / 'music_genres.mmtax')
+    ct.compile_taxonomy(GENRES_PATH, path)
+    return path
+
+
+def test_compiled_taxonomy_roundtrip(compiled_path: str):
+    '''
+    Test that a compiled taxonomy is loaded with the same genres as the yaml file.
+
+    Parameters
+    ----------
+    compiled_path : fixture
+        Path of the compiled taxonomy.
+    '''
+    expected = rec.RecommendationEngine.load_yaml_file(GENRES_PATH)
+    taxonomy = ct.load_compiled_taxonomy(compiled_path, GENRES_PATH)
+    assert_that(taxonomy).is_equal_to(expected)
+    assert_that(taxonomy.genre_names).is_equal_to(expected.genre_names)
+    assert_that(taxonomy.lookup).is_equal_to(expected.lookup)
+
+
+def test_compiled_taxonomy_version_ko(compiled_path: str, tmp_path):
+    '''
+    Test that a compiled taxonomy is rejected when the yaml file has another version.
+
+    Parameters
+    ----------
+    compiled_path : fixture
+        Path of the compiled taxonomy.
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    '''
+    genres_path = tmp_path / 'genres.yaml'
+    genres_path.write_text("version: 'v2.0.0'\ngenres:\n  - rock:\n      - subgenres:\n"
+                           "          - hard\n", encoding='utf-8')
+    assert_that(ct.read_yaml_version(str(genres_path))).is_equal_to('v2.0.0')
+    with pytest.raises(rec.RecommendationError):
+        ct.load_compiled_taxonomy(compiled_path, str(genres_path))
+    genres_path.write_text('genres: []\n', encoding='utf-8')
+    with pytest.raises(rec.RecommendationParsingError):
+        ct.load_compiled_taxonomy(compiled_path, str(genres_path))
+
+
+@pytest.mark.parametrize('version_line,expected', [
+    ("version: 'v1.0.0'  # release", 'v1.0.0'),
+    ('version: 1.10', '1.1'),
+    ('version: "2.0"', '2.0'),
+])
+def test_compiled_taxonomy_yaml_version(tmp_path, version_line: str, expected: str):
+    '''
+    Test that the version of the yaml file is read as the compiled taxonomy keeps it.
+
+    Parameters
+    ----------
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    version_line : str
+        Line of the yaml file with the version.
+    expected : str
+        Version read.
+    '''
+    genres_path = tmp_path / 'genres.yaml'
+    genres_path.write_text(f'{version_line}\ngenres:\n  - rock:\n      - subgenres:\n'
+                           '          - hard\n', encoding='utf-8')
+    compiled_path = str(tmp_path / 'genres.mmtax')
+    ct.compile_taxonomy(str(genres_path), compiled_path)
+    assert_that(ct.read_yaml_version(str(genres_path))).is_equal_to(expected)
+    assert_that(ct.load_compiled_taxonomy(compiled_path, str(genres_path)).version
+                ).is_equal_to(expected)
+
+
+def test_compiled_taxonomy_version_unparsed(compiled_path: str, monkeypatch):
+    '''
+    Test that checking the version of the yaml file doesn't parse the whole file.
+
+    Parameters
+    ----------
+    compiled_path : fixture
+        Path of the compiled taxonomy.
+    monkeypatch : fixture
+        Fixture used to replace the yaml parser.
+    '''
+    def parse_yaml_file(genres_yaml: str):
+        raise AssertionError(f'{genres_yaml} was parsed')
+
+    rec.clear_taxonomy_cache()
+    monkeypatch.setattr(rec.RecommendationEngine, '_parse_yaml_file', parse_yaml_file)
+    taxonomy = ct.load_compiled_taxonomy(compiled_path, GENRES_PATH)
+    assert_that(taxonomy.version).is_equal_to('v1.0.0')
+
+
+@pytest.mark.parametrize('content', [b'', b'not a taxonomy', ct.MAGIC + b'\x01'])
+def test_compiled_taxonomy_parsing_ko(tmp_path, content: bytes):
+    '''
+    Test that loading a file that isn't a compiled taxonomy raises an exception.
+
+    Parameters
+    ----------
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    content : bytes
+        Content of the file loaded.
+    '''
+    path = tmp_path / 'wrong.mmtax'
+    path.write_bytes(content)
+    with pytest.raises(rec.RecommendationParsingError):
+        ct.load_compiled_taxonomy(str(path))
+
+
+def test_compiled_taxonomy_file_ko():
+    '''Test that loading an unexisting compiled taxonomy raises an exception.'''
+    with pytest.raises(rec.RecommendationFileError):
+        ct.load_compiled_taxonomy('unexisting_file')
@@ -0,0 +1,162 @@
+'''Tests for the ingest.py file.'''
+
+import gzip
+import json
+
+import pytest
+from assertpy import assert_that
+
+import music_matcher.ingest as ing
+import music_matcher.recommendation_engine as rec
+
+
+GENRES_PATH = 'music_matcher/data/music_genres.yaml'
+
+RECORDS = [
+    {'username': 'lucia', 'title': 'Holy Diver', 'genre': 'heavy', 'plays': 3},
+    {'username': 'lucia', 'title': 'Juicy', 'genre': 'hip-hop'},
+    {'username': 'luis', 'title': 'Hey Jude', 'genre': 'pop', 'plays': 2},
+    {'username': 'luis', 'title': 'T.N.T.', 'genre': 'hard', 'plays': 2},
+    {'username': 'jorge', 'title': 'White Riot', 'genre': 'punk'},
+]
+
+
+def write_export(directory, name: str, records: list[dict]) -> str:
+    '''Write an export of reproductions in the format given by its name.
+
+    Parameters
+    ----------
+    directory : pathlib.Path
+        Directory where the export will be written.
+    name : str
+        Name of the file, whose extension determines its format.
+    records : list[dict]
+        Reproductions written.
+
+    Returns
+    -------
+    str
+        Path of the export.
+    '''
+    if '.csv' in name:
+        lines = ['username,title,genre,plays'] + [
+            f"{r['username']},{r['title']},{r['genre']},{r.get('plays', '')}" for r in records]
+    else:
+        lines = [json.dumps(record) for record in records]
+    content = ('\n'.join(lines) + '\n').encode('utf-8')
+    path = directory / name
+    path.write_bytes(gzip.compress(content) if name.endswith('.gz') else content)
+    return str(path)
+
+
+@pytest.mark.parametrize('name', ['plays.jsonl', 'plays.csv', 'plays.jsonl.gz', 'plays.csv.gz'])
+def test_ingest_read_plays(tmp_path, name: str):
+    '''
+    Test that read_plays reads every row of an export in every format.
+
+    Parameters
+    ----------
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    name : str
+        Name of the export.
+    '''
+    plays = list(ing.read_plays(write_export(tmp_path, name, RECORDS)))
+    assert_that(plays).is_equal_to([ing.Play(r['username'], r['genre'], r.get('plays', 1))
+                                    for r in RECORDS])
+
+
+@pytest.mark.parametrize('name,content', [
+    ('plays.txt', b''),
+    ('plays.jsonl', b'{"username": "lucia"}\n'),
+    ('plays.jsonl', b'{"username": "lucia", "genre": "pop", "plays": -1}\n'),
+    ('plays.jsonl', b'[1, 2]\n'),
+    ('plays.jsonl', b'{"username": \n'),
+    ('plays.csv', b'username,genre,plays\nlucia,pop,many\n'),
+])
+def test_ingest_read_plays_ko(tmp_path, name: str, content: bytes):
+    '''
+    Test that read_plays raises an exception with wrong exports.
+
+    Parameters
+    ----------
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    name : str
+        Name of the export.
+    content : bytes
+        Content of the export.
+    '''
+    path = tmp_path / name
+    path.write_bytes(content)
+    with pytest.raises(ing.IngestError):
+        list(ing.read_plays(str(path)))
+
+
+@pytest.mark.parametrize('grouped', [True, False])
+def test_ingest_aggregate_preferences(grouped: bool, float_tolerance: float):
+    '''
+    Test that aggregate_preferences computes the preferences of every user.
+
+    Parameters
+    ----------
+    grouped : bool
+        If the reproductions of every user are contiguous.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    '''
+    plays = [ing.Play(r['username'], r['genre'], r.get('plays', 1)) for r in RECORDS]
+    preferences = dict(ing.aggregate_preferences(iter(plays), grouped))
+    assert_that(preferences).contains_only('lucia', 'luis', 'jorge')
+    assert_that(preferences['lucia']['heavy']).is_close_to(0.75, float_tolerance)
+    assert_that(preferences['luis']).is_equal_to({'pop': 0.5, 'hard': 0.5})
+    assert_that(preferences['jorge']).is_equal_to({'punk': 1.0})
+
+
+def test_ingest_aggregate_preferences_ungrouped():
+    '''Test that reproductions that aren't contiguous are only accepted if not grouped.'''
+    plays = [ing.Play('lucia', 'pop', 1), ing.Play('luis', 'pop', 1), ing.Play('lucia', 'rock', 1)]
+    with pytest.raises(ing.IngestError):
+        list(ing.aggregate_preferences(plays))
+    assert_that(dict(ing.aggregate_preferences(plays, grouped=False))['lucia']).is_equal_to(
+        {'pop': 0.5, 'rock': 0.5})
+
+
+def test_ingest_aggregate_preferences_multigenre(float_tolerance: float):
+    '''
+    Test that the reproductions of songs with several genres are split among them.
+
+    Parameters
+    ----------
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    '''
+    plays = [ing.Play('lucia', 'rock;pop', 3), ing.Play('lucia', 'pop', 1)]
+    preferences = dict(ing.aggregate_preferences(plays))['lucia']
+    assert_that(preferences).contains_only('rock', 'pop')
+    assert_that(preferences['rock']).is_close_to(0.375, float_tolerance)
+    assert_that(preferences['pop']).is_close_to(0.625, float_tolerance)
+
+
+def test_ingest_load_engine(tmp_path, float_tolerance: float):
+    '''
+    Test that load_engine builds an engine with the preferences of an export.
+
+    Parameters
+    ----------
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    '''
+    path = write_export(tmp_path, 'plays.jsonl.gz', RECORDS)
+    engine = ing.load_engine(GENRES_PATH, path, storage='lazy')
+    expected = rec.RecommendationEngine.from_preferences(
+        GENRES_PATH, [('lucia', {'heavy': 0.75, 'hip-hop': 0.25}),
+                      ('luis', {'pop': 0.5, 'hard': 0.5}),
+                      ('jorge', {'punk': 1.0})])
+    assert_that(engine._usernames).is_equal_to(['lucia', 'luis', 'jorge'])
+    for i in range(3):
+        for j in range(3):
+            assert_that(engine._pair_affinity(i, j)).is_close_to(expected._pair_affinity(i, j),
+                                                                 float_tolerance)
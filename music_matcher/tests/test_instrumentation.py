@@ -0,0 +1,146 @@
+'''Tests for the instrumentation.py file.'''
+
+import json
+
+import numpy as np
+import pytest
+from assertpy import assert_that
+
+from music_matcher import instrumentation as ins
+import music_matcher.recommendation_engine as rec
+
+
+GENRES_PATH = 'music_matcher/data/music_genres.yaml'
+
+
+@pytest.fixture(autouse=True)
+def disabled_instrumentation():
+    '''Disable the instrumentation after every test.'''
+    yield
+    ins.disable()
+
+
+def test_stats_histogram():
+    """Test that the durations recorded are aggregated into cumulative buckets."""
+    stats = ins.Stats(buckets=(0.001, 0.01))
+    for seconds in [0.0005, 0.001, 0.005, 0.5]:
+        stats('load', seconds)
+    stats('affinity', 0.002)
+
+    snapshot = stats.snapshot()
+    assert_that(snapshot).contains_only('affinity', 'load')
+    assert_that(snapshot['load']).is_equal_to({
+        'count': 4, 'sum': pytest.approx(0.5065), 'min': 0.0005, 'max': 0.5,
+        'buckets': {'0.001': 2, '0.01': 3, '+Inf': 4}})
+    assert_that(json.loads(stats.to_json())).is_equal_to(snapshot)
+
+    stats.reset()
+    assert_that(stats.snapshot()).is_empty()
+
+
+def test_stats_prometheus():
+    """Test that the histograms are written in the Prometheus text format."""
+    stats = ins.Stats(buckets=(0.001,))
+    stats('affinity', 0.0005)
+    stats('affinity', 0.25)
+    assert_that(stats.to_prometheus('mm').splitlines()).is_equal_to([
+        '# HELP mm_duration_seconds Duration of the instrumented operations.',
+        '# TYPE mm_duration_seconds histogram',
+        'mm_duration_seconds_bucket{operation="affinity",le="0.001"} 1',
+        'mm_duration_seconds_bucket{operation="affinity",le="+Inf"} 2',
+        'mm_duration_seconds_sum{operation="affinity"} 0.2505',
+        'mm_duration_seconds_count{operation="affinity"} 2',
+    ])
+
+
+@pytest.mark.parametrize('buckets', [(), (0.1, 0.1), (1.0, 0.5)])
+def test_stats_ko(buckets: tuple):
+    """
+    Test that the Stats constructor rejects wrong buckets.
+
+    Parameters
+    ----------
+    buckets : tuple
+        Upper bounds of the buckets.
+    """
+    with pytest.raises(ins.InstrumentationError):
+        ins.Stats(buckets)
+
+
+def test_instrumented():
+    """Test that an instrumented function only reports its calls while enabled."""
+    calls = []
+
+    @ins.instrumented('double')
+    def double(value: int) -> int:
+        return 2 * value
+
+    assert_that(double(2)).is_equal_to(4)
+    with ins.recording(lambda name, seconds: calls.append((name, seconds))):
+        assert_that(double(3)).is_equal_to(6)
+        with ins.recording() as stats:
+            double(4)
+        assert_that(stats.snapshot()['double']['count']).is_equal_to(1)
+        double(5)
+    double(6)
+
+    assert_that([name for name, _ in calls]).is_equal_to(['double', 'double'])
+    assert_that(all(seconds >= 0 for _, seconds in calls)).is_true()
+    assert_that(ins.active_recorder).is_none()
+    with pytest.raises(ins.InstrumentationError):
+        ins.enable('stats')
+
+
+def test_instrumented_engine(songs, users):
+    """
+    Test that building and querying an engine records every operation.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis', 'jorge']]
+    stats = ins.enable()
+    rec_en = rec.RecommendationEngine(GENRES_PATH, users)
+    rec_en.affinity((users[0], users[1]))
+    rec_en.affinity((users[1], users[2]))
+    ins.disable()
+    rec_en.affinity((users[0], users[2]))
+
+    snapshot = stats.snapshot()
+    assert_that(snapshot).contains_only('load_yaml_file', 'normalize_preferences',
+                                        'build_affinities', 'affinity')
+    assert_that({name: histogram['count'] for name, histogram in snapshot.items()}
+                ).is_equal_to({'load_yaml_file': 1, 'normalize_preferences': 3,
+                               'build_affinities': 1, 'affinity': 2})
+
+
+def test_instrumented_engine_batched(songs, users):
+    """
+    Test that building an engine in batch records every operation once per build.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis', 'jorge']]
+    preferences = [(user.username, user.music_history.genre_preferences) for user in users]
+    taxonomy = rec.RecommendationEngine.load_yaml_file(GENRES_PATH)
+    matrix = np.random.default_rng(3).random((len(users), len(taxonomy.basic_genres)))
+
+    with ins.recording() as stats:
+        rec.RecommendationEngine.from_preferences(GENRES_PATH, preferences)
+    assert_that({name: histogram['count'] for name, histogram in stats.snapshot().items()}
+                ).is_equal_to({'load_yaml_file': 1, 'pack_preferences': 1,
+                               'build_affinities': 1})
+
+    with ins.recording() as stats:
+        rec.RecommendationEngine.from_matrix(taxonomy, [user.username for user in users], matrix)
+    assert_that({name: histogram['count'] for name, histogram in stats.snapshot().items()}
+                ).is_equal_to({'build_affinities': 1})
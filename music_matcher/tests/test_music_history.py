@@ -1,12 +1,15 @@
 '''Tests for the music_history.py file.'''
 
+from array import array
 from datetime import timedelta, datetime
 
+import numpy as np
 import pytest
 from assertpy import assert_that
 
 import music_matcher.music_history as mh
-from music_matcher.song import Song
+from music_matcher.song import CompactSong, Song
+from music_matcher.song_catalog import SongCatalog
 from .conftest import genres, valid_date
 
 
@@ -66,7 +69,11 @@ def valid_song() -> Song:
     (None, None),
     (valid_song(), [False]),
     (valid_song(), [valid_date(), 1]),
-    (None, [valid_date()])
+    (None, [valid_date()]),
+    (valid_song(), array('d', [1.0])),
+    (valid_song(), np.zeros(2, dtype=np.float64)),
+    (valid_song(), np.zeros((2, 2), dtype=np.int64)),
+    (valid_song(), (valid_date(),))
 ])
 def test_song_entry_init_ko(song: Song, times_played: datetime):
     '''
@@ -293,3 +300,314 @@ def test_music_history_genre_preferences(songs, songs_param: list[tuple[str, int
     mh_preferences = music_history.genre_preferences
     map(lambda x: assert_that(mh_preferences[x]).is_close_to(
         preferences[x], float_tolerance), genres)
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+@pytest.mark.parametrize('songs_param, preferences', [
+    ([('metal', 10)], {
+        'metalcore': 0.1,
+        'heavy': 0.2,
+        'metal': 0.2,
+        'trash': 0.1,
+        'doom': 0.1,
+        'djent': 0.1,
+        'blackgaze': 0.1,
+        'nu-metal': 0.1
+    }),
+    ([('punk', 4), ('rock', 4)], {
+        'screamo': 0.25,
+        'punk': 0.25,
+        'rock': 0.5,
+    }),
+])
+def test_music_history_genre_preferences_values(songs, incremental: bool,
+                                                songs_param: list[tuple[str, int]],
+                                                preferences: dict[str:float],
+                                                float_tolerance: float):
+    '''
+    Test the values computed by MusicHistory's genre_preferences in both modes.
+
+    Parameters
+    ----------
+    songs : fixture
+        Fixture that returns a list of songs.
+    incremental : bool
+        If the MusicHistory keeps its reproductions per genre up to date.
+    songs_param : list[tuple[str,int]]
+        List composed of tuples of str and int, being the string the name of the music
+        genre and the int the number of songs (up to 10) that will be added from that
+        music genre to the MusicHistory object returned.
+    preferences : dict[str:float]
+        The expected computed preferences.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    '''
+    song_entries = [mh.SongEntry(song, [valid_date()]) for song in songs(songs_param)]
+    mh_preferences = mh.MusicHistory(song_entries, incremental=incremental).genre_preferences
+    assert_that(mh_preferences).is_length(len(preferences))
+    for genre, percentage in preferences.items():
+        assert_that(mh_preferences[genre]).is_close_to(percentage, float_tolerance)
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_music_history_multigenre_preferences(incremental: bool, float_tolerance: float):
+    '''
+    Test that the reproductions of a song with several genres are split evenly among them.
+
+    Parameters
+    ----------
+    incremental : bool
+        If the MusicHistory keeps its reproductions per genre up to date.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    '''
+    fusion_song = Song('Bitches Brew', 'jazz;rock;funk', 'Miles Davis', 1970)
+    music_history = mh.MusicHistory([mh.SongEntry(valid_song(), [valid_date()])],
+                                    incremental=incremental)
+    music_history.record_plays([(fusion_song, valid_date())] * 2)
+
+    preferences = music_history.genre_preferences
+    assert_that(music_history.total_entries).is_equal_to(3)
+    assert_that(music_history.genres_listened).is_equal_to(
+        {'blackgaze', 'jazz', 'rock', 'funk'})
+    assert_that(preferences['blackgaze']).is_close_to(1/3, float_tolerance)
+    for genre in fusion_song.genres:
+        assert_that(preferences[genre]).is_close_to(2/9, float_tolerance)
+    assert_that(sum(preferences.values())).is_close_to(1, float_tolerance)
+
+
+def test_music_history_weighted_genre_preferences(songs, float_tolerance: float):
+    '''
+    Test that MusicHistory's weighted_genre_preferences windows and decays the reproductions.
+
+    Parameters
+    ----------
+    songs : fixture
+        Fixture that returns a list of songs.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    '''
+    metal_song, rock_song = songs([('metal', 1), ('rock', 1)])
+    day = timedelta(days=1)
+    music_history = mh.MusicHistory([
+        mh.SongEntry(metal_song, [valid_date(), valid_date() - 10 * day, valid_date() - day]),
+        mh.SongEntry(rock_song, array('q', [int((valid_date() - 2 * day).timestamp())]))
+    ])
+
+    windowed = music_history.weighted_genre_preferences(since=valid_date() - 5 * day)
+    assert_that(windowed[metal_song.genre]).is_close_to(2/3, float_tolerance)
+    assert_that(windowed[rock_song.genre]).is_close_to(1/3, float_tolerance)
+
+    decayed = music_history.weighted_genre_preferences(half_life=day, now=valid_date())
+    metal_weight = 1 + 0.5 + 2 ** -10
+    assert_that(decayed[rock_song.genre]).is_close_to(0.25 / (metal_weight + 0.25),
+                                                      float_tolerance)
+    assert_that(music_history.weighted_genre_preferences()).is_equal_to(
+        music_history.genre_preferences)
+    assert_that(music_history.weighted_genre_preferences(since=valid_date() + day)).is_empty()
+
+    with pytest.raises(mh.MusicHistoryError):
+        music_history.weighted_genre_preferences(half_life=timedelta(0))
+    with pytest.raises(mh.MusicHistoryTypeError):
+        music_history.weighted_genre_preferences(since='2001-12-01')
+
+    catalog_history = mh.MusicHistory([], catalog=SongCatalog())
+    catalog_history.record_plays([(metal_song, valid_date()), (metal_song, valid_date() - day),
+                                  (metal_song, valid_date() - 10 * day),
+                                  (rock_song, valid_date() - 2 * day)])
+    catalog_decayed = catalog_history.weighted_genre_preferences(half_life=day, now=valid_date())
+    assert_that(catalog_decayed[rock_song.genre]).is_close_to(decayed[rock_song.genre],
+                                                              float_tolerance)
+    with pytest.raises(mh.SongEntryTypeError):
+        mh.CatalogEntry(catalog_history.catalog, 0, [valid_date()])
+
+
+def test_music_history_add_entry_incremental(songs, times_played, float_tolerance: float):
+    '''
+    Test that an incremental MusicHistory stays up to date when entries are added.
+
+    Parameters
+    ----------
+    songs : fixture
+        Fixture that returns a list of songs.
+    times_played : fixture
+        Fixture that returns a list of dates.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    '''
+    all_songs = songs([('metal', 5), ('rock', 3), ('pop', 2)])
+    incremental = mh.MusicHistory([], incremental=True)
+    for i, song in enumerate(all_songs):
+        incremental.add_entry(mh.SongEntry(song, times_played + [valid_date()] * i))
+
+    expected = mh.MusicHistory(incremental._songs_played[:])
+    assert_that(incremental.incremental).is_true()
+    assert_that(expected.incremental).is_false()
+    assert_that(incremental.total_entries).is_equal_to(expected.total_entries)
+    assert_that(incremental.genre_preferences).is_length(len(expected.genre_preferences))
+    for genre, percentage in expected.genre_preferences.items():
+        assert_that(incremental.genre_preferences[genre]).is_close_to(percentage,
+                                                                      float_tolerance)
+
+
+def test_music_history_add_entry_ko():
+    '''Test that MusicHistory's add_entry method rejects objects that aren't SongEntry.'''
+    with pytest.raises(mh.MusicHistoryTypeError):
+        mh.MusicHistory([]).add_entry(valid_song())
+
+
+def test_song_entry_add_play(get_song):
+    """
+    Test the SongEntry's add_play method.
+
+    Parameters
+    ----------
+    get_song : fixture
+        Fixture that returns a song instance.
+    """
+    song_entry = mh.SongEntry(get_song, [valid_date()])
+    song_entry.add_play(valid_date() + timedelta(days=1))
+    assert_that(song_entry.amount_reproductions).is_equal_to(2)
+    with pytest.raises(mh.SongEntryTypeError):
+        song_entry.add_play('2001-12-02')
+
+
+@pytest.mark.parametrize('storage', [array, np.array])
+def test_song_entry_compact(get_song, times_played, storage):
+    """
+    Test that SongEntry keeps compact reproductions as epoch seconds.
+
+    Parameters
+    ----------
+    get_song : fixture
+        Fixture that returns a song instance.
+    times_played : fixture
+        Fixture that returns a list of dates.
+    storage : callable
+        Constructor of the compact reproductions.
+    """
+    seconds = [int(timestamp.timestamp()) for timestamp in times_played]
+    compact_times = array('q', seconds) if storage is array else np.array(seconds, dtype=np.int64)
+    song_entry = mh.SongEntry(get_song, compact_times)
+    assert_that(song_entry.is_compact).is_true()
+    assert_that(song_entry.amount_reproductions).is_equal_to(len(times_played))
+
+    song_entry.add_play(valid_date() + timedelta(days=1))
+    assert_that(song_entry.amount_reproductions).is_equal_to(len(times_played) + 1)
+    assert_that(song_entry.times_played).is_instance_of(array)
+    assert_that(song_entry.epoch_seconds.tolist()).is_equal_to(
+        seconds + [int((valid_date() + timedelta(days=1)).timestamp())])
+
+    list_entry = mh.SongEntry(get_song, list(times_played))
+    list_entry.compact()
+    assert_that(list_entry.times_played).is_equal_to(array('q', seconds))
+    assert_that(list_entry.epoch_seconds.dtype).is_equal_to(np.int64)
+
+
+def test_song_entry_compact_eq(get_song, times_played):
+    """
+    Test that SongEntry compares compact reproductions by their epoch seconds.
+
+    Parameters
+    ----------
+    get_song : fixture
+        Fixture that returns a song instance.
+    times_played : fixture
+        Fixture that returns a list of dates.
+    """
+    seconds = [int(timestamp.timestamp()) for timestamp in times_played]
+    ndarray_entry = mh.SongEntry(get_song, np.array(seconds, dtype=np.int64))
+    assert_that(ndarray_entry).is_equal_to(
+        mh.SongEntry(get_song, np.array(seconds, dtype=np.int64)))
+    assert_that(ndarray_entry).is_equal_to(mh.SongEntry(get_song, array('q', seconds)))
+    assert_that(ndarray_entry).is_equal_to(mh.SongEntry(get_song, list(times_played)))
+    assert_that(ndarray_entry).is_not_equal_to(
+        mh.SongEntry(get_song, np.array(seconds + [0], dtype=np.int64)))
+    assert_that(ndarray_entry).is_not_equal_to(
+        mh.SongEntry(valid_song(), np.array(seconds, dtype=np.int64)))
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_music_history_record_plays(songs, incremental: bool, float_tolerance: float):
+    '''
+    Test that MusicHistory's record_plays method adds the reproductions to the right entries.
+
+    Parameters
+    ----------
+    songs : fixture
+        Fixture that returns a list of songs.
+    incremental : bool
+        If the MusicHistory keeps its reproductions per genre up to date.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    '''
+    metal_songs = songs([('metal', 2)])
+    rock_song = songs([('rock', 1)])[0]
+    music_history = mh.MusicHistory([mh.SongEntry(metal_songs[0], [valid_date()])],
+                                    incremental=incremental)
+    music_history.record_plays([(metal_songs[0], valid_date()),
+                                (rock_song, valid_date()),
+                                (CompactSong.from_song(rock_song), valid_date()),
+                                (metal_songs[1], valid_date())])
+
+    assert_that(music_history).is_length(3)
+    assert_that(music_history.total_entries).is_equal_to(5)
+    assert_that([entry.amount_reproductions for entry in music_history._songs_played]
+                ).is_equal_to([2, 2, 1])
+    assert_that(music_history.genre_preferences[rock_song.genre]).is_close_to(0.4,
+                                                                             float_tolerance)
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_music_history_catalog(songs, incremental: bool, float_tolerance: float):
+    '''
+    Test that MusicHistory stores the songs played as entries of a shared catalog.
+
+    Parameters
+    ----------
+    songs : fixture
+        Fixture that returns a list of songs.
+    incremental : bool
+        If the MusicHistory keeps its reproductions per genre up to date.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    '''
+    metal_song, rock_song = songs([('metal', 1), ('rock', 1)])
+    catalog = SongCatalog()
+    first = mh.MusicHistory([mh.SongEntry(metal_song, [valid_date()])],
+                            incremental=incremental, catalog=catalog)
+    second = mh.MusicHistory([], incremental=incremental, catalog=catalog)
+    first.record_plays([(metal_song, valid_date()), (rock_song, valid_date())])
+    second.record_plays([(Song(rock_song.title, rock_song.genre,
+                               rock_song.artist, rock_song.year), valid_date())] * 3)
+
+    assert_that(catalog).is_length(2)
+    assert_that(first).is_length(2)
+    assert_that(first.total_entries).is_equal_to(3)
+    assert_that(first.genre_preferences[rock_song.genre]).is_close_to(1/3, float_tolerance)
+    assert_that(second._songs_played).is_equal_to(
+        [mh.CatalogEntry(catalog, 1, array('q', [int(valid_date().timestamp())] * 3))])
+    assert_that(second._songs_played[0].song).is_same_as(first._songs_played[1].song)
+    with pytest.raises(mh.SongEntryTypeError):
+        second._songs_played[0].add_play('2001-12-02')
+    with pytest.raises(mh.MusicHistoryTypeError):
+        mh.MusicHistory([], catalog={})
+
+
+@pytest.mark.parametrize('song, timestamp', [
+    (None, valid_date()),
+    (valid_song(), '2001-12-01'),
+])
+def test_music_history_record_play_ko(song: Song, timestamp: datetime):
+    '''
+    Test that MusicHistory's record_play method rejects parameters with a wrong type.
+
+    Parameters
+    ----------
+    song : Song
+        Song played.
+    timestamp : datetime
+        Moment when the song was played.
+    '''
+    with pytest.raises(mh.MusicHistoryTypeError):
+        mh.MusicHistory([]).record_play(song, timestamp)
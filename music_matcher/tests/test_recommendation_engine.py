@@ -1,9 +1,16 @@
 '''Tests for the recommendation_engine.py file.'''
 
+import os
+import stat
+from datetime import timedelta
+
+import numpy as np
 import pytest
 from assertpy import assert_that
 
 import music_matcher.recommendation_engine as rec
+from music_matcher.benchmark import synthetic_users
+from .conftest import valid_date
 
 
 GENRES_PATH = 'music_matcher/data/music_genres.yaml'
@@ -79,6 +86,8 @@ def loaded_genres():
      {'metal': 0.5}],
     [{'hardcore': 0.7, 'opera': 0.1, 'medieval': 0.1, 'rap': 0.1},
      {'punk': 0.7, 'classical': 0.2, 'hip-hop': 0.1}],
+    [{'heavy;rap': 0.4, 'pop': 0.5, 'opera; unknown': 0.1},
+     {'metal': 0.2, 'hip-hop': 0.2, 'pop': 0.5, 'classical': 0.05}],
 ])
 def test_recommendation_normalize(monkeypatch, preferences: dict[str:float], float_tolerance,
                                   normalized_preferences: dict[str:float], loaded_genres):
@@ -209,3 +218,1061 @@ def test_recommendation_init_affinity_matrix(songs, users, user_names,
     for i, row in enumerate(rec_en._matrix):
         for j, elem in enumerate(row):
             assert_that(elem).is_close_to(expected_matrix[i][j], float_tolerance)
+
+
+@pytest.mark.parametrize('user_names', [
+    ['lucia', 'luis', 'jorge', 'daniel'],
+])
+def test_recommendation_matrix_matches_pairwise(songs, users, user_names, float_tolerance):
+    """
+    Test that the vectorized affinity matrix matches the pairwise computation.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    user_names : list[str]
+        Usernames that will be used to initialize the RecommendationEngine instance.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = sorted(users(username, songs) for username in user_names)
+    rec_en = rec.RecommendationEngine(GENRES_PATH, users)
+    preferences = [rec_en._normalize_preferences(user.music_history.genre_preferences)
+                   for user in users]
+    for i, pref_1 in enumerate(preferences):
+        for j, pref_2 in enumerate(preferences):
+            if i != j:
+                expected = rec.RecommendationEngine._calculate_affinity(pref_1, pref_2)
+                assert_that(rec_en._matrix[i, j]).is_close_to(expected, float_tolerance)
+
+
+@pytest.mark.parametrize('user_names,pairs', [
+    (['lucia', 'luis', 'jorge', 'daniel'],
+     [('lucia', 'luis'), ('daniel', 'luis'), ('jorge', 'jorge'), ('luis', 'lucia')]),
+])
+def test_recommendation_affinities(songs, users, user_names: list[str],
+                                   pairs: list[tuple[str, str]], float_tolerance):
+    """
+    Test that the RecommendationEngine's affinities method matches affinity.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    user_names : list[str]
+        Usernames that will be used to initialize the RecommendationEngine instance.
+    pairs : list[tuple[str, str]]
+        Usernames of the pairs whose affinity is going to be requested.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = {username: users(username, songs) for username in user_names}
+    rec_en = rec.RecommendationEngine(GENRES_PATH, list(users.values()))
+    user_pairs = [(users[name_1], users[name_2]) for name_1, name_2 in pairs]
+    computed = rec_en.affinities(user_pairs)
+    assert_that(computed).is_length(len(pairs))
+    for pair, affinity in zip(user_pairs, computed):
+        assert_that(affinity).is_close_to(rec_en.affinity(pair), float_tolerance)
+
+
+def test_recommendation_affinities_ko(songs, users):
+    """
+    Test that the RecommendationEngine's affinities method raises with unknown users.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    """
+    known = [users(username, songs) for username in ['lucia', 'luis']]
+    rec_en = rec.RecommendationEngine(GENRES_PATH, known)
+    with pytest.raises(rec.RecommendationError):
+        rec_en.affinities([(known[0], users('jorge', songs))])
+
+
+@pytest.mark.parametrize('storage', rec.RecommendationEngine.STORAGE_MODES)
+@pytest.mark.parametrize('user_names,users_compared,expected_result', [
+    (['lucia', 'luis'], ['lucia', 'luis'], 0.1518),
+    (['daniel', 'lucia', 'luis'], ['daniel', 'luis'], 0.2645),
+    (['daniel', 'lucia', 'luis'], ['luis', 'luis'], 1),
+])
+def test_recommendation_affinity_storage(songs, users, storage: str, user_names: list[str],
+                                         users_compared: list[str], expected_result: float,
+                                         float_tolerance):
+    """
+    Test that every storage mode returns the same affinities.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    storage : str
+        Storage mode used by the RecommendationEngine instance.
+    user_names : list[str]
+        Usernames that will be used to initialize the RecommendationEngine instance.
+    users_compared : list[str]
+        List with the two users whose affinity is going to be requested.
+    expected_result : float
+        The expected affinity between the two users chosen to compare then.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = {username: users(username, songs) for username in user_names}
+    rec_en = rec.RecommendationEngine(GENRES_PATH, list(users.values()), storage=storage)
+    pair = tuple(users[username] for username in users_compared)
+    assert_that(rec_en.affinity(pair)).is_close_to(expected_result, float_tolerance)
+    assert_that(rec_en.affinities([pair])[0]).is_close_to(expected_result, float_tolerance)
+
+
+@pytest.mark.parametrize('storage,expected_exception', [
+    (None, rec.RecommendationTypeError),
+    ('sparse-ish', rec.RecommendationError),
+])
+def test_recommendation_storage_ko(songs, users, storage, expected_exception: Exception):
+    """
+    Test that the RecommendationEngine's constructor rejects wrong storage modes.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    storage : Any
+        Storage mode used to initialize the RecommendationEngine instance.
+    expected_exception : Exception
+        The exception that should be raised.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis']]
+    with pytest.raises(expected_exception):
+        rec.RecommendationEngine(GENRES_PATH, users, storage=storage)
+
+
+@pytest.mark.parametrize('storage', rec.RecommendationEngine.STORAGE_MODES)
+@pytest.mark.parametrize('k', [1, 2, 3, 10])
+def test_recommendation_top_matches(songs, users, storage: str, k: int):
+    """
+    Test that the RecommendationEngine's top_matches method returns the best matches.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    storage : str
+        Storage mode used by the RecommendationEngine instance.
+    k : int
+        Number of matches requested.
+    """
+    users = {username: users(username, songs)
+             for username in ['lucia', 'luis', 'jorge', 'daniel']}
+    rec_en = rec.RecommendationEngine(GENRES_PATH, list(users.values()), storage=storage)
+    expected = sorted(((username, rec_en.affinity((users['lucia'], user)))
+                       for username, user in users.items() if username != 'lucia'),
+                      key=lambda match: -match[1])[:k]
+    matches = rec_en.top_matches(users['lucia'], k)
+    assert_that([username for username, _ in matches]).is_equal_to(
+        [username for username, _ in expected])
+
+
+@pytest.mark.parametrize('k,expected_exception', [
+    (0, rec.RecommendationError),
+    ('3', rec.RecommendationTypeError),
+])
+def test_recommendation_top_matches_ko(songs, users, k, expected_exception: Exception):
+    """
+    Test that the RecommendationEngine's top_matches method rejects wrong parameters.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    k : Any
+        Number of matches requested.
+    expected_exception : Exception
+        The exception that should be raised.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis']]
+    rec_en = rec.RecommendationEngine(GENRES_PATH, users, storage='none')
+    with pytest.raises(expected_exception):
+        rec_en.top_matches(users[0], k)
+
+
+def test_recommendation_lazy_cache(songs, users, float_tolerance):
+    """
+    Test that the 'lazy' storage mode caches the affinities computed.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = {username: users(username, songs) for username in ['lucia', 'luis', 'jorge']}
+    rec_en = rec.RecommendationEngine(GENRES_PATH, list(users.values()),
+                                      storage='lazy', cache_size=1)
+    assert_that(rec_en._matrix).is_none()
+
+    first = rec_en.affinity((users['lucia'], users['luis']))
+    second = rec_en.affinity((users['luis'], users['lucia']))
+    rec_en.affinity((users['lucia'], users['jorge']))
+
+    assert_that(first).is_close_to(0.1518, float_tolerance)
+    assert_that(second).is_equal_to(first)
+    assert_that(rec_en.cache_info).is_equal_to((1, 2, 1, 1, 1))
+
+
+@pytest.mark.parametrize('cache_size,expected_exception', [
+    (-1, rec.RecommendationError),
+    (1.5, rec.RecommendationTypeError),
+])
+def test_recommendation_cache_size_ko(songs, users, cache_size, expected_exception: Exception):
+    """
+    Test that the RecommendationEngine's constructor rejects wrong cache sizes.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    cache_size : Any
+        Cache size used to initialize the RecommendationEngine instance.
+    expected_exception : Exception
+        The exception that should be raised.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis']]
+    with pytest.raises(expected_exception):
+        rec.RecommendationEngine(GENRES_PATH, users, storage='lazy', cache_size=cache_size)
+
+
+@pytest.mark.parametrize('dtype,expected_exception', [
+    ('float64', rec.RecommendationError),
+    (None, rec.RecommendationTypeError),
+])
+def test_recommendation_dtype_ko(songs, users, dtype, expected_exception: Exception):
+    """
+    Test that the RecommendationEngine's constructor rejects wrong dtypes.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    dtype : Any
+        Floating point type used to initialize the RecommendationEngine instance.
+    expected_exception : Exception
+        The exception that should be raised.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis']]
+    with pytest.raises(expected_exception):
+        rec.RecommendationEngine(GENRES_PATH, users, storage='triangular', dtype=dtype)
+
+
+@pytest.mark.parametrize('genre,basic_genre', [
+    ('metal', 'metal'),
+    ('heavy', 'metal'),
+    ('opera', 'classical'),
+    ('electronic', 'electronic'),
+    ('unknown genre', None),
+])
+def test_recommendation_genre_lookup(loaded_genres, genre: str, basic_genre: str):
+    """
+    Test that build_genre_lookup maps every genre to its basic genre.
+
+    Parameters
+    ----------
+    loaded_genres : fixture
+        Fixture that returns the set of rec.Genres used.
+    genre : str
+        Genre or subgenre looked up.
+    basic_genre : str
+        Basic genre that the genre should be mapped to.
+    """
+    lookup = rec.build_genre_lookup(loaded_genres)
+    assert_that(lookup.get(genre)).is_equal_to(basic_genre)
+    assert_that(rec.build_genre_lookup(loaded_genres)).is_same_as(lookup)
+
+
+def assert_same_affinities(rec_en: rec.RecommendationEngine,
+                           expected_en: rec.RecommendationEngine,
+                           users: list, float_tolerance: float):
+    """
+    Assert that two engines return the same affinity for every pair of users.
+
+    Parameters
+    ----------
+    rec_en : rec.RecommendationEngine
+        Engine tested.
+    expected_en : rec.RecommendationEngine
+        Engine with the expected affinities.
+    users : list[User]
+        Users whose affinities will be compared.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    for user_1 in users:
+        for user_2 in users:
+            assert_that(rec_en.affinity((user_1, user_2))).is_close_to(
+                expected_en.affinity((user_1, user_2)), float_tolerance)
+
+
+@pytest.mark.parametrize('storage', rec.RecommendationEngine.STORAGE_MODES)
+def test_recommendation_add_user(songs, users, storage: str, float_tolerance):
+    """
+    Test that adding users gives the same affinities as building the engine with them.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    storage : str
+        Storage mode used by the RecommendationEngine instance.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis', 'jorge', 'daniel']]
+    rec_en = rec.RecommendationEngine(GENRES_PATH, users[:2], storage=storage)
+    rec_en.affinity((users[0], users[1]))
+    rec_en.add_user(users[2])
+    rec_en.add_user(users[3])
+
+    expected_en = rec.RecommendationEngine(GENRES_PATH, users)
+    assert_same_affinities(rec_en, expected_en, users, float_tolerance)
+    with pytest.raises(rec.RecommendationError):
+        rec_en.add_user(users[0])
+
+
+def test_recommendation_add_user_dense(float_tolerance):
+    """
+    Test that the dense matrix is only copied when its spare capacity runs out.
+
+    Parameters
+    ----------
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = synthetic_users(rec.RecommendationEngine.load_yaml_file(GENRES_PATH), 60, seed=3)
+    rec_en = rec.RecommendationEngine(GENRES_PATH, users[:2])
+    copies, data = 0, rec_en._matrix.ctypes.data
+    for user in users[2:]:
+        rec_en.add_user(user)
+        copies += rec_en._matrix.ctypes.data != data
+        data = rec_en._matrix.ctypes.data
+    assert_that(copies).is_less_than_or_equal_to(12)
+
+    rec_en.remove_user(users[5].username)
+    rec_en.add_user(users[5])
+    expected_en = rec.RecommendationEngine(GENRES_PATH, users)
+    assert_same_affinities(rec_en, expected_en, users[::4], float_tolerance)
+
+
+@pytest.mark.parametrize('storage', rec.RecommendationEngine.STORAGE_MODES)
+def test_recommendation_update_user(songs, users, storage: str, float_tolerance):
+    """
+    Test that updating a user gives the same affinities as rebuilding the engine.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    storage : str
+        Storage mode used by the RecommendationEngine instance.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis', 'jorge', 'daniel']]
+    rec_en = rec.RecommendationEngine(GENRES_PATH, users, storage=storage)
+    rec_en.affinity((users[1], users[2]))
+
+    for song in songs([('jazz', 10), ('classical', 5)]):
+        users[1].music_history.record_play(song, valid_date())
+    rec_en.update_user(users[1])
+
+    expected_en = rec.RecommendationEngine(GENRES_PATH, users)
+    assert_same_affinities(rec_en, expected_en, users, float_tolerance)
+
+
+@pytest.mark.parametrize('storage', rec.RecommendationEngine.STORAGE_MODES)
+@pytest.mark.parametrize('removed', ['daniel', 'jorge', 'lucia', 'luis'])
+def test_recommendation_remove_user(songs, users, storage: str, removed: str,
+                                    float_tolerance):
+    """
+    Test that removing a user gives the same affinities as building the engine without it.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    storage : str
+        Storage mode used by the RecommendationEngine instance.
+    removed : str
+        Username of the user removed.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis', 'jorge', 'daniel']]
+    rec_en = rec.RecommendationEngine(GENRES_PATH, users, storage=storage)
+    rec_en.affinity((users[0], users[3]))
+    rec_en.remove_user(removed)
+
+    remaining = [user for user in users if user.username != removed]
+    expected_en = rec.RecommendationEngine(GENRES_PATH, remaining)
+    assert_same_affinities(rec_en, expected_en, remaining, float_tolerance)
+    with pytest.raises(rec.RecommendationError):
+        rec_en.affinity((users[0], [user for user in users if user.username == removed][0]))
+
+
+@pytest.mark.parametrize('username,expected_exception', [
+    ('jorge', rec.RecommendationError),
+    ('lucia', rec.RecommendationError),
+    (None, rec.RecommendationTypeError),
+])
+def test_recommendation_remove_user_ko(songs, users, username, expected_exception: Exception):
+    """
+    Test that the RecommendationEngine's remove_user method rejects wrong parameters.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    username : Any
+        Username of the user removed.
+    expected_exception : Exception
+        The exception that should be raised.
+    """
+    rec_en = rec.RecommendationEngine(GENRES_PATH,
+                                      [users(username, songs) for username in ['lucia', 'luis']])
+    with pytest.raises(expected_exception):
+        rec_en.remove_user(username)
+
+
+def test_recommendation_update_user_ko(songs, users):
+    """
+    Test that the RecommendationEngine's update_user method rejects wrong parameters.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    """
+    rec_en = rec.RecommendationEngine(GENRES_PATH,
+                                      [users(username, songs) for username in ['lucia', 'luis']])
+    with pytest.raises(rec.RecommendationTypeError):
+        rec_en.update_user('lucia')
+    with pytest.raises(rec.RecommendationError):
+        rec_en.update_user(users('jorge', songs))
+
+
+def test_recommendation_taxonomy_cache(tmp_path):
+    """
+    Test that a genres yaml file is only parsed again when it changes.
+
+    Parameters
+    ----------
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    """
+    genres_path = tmp_path / 'genres.yaml'
+    genres_path.write_text("version: 'v1'\ngenres:\n  - rock:\n      - subgenres:\n"
+                           "          - hard\n", encoding='utf-8')
+    rec.clear_taxonomy_cache()
+    taxonomy = rec.RecommendationEngine.load_yaml_file(str(genres_path))
+    assert_that(rec.RecommendationEngine.load_yaml_file(str(genres_path))).is_same_as(taxonomy)
+
+    genres_path.write_text("version: 'v2'\ngenres:\n  - rock:\n      - subgenres:\n"
+                           "          - hard\n          - stoner\n", encoding='utf-8')
+    new_taxonomy = rec.RecommendationEngine.load_yaml_file(str(genres_path))
+    assert_that(new_taxonomy.version).is_equal_to('v2')
+    assert_that(new_taxonomy.lookup).is_equal_to({'rock': 'rock', 'hard': 'rock',
+                                                  'stoner': 'rock'})
+
+    rec.clear_taxonomy_cache()
+    assert_that(rec.RecommendationEngine.load_yaml_file(str(genres_path))
+                ).is_not_same_as(new_taxonomy)
+
+
+def test_recommendation_init_taxonomy(songs, users, float_tolerance):
+    """
+    Test that the RecommendationEngine can be built from a Taxonomy already loaded.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis']]
+    taxonomy = rec.RecommendationEngine.load_yaml_file(GENRES_PATH)
+    rec_en = rec.RecommendationEngine(taxonomy, users)
+    assert_that(rec_en.affinity(tuple(users))).is_close_to(0.1518, float_tolerance)
+
+
+@pytest.mark.parametrize('storage', ['dense', 'triangular'])
+def test_recommendation_parallel(songs, users, storage: str, float_tolerance):
+    """
+    Test that building the affinities in several processes gives the same affinities.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    storage : str
+        Storage mode used by the RecommendationEngine instance.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis', 'jorge', 'daniel']]
+    rec_en = rec.RecommendationEngine(GENRES_PATH, users, storage=storage,
+                                      workers=2, block_size=1)
+    expected_en = rec.RecommendationEngine(GENRES_PATH, users)
+    assert_same_affinities(rec_en, expected_en, users, float_tolerance)
+
+
+@pytest.mark.parametrize('workers,block_size,expected_exception', [
+    (0, 1, rec.RecommendationError),
+    (2, 0, rec.RecommendationError),
+    ('2', 1, rec.RecommendationTypeError),
+    (2, None, rec.RecommendationTypeError),
+])
+def test_recommendation_parallel_ko(songs, users, workers, block_size,
+                                    expected_exception: Exception):
+    """
+    Test that the RecommendationEngine's constructor rejects wrong workers and block sizes.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    workers : Any
+        Number of worker processes.
+    block_size : Any
+        Number of rows computed at once.
+    expected_exception : Exception
+        The exception that should be raised.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis']]
+    with pytest.raises(expected_exception):
+        rec.RecommendationEngine(GENRES_PATH, users, workers=workers, block_size=block_size)
+
+
+@pytest.mark.parametrize('storage', rec.RecommendationEngine.STORAGE_MODES)
+def test_recommendation_save_open(songs, users, storage: str, tmp_path, float_tolerance):
+    """
+    Test that an engine opened from a file has the same affinities as the saved one.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    storage : str
+        Storage mode used by the RecommendationEngine instance.
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis', 'jorge', 'daniel']]
+    engine_path = str(tmp_path / 'engine.mmeng')
+    saved_en = rec.RecommendationEngine(GENRES_PATH, users[:3], storage=storage)
+    saved_en.save(engine_path)
+
+    opened_en = rec.RecommendationEngine.open(engine_path, GENRES_PATH)
+    assert_that(opened_en._storage).is_equal_to(storage)
+    assert_same_affinities(opened_en, saved_en, users[:3], float_tolerance)
+
+    opened_en.add_user(users[3])
+    for song in songs([('jazz', 10)]):
+        users[0].music_history.record_play(song, valid_date())
+    opened_en.update_user(users[0])
+    expected_en = rec.RecommendationEngine(GENRES_PATH, users)
+    assert_same_affinities(opened_en, expected_en, users, float_tolerance)
+
+    reopened_en = rec.RecommendationEngine.open(engine_path, GENRES_PATH)
+    assert_same_affinities(reopened_en, saved_en, users[:3], float_tolerance)
+
+
+@pytest.mark.parametrize('storage', rec.RecommendationEngine.STORAGE_MODES)
+def test_recommendation_save_opened(storage: str, tmp_path):
+    """
+    Test that an opened engine can be saved again into the file it's mapped from.
+
+    Parameters
+    ----------
+    storage : str
+        Storage mode used by the RecommendationEngine instance.
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    """
+    taxonomy = rec.RecommendationEngine.load_yaml_file(GENRES_PATH)
+    matrix = np.random.default_rng(11).random((1000, len(taxonomy.basic_genres)))
+    usernames = [f'user{i}' for i in range(len(matrix))]
+    engine_path = str(tmp_path / 'engine.mmeng')
+    rec.RecommendationEngine.from_matrix(taxonomy, usernames, matrix,
+                                         storage=storage).save(engine_path)
+
+    opened_en = rec.RecommendationEngine.open(engine_path, taxonomy)
+    expected = opened_en._pairs_affinity(np.arange(1000), np.arange(1000)[::-1]).tolist()
+    opened_en.save(engine_path)
+    assert_that(opened_en._pairs_affinity(np.arange(1000), np.arange(1000)[::-1]).tolist()
+                ).is_equal_to(expected)
+    reopened_en = rec.RecommendationEngine.open(engine_path, taxonomy)
+    assert_that(reopened_en._pairs_affinity(np.arange(1000), np.arange(1000)[::-1]).tolist()
+                ).is_equal_to(expected)
+    assert_that([path.name for path in tmp_path.iterdir()]).is_equal_to(['engine.mmeng'])
+
+
+def test_recommendation_save_mode(tmp_path):
+    """
+    Test that a saved engine gets the permissions of a file created with open.
+
+    Parameters
+    ----------
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    """
+    taxonomy = rec.RecommendationEngine.load_yaml_file(GENRES_PATH)
+    matrix = np.random.default_rng(13).random((3, len(taxonomy.basic_genres)))
+    rec_en = rec.RecommendationEngine.from_matrix(taxonomy, ['a', 'b', 'c'], matrix)
+    engine_path = tmp_path / 'engine.mmeng'
+    umask = os.umask(0o022)
+    try:
+        rec_en.save(str(engine_path))
+        assert_that(stat.S_IMODE(engine_path.stat().st_mode)).is_equal_to(0o644)
+        engine_path.chmod(0o640)
+        rec_en.save(str(engine_path))
+        assert_that(stat.S_IMODE(engine_path.stat().st_mode)).is_equal_to(0o640)
+    finally:
+        os.umask(umask)
+
+
+def test_recommendation_open_version_ko(songs, users, tmp_path):
+    """
+    Test that an engine saved with another version of the genres is rejected.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis']]
+    engine_path = str(tmp_path / 'engine.mmeng')
+    rec.RecommendationEngine(GENRES_PATH, users).save(engine_path)
+
+    taxonomy = rec.RecommendationEngine.load_yaml_file(GENRES_PATH)
+    with pytest.raises(rec.RecommendationError):
+        rec.RecommendationEngine.open(engine_path, taxonomy._replace(version='v0.0.1'))
+
+
+@pytest.mark.parametrize('content,expected_exception', [
+    (None, rec.RecommendationFileError),
+    (b'not an engine', rec.RecommendationParsingError),
+    (rec.ENGINE_MAGIC + b'\x05\x00\x00\x00\x00\x00\x00\x00{"a":', rec.RecommendationParsingError),
+])
+def test_recommendation_open_ko(tmp_path, content: bytes, expected_exception: Exception):
+    """
+    Test that opening a file that isn't a saved engine raises an exception.
+
+    Parameters
+    ----------
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    content : bytes
+        Content of the file opened, or None if it must not exist.
+    expected_exception : Exception
+        The exception that should be raised.
+    """
+    engine_path = tmp_path / 'engine.mmeng'
+    if content is not None:
+        engine_path.write_bytes(content)
+    with pytest.raises(expected_exception):
+        rec.RecommendationEngine.open(str(engine_path), GENRES_PATH)
+
+
+@pytest.mark.parametrize('storage', rec.RecommendationEngine.STORAGE_MODES)
+def test_recommendation_from_preferences(songs, users, storage: str, float_tolerance):
+    """
+    Test that an engine built from preferences matches the one built from users.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    storage : str
+        Storage mode used by the RecommendationEngine instance.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis', 'jorge', 'daniel']]
+    preferences = ((user.username, user.music_history.genre_preferences) for user in users)
+    rec_en = rec.RecommendationEngine.from_preferences(GENRES_PATH, preferences, storage=storage)
+    expected_en = rec.RecommendationEngine(GENRES_PATH, users)
+    assert_that(rec_en._usernames).is_equal_to([user.username for user in users])
+    assert_same_affinities(rec_en, expected_en, users, float_tolerance)
+
+
+@pytest.mark.parametrize('preferences,expected_exception', [
+    ([('lucia', {'metal': 1.0})], rec.RecommendationError),
+    ([('lucia', {'metal': 1.0}), ('lucia', {'rock': 1.0})], rec.RecommendationError),
+    ([('lucia', {'metal': 1.0}), ('luis', None)], rec.RecommendationTypeError),
+    ([('lucia', {'metal': 1.0}), (3, {'rock': 1.0})], rec.RecommendationTypeError),
+])
+def test_recommendation_from_preferences_ko(preferences, expected_exception: Exception):
+    """
+    Test that the RecommendationEngine's from_preferences rejects wrong preferences.
+
+    Parameters
+    ----------
+    preferences : list[tuple[str, dict[str:float]]]
+        Preferences used to build the engine.
+    expected_exception : Exception
+        The exception that should be raised.
+    """
+    with pytest.raises(expected_exception):
+        rec.RecommendationEngine.from_preferences(GENRES_PATH, preferences)
+
+
+def test_recommendation_engine_weighted_preferences(songs, users, float_tolerance: float):
+    """Test that the decayed genre preferences of the users can build an engine.
+
+    Every sample reproduction happens at the same moment, so the decay
+    doesn't change the affinities.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    sample_users = [users(username, songs) for username in ['daniel', 'jorge', 'lucia']]
+    expected_en = rec.RecommendationEngine(GENRES_PATH, sample_users)
+    rec_en = rec.RecommendationEngine.from_preferences(
+        GENRES_PATH, ((user.username, user.music_history.weighted_genre_preferences(
+            half_life=timedelta(days=30), now=valid_date() + timedelta(days=90)))
+                      for user in sample_users))
+    assert_same_affinities(rec_en, expected_en, sample_users, float_tolerance)
+
+
+@pytest.mark.parametrize('storage', rec.RecommendationEngine.STORAGE_MODES)
+def test_recommendation_sparse(songs, users, storage: str, tmp_path, float_tolerance):
+    """
+    Test that an engine with sparse preferences has the same affinities as a dense one.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    storage : str
+        Storage mode used by the RecommendationEngine instance.
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis', 'jorge', 'daniel']]
+    rec_en = rec.RecommendationEngine(GENRES_PATH, users[:3], storage=storage, sparse=True)
+    expected_en = rec.RecommendationEngine(GENRES_PATH, users[:3])
+    assert_same_affinities(rec_en, expected_en, users[:3], float_tolerance)
+    assert_that(rec_en.affinities([(users[0], users[1]), (users[2], users[2])]).tolist()
+                ).is_equal_to(pytest.approx(expected_en.affinities(
+                    [(users[0], users[1]), (users[2], users[2])]).tolist(), abs=float_tolerance))
+    assert_that(rec_en.preference_matrix.tolist()).is_equal_to(
+        expected_en.preference_matrix.tolist())
+
+    rec_en.add_user(users[3])
+    for song in songs([('jazz', 10)]):
+        users[0].music_history.record_play(song, valid_date())
+    rec_en.update_user(users[0])
+    rec_en.remove_user('luis')
+    remaining = [users[0], users[2], users[3]]
+    expected_en = rec.RecommendationEngine(GENRES_PATH, remaining)
+    assert_same_affinities(rec_en, expected_en, remaining, float_tolerance)
+    assert_that([name for name, _ in rec_en.top_matches(users[0], 2)]).is_equal_to(
+        [name for name, _ in expected_en.top_matches(users[0], 2)])
+
+    engine_path = str(tmp_path / 'engine.mmeng')
+    rec_en.save(engine_path)
+    opened_en = rec.RecommendationEngine.open(engine_path, GENRES_PATH)
+    assert_that(opened_en._sparse).is_true()
+    assert_same_affinities(opened_en, expected_en, remaining, float_tolerance)
+
+
+@pytest.mark.parametrize('sparse,workers,expected_exception', [
+    ('yes', 1, rec.RecommendationTypeError),
+    (True, 2, rec.RecommendationError),
+])
+def test_recommendation_sparse_ko(songs, users, sparse, workers: int,
+                                  expected_exception: Exception):
+    """
+    Test that the RecommendationEngine's constructor rejects wrong sparse options.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    sparse : bool
+        Value of the sparse parameter.
+    workers : int
+        Number of workers used.
+    expected_exception : Exception
+        Exception that should have been raised.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis']]
+    with pytest.raises(expected_exception):
+        rec.RecommendationEngine(GENRES_PATH, users, sparse=sparse, workers=workers)
+
+
+@pytest.mark.parametrize('genre_1,genre_2,similarity', [
+    ('bebop', 'bebop', 1.0),
+    ('bebop', 'swing', 0.5),
+    ('bebop', 'jazz', 0.5),
+    ('bebop', 'metal', 0.0),
+    ('jazz', 'rock', 0.0),
+])
+def test_recommendation_genre_kernel(genre_1: str, genre_2: str, similarity: float,
+                                     float_tolerance: float):
+    """
+    Test the similarity of the genres in the kernel of a taxonomy.
+
+    Parameters
+    ----------
+    genre_1, genre_2 : str
+        Genres compared.
+    similarity : float
+        Expected similarity of the genres.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    taxonomy = rec.RecommendationEngine.load_yaml_file(GENRES_PATH)
+    kernel = taxonomy.kernel()
+    genre_ids = taxonomy.genre_ids
+    assert_that(kernel[genre_ids[genre_1], genre_ids[genre_2]]).is_close_to(
+        similarity, float_tolerance)
+    assert_that(kernel[genre_ids[genre_2], genre_ids[genre_1]]).is_close_to(
+        similarity, float_tolerance)
+    assert_that(np.linalg.eigvalsh(kernel).min()).is_greater_than_or_equal_to(-float_tolerance)
+    assert_that(taxonomy.kernel()).is_same_as(kernel)
+    assert_that(kernel.flags.writeable).is_false()
+
+
+@pytest.mark.parametrize('storage', rec.RecommendationEngine.STORAGE_MODES)
+@pytest.mark.parametrize('sparse', [False, True])
+def test_recommendation_subgenre(songs, users, storage: str, sparse: bool, tmp_path,
+                                 float_tolerance):
+    """
+    Test that the affinities at subgenre resolution are the ones of P·K·Pᵀ.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    storage : str
+        Storage mode used by the RecommendationEngine instance.
+    sparse : bool
+        If the preferences are stored as sparse ones.
+    tmp_path : fixture
+        Temporary directory unique to the test.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis', 'jorge', 'daniel']]
+    rec_en = rec.RecommendationEngine(GENRES_PATH, users, storage=storage, sparse=sparse,
+                                      resolution='subgenre')
+
+    taxonomy = rec.RecommendationEngine.load_yaml_file(GENRES_PATH)
+    preferences = np.zeros((len(users), len(taxonomy.genre_names)))
+    for i, user in enumerate(users):
+        for genre, percentage in user.music_history.genre_preferences.items():
+            if genre in taxonomy.genre_ids:
+                preferences[i, taxonomy.genre_ids[genre]] += percentage
+    expected = preferences @ taxonomy.kernel() @ preferences.T
+    for i, user_1 in enumerate(users):
+        for j, user_2 in enumerate(users):
+            if i != j:
+                assert_that(rec_en.affinity((user_1, user_2))).is_close_to(
+                    expected[i, j], float_tolerance)
+
+    engine_path = str(tmp_path / 'engine.mmeng')
+    rec_en.save(engine_path)
+    opened_en = rec.RecommendationEngine.open(engine_path, GENRES_PATH)
+    assert_that(opened_en._resolution).is_equal_to('subgenre')
+    assert_same_affinities(opened_en, rec_en, users, float_tolerance)
+
+
+@pytest.mark.parametrize('resolution,sibling_weight,expected', [
+    ('basic', 0.5, [1.0, 1.0]),
+    ('subgenre', 0.5, [1.0, 0.5]),
+    ('subgenre', 0.25, [1.0, 0.25]),
+])
+def test_recommendation_subgenre_siblings(resolution: str, sibling_weight: float,
+                                          expected: list[float], float_tolerance: float):
+    """
+    Test that only the subgenre resolution tells apart the subgenres of a basic genre.
+
+    Parameters
+    ----------
+    resolution : str
+        Resolution of the engine.
+    sibling_weight : float
+        Similarity of two different subgenres of the same basic genre.
+    expected : list[float]
+        Affinity of a bebop fan with another one and with a swing fan.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    rec_en = rec.RecommendationEngine.from_preferences(
+        GENRES_PATH, [('ana', {'bebop': 1.0}), ('bea', {'bebop': 1.0}), ('eva', {'swing': 1.0})],
+        resolution=resolution, sibling_weight=sibling_weight)
+    assert_that(rec_en._pairs_affinity(np.array([0, 0]), np.array([1, 2])).tolist()
+                ).is_equal_to(pytest.approx(expected, abs=float_tolerance))
+
+
+@pytest.mark.parametrize('resolution,sibling_weight,expected_exception', [
+    (1, 0.5, rec.RecommendationTypeError),
+    ('genre', 0.5, rec.RecommendationError),
+    ('subgenre', '0.5', rec.RecommendationTypeError),
+    ('subgenre', 1.5, rec.RecommendationError),
+    ('subgenre', -0.1, rec.RecommendationError),
+])
+def test_recommendation_resolution_ko(songs, users, resolution, sibling_weight,
+                                      expected_exception: Exception):
+    """
+    Test that the RecommendationEngine's constructor rejects wrong resolution options.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    resolution : str
+        Value of the resolution parameter.
+    sibling_weight : float
+        Value of the sibling_weight parameter.
+    expected_exception : Exception
+        Exception that should have been raised.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis']]
+    with pytest.raises(expected_exception):
+        rec.RecommendationEngine(GENRES_PATH, users, resolution=resolution,
+                                 sibling_weight=sibling_weight)
+
+
+@pytest.mark.parametrize('storage', rec.RecommendationEngine.STORAGE_MODES)
+@pytest.mark.parametrize('sparse', [False, True])
+@pytest.mark.parametrize('resolution', rec.RecommendationEngine.RESOLUTIONS)
+def test_recommendation_from_matrix(songs, users, storage: str, sparse: bool, resolution: str,
+                                    float_tolerance):
+    """
+    Test that an engine built from a preference matrix matches the one built from users.
+
+    Parameters
+    ----------
+    songs : fixture
+        Song's factory as fixture.
+    users : fixture
+        User's factory as fixture.
+    storage : str
+        Storage mode used by the RecommendationEngine instance.
+    sparse : bool
+        If the preferences are stored as sparse ones.
+    resolution : str
+        Resolution of the engine.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    """
+    users = [users(username, songs) for username in ['lucia', 'luis', 'jorge', 'daniel']]
+    taxonomy = rec.RecommendationEngine.load_yaml_file(GENRES_PATH)
+    lookup = taxonomy.lookup if resolution == 'basic' else {name: name for name in
+                                                            taxonomy.genre_names}
+    columns = taxonomy.basic_genres if resolution == 'basic' else list(taxonomy.genre_names)
+    matrix = np.zeros((len(users), len(columns)))
+    for i, user in enumerate(users):
+        for genre, percentage in user.music_history.genre_preferences.items():
+            if genre in lookup:
+                matrix[i, columns.index(lookup[genre])] += percentage
+
+    rec_en = rec.RecommendationEngine.from_matrix(
+        taxonomy, (user.username for user in users), matrix, storage=storage, sparse=sparse,
+        resolution=resolution)
+    expected_en = rec.RecommendationEngine(GENRES_PATH, users, resolution=resolution)
+    assert_that(rec_en.usernames).is_equal_to([user.username for user in users])
+    assert_same_affinities(rec_en, expected_en, users, float_tolerance)
+
+    matrix[:] = 0
+    assert_same_affinities(rec_en, expected_en, users, float_tolerance)
+
+
+@pytest.mark.parametrize('usernames,matrix,expected_exception', [
+    (['lucia'], [[1.0] * 15], rec.RecommendationError),
+    (['lucia', 'lucia'], [[1.0] * 15] * 2, rec.RecommendationError),
+    (['lucia', 3], [[1.0] * 15] * 2, rec.RecommendationTypeError),
+    (['lucia', 'luis'], [[1.0] * 14] * 2, rec.RecommendationError),
+    (['lucia', 'luis', 'jorge'], [[1.0] * 15] * 2, rec.RecommendationError),
+    (['lucia', 'luis'], [['rock'] * 15] * 2, rec.RecommendationTypeError),
+])
+def test_recommendation_from_matrix_ko(usernames, matrix, expected_exception: Exception):
+    """
+    Test that the RecommendationEngine's from_matrix rejects wrong matrices.
+
+    Parameters
+    ----------
+    usernames : list[str]
+        Usernames of the rows.
+    matrix : list[list[float]]
+        Preference matrix used to build the engine.
+    expected_exception : Exception
+        The exception that should be raised.
+    """
+    with pytest.raises(expected_exception):
+        rec.RecommendationEngine.from_matrix(GENRES_PATH, usernames, matrix)
@@ -1,9 +1,11 @@
 '''Tests for the song.py file.'''
 
+import pickle
+
 import pytest
 from assertpy import assert_that
 
-from music_matcher.song import Song, SongError, SongTypeError
+from music_matcher.song import CompactSong, Song, SongError, SongTypeError, split_genres
 
 
 @pytest.mark.parametrize('title,genre,artist,year', [
@@ -54,3 +56,71 @@ def test_song_init_ko(title: str, genre: str, artist: str, year: int,
 """
     with pytest.raises(expected_exception):
         Song(title=title, genre=genre, artist=artist, year=year)
+
+
+def test_song_key():
+    """Test that the Song's key only depends on the title, artist and year."""
+    song = Song('Invierno Nuclear', 'electronic', 'VVV[Trippin\' you', 2020)
+    same_song = Song('Invierno Nuclear', 'techno', 'VVV[Trippin\' you', 2020)
+    assert_that(song.key).is_equal_to(('Invierno Nuclear', 'VVV[Trippin\' you', 2020))
+    assert_that(same_song.key).is_equal_to(song.key)
+
+
+def test_compact_song():
+    """Test that CompactSong has the attributes of Song and shares its strings."""
+    song = Song('Invierno Nuclear', 'electronic', 'VVV[Trippin\' you', 2020)
+    compact = CompactSong.from_song(song, {'electronic': 3})
+    other = CompactSong('Nadie es Leal', ''.join(['electro', 'nic']),
+                        ''.join(['VVV[Trippin\'', ' you']), 2021)
+
+    assert_that(compact).is_equal_to(song)
+    assert_that(compact.key).is_equal_to(song.key)
+    assert_that(compact.genre_id).is_equal_to(3)
+    assert_that(other.genre_id).is_none()
+    assert_that(other.genre).is_same_as(compact.genre)
+    assert_that(other.artist).is_same_as(compact.artist)
+    assert_that(hash(compact)).is_equal_to(hash(CompactSong.from_song(song)))
+    assert_that(hasattr(compact, '__dict__')).is_false()
+    assert_that(pickle.loads(pickle.dumps(compact)).genre_id).is_equal_to(3)
+    with pytest.raises(AttributeError):
+        compact.year = 2021
+
+
+@pytest.mark.parametrize('title,genre,artist,year,expected_exception', [
+    (3, 'rock', 'VVV[Trippin\' you', 1998, SongTypeError),
+    ('Hiedra Verde', None, 'VVV[Trippin\' you', 2021, SongTypeError),
+    ('Monstruo', 'electronic', 'VVV[Trippin\' you', -92, SongError),
+])
+def test_compact_song_ko(title: str, genre: str, artist: str, year: int,
+                         expected_exception: Exception):
+    """Test that CompactSong validates its parameters as Song does."""
+    with pytest.raises(expected_exception):
+        CompactSong(title, genre, artist, year)
+
+
+@pytest.mark.parametrize('genre,genres', [
+    ('rock', ('rock',)),
+    ('rock;pop', ('rock', 'pop')),
+    (' rock ; pop;rock;', ('rock', 'pop')),
+    (';', (';',)),
+])
+def test_split_genres(genre: str, genres: tuple[str, ...]):
+    """Test that the genres of a song are split once and shared.
+
+    Parameters
+    ----------
+    genre : str
+        Genre string of the song.
+    genres : tuple[str, ...]
+        Genres expected.
+    """
+    song = Song('Invierno Nuclear', genre, 'VVV[Trippin\' you', 2020)
+    compact = CompactSong.from_song(song)
+    assert_that(song.genres).is_equal_to(genres)
+    assert_that(compact.genres).is_same_as(song.genres)
+    assert_that(split_genres(genre)).is_same_as(song.genres)
+
+    split_genres.cache_clear()
+    assert_that(vars(song)['genres']).is_same_as(compact.genres)
+    assert_that(repr(song)).does_not_contain('genres')
+    assert_that(song).is_equal_to(Song('Invierno Nuclear', genre, 'VVV[Trippin\' you', 2020))
@@ -0,0 +1,54 @@
+'''Tests for the song_catalog.py file.'''
+
+import pytest
+from assertpy import assert_that
+
+from music_matcher.song import CompactSong, Song
+from music_matcher.song_catalog import SongCatalog, SongCatalogError, SongCatalogTypeError
+
+
+def test_song_catalog_register(songs):
+    '''
+    Test that SongCatalog deduplicates the songs by title, artist and year.
+
+    Parameters
+    ----------
+    songs : fixture
+        Fixture that returns a list of songs.
+    '''
+    metal_songs = songs([('metal', 3)])
+    catalog = SongCatalog({'metal': 5})
+    ids = [catalog.register(song) for song in metal_songs]
+    same_song = Song(metal_songs[2].title, 'heavy', metal_songs[2].artist, metal_songs[2].year)
+
+    assert_that(ids).is_equal_to([0, 1, 2])
+    assert_that(catalog.register(same_song)).is_equal_to(2)
+    assert_that(catalog.register(CompactSong.from_song(metal_songs[0]))).is_equal_to(0)
+    assert_that(catalog).is_length(3)
+    assert_that(catalog.song_id(same_song)).is_equal_to(2)
+    assert_that(catalog[2]).is_equal_to(metal_songs[2])
+    assert_that(catalog[2].genre_id).is_equal_to(5)
+    assert_that(catalog.canonical(same_song)).is_same_as(catalog[2])
+    assert_that(same_song in catalog).is_true()
+    assert_that(songs([('rock', 1)])[0] in catalog).is_false()
+
+
+def test_song_catalog_ko(songs):
+    '''
+    Test that SongCatalog rejects wrong songs and ids.
+
+    Parameters
+    ----------
+    songs : fixture
+        Fixture that returns a list of songs.
+    '''
+    catalog = SongCatalog()
+    catalog.register(songs([('pop', 1)])[0])
+    with pytest.raises(SongCatalogTypeError):
+        catalog.register('Paranoid')
+    with pytest.raises(SongCatalogError):
+        catalog.song_id(songs([('rock', 1)])[0])
+    with pytest.raises(SongCatalogError):
+        catalog[1]  # pylint: disable=pointless-statement
+    with pytest.raises(SongCatalogTypeError):
+        catalog['0']  # pylint: disable=pointless-statement
@@ -0,0 +1,100 @@
+'''Tests for the sparse_preferences.py file.'''
+
+import numpy as np
+import pytest
+from assertpy import assert_that
+
+from music_matcher.sparse_preferences import SparsePreferences, SparsePreferencesError
+
+
+@pytest.fixture
+def dense_preferences() -> np.ndarray:
+    '''Return a matrix of preferences where most weights are zero.
+
+    Returns
+    -------
+    np.ndarray
+        40 x 60 matrix with an empty row.
+    '''
+    rng = np.random.default_rng(3)
+    matrix = rng.random((40, 60)) * (rng.random((40, 60)) < 0.1)
+    matrix[5] = 0
+    return matrix
+
+
+def test_sparse_preferences_products(dense_preferences, float_tolerance: float):
+    '''
+    Test that the products of sparse rows match the dense ones.
+
+    Parameters
+    ----------
+    dense_preferences : fixture
+        Fixture that returns a sparse matrix of preferences in dense format.
+    float_tolerance : float
+        Number that sets the appropriate deviation when comparing floating numbers.
+    '''
+    sparse = SparsePreferences.from_dense(dense_preferences)
+    rows, cols = np.arange(40), np.arange(40)[::-1]
+    expected = dense_preferences @ dense_preferences.T
+
+    assert_that(sparse.shape).is_equal_to((40, 60))
+    assert_that(sparse.nnz).is_equal_to(np.count_nonzero(dense_preferences))
+    assert_that(np.allclose(sparse.to_dense(), dense_preferences)).is_true()
+    assert_that(np.allclose(sparse.gram(), expected)).is_true()
+    assert_that(np.allclose(sparse.dots(rows, cols), expected[rows, cols])).is_true()
+    assert_that(np.allclose(sparse.block_scores(10, 20), expected[10:20, :20])).is_true()
+    assert_that(sparse.dot(5, 6)).is_equal_to(0.0)
+    for i, j in zip(rows, cols):
+        assert_that(sparse.dot(i, j)).is_close_to(expected[i, j], float_tolerance)
+
+
+def test_sparse_preferences_rows(dense_preferences):
+    '''
+    Test that rows can be replaced, appended and removed.
+
+    Parameters
+    ----------
+    dense_preferences : fixture
+        Fixture that returns a sparse matrix of preferences in dense format.
+    '''
+    sparse = SparsePreferences.from_dense(dense_preferences)
+    sparse.gram()
+    sparse.set_row(3, np.array([1, 4]), np.array([0.5, 0.5]))
+    dense_preferences[3] = 0
+    dense_preferences[3, [1, 4]] = 0.5
+    sparse.append(np.array([2]), np.array([1.0]))
+    dense_preferences = np.vstack((dense_preferences, np.eye(60)[2]))
+    sparse.remove(7)
+    dense_preferences = np.delete(dense_preferences, 7, axis=0)
+
+    assert_that(sparse).is_length(40)
+    assert_that(np.allclose(sparse.to_dense(), dense_preferences)).is_true()
+    assert_that(np.allclose(sparse.gram(), dense_preferences @ dense_preferences.T)).is_true()
+
+
+def test_sparse_preferences_from_coordinates(dense_preferences):
+    '''
+    Test that a matrix built from shuffled and repeated coordinates matches the dense one.
+
+    Parameters
+    ----------
+    dense_preferences : fixture
+        Fixture that returns a sparse matrix of preferences in dense format.
+    '''
+    rows, columns = np.nonzero(dense_preferences)
+    weights = dense_preferences[rows, columns]
+    order = np.random.default_rng(5).permutation(2 * len(rows)) % len(rows)
+    sparse = SparsePreferences.from_coordinates(
+        np.append(rows[order], 7), np.append(columns[order], 3),
+        np.append(weights[order] / 2, 0.0), dense_preferences.shape)
+
+    assert_that(sparse.nnz).is_equal_to(len(rows))
+    assert_that(np.allclose(sparse.to_dense(), dense_preferences)).is_true()
+    assert_that(sparse.arrays['indptr'].tolist()).is_equal_to(
+        SparsePreferences.from_dense(dense_preferences).arrays['indptr'].tolist())
+
+
+def test_sparse_preferences_ko():
+    '''Test that inconsistent arrays are rejected.'''
+    with pytest.raises(SparsePreferencesError):
+        SparsePreferences(np.array([0, 2]), np.array([1], dtype=np.int32), np.array([1.0]), 3)
@@ -4,7 +4,7 @@ Tasks file for the project.
 Use as: 'inv <task>'
 To list all the available tasks run: 'inv --list'
 """
-from invoke import task
+from invoke import Exit, task
 
 
 @task(help={'style': 'Analyze code style too'})
@@ -42,6 +42,79 @@ def test(ctx, keyword='', capture_output=True):
     ctx.run(' -'.join(['pytest'] + args), pty=capture_output)
 
 
+@task(help={'genres_yaml': 'Genres yaml file that will be compiled.',
+            'output': 'Path of the compiled taxonomy.'})
+def compile_taxonomy(ctx, genres_yaml='music_matcher/data/music_genres.yaml',
+                     output='music_matcher/data/music_genres.mmtax'):
+    """
+    Compile a genres yaml file into a binary taxonomy that loads without parsing.
+
+    Parameters
+    ----------
+    genres_yaml : str
+        Path of the genres yaml file.
+    output : str
+        Path where the compiled taxonomy will be written.
+    """
+    # pylint: disable=import-outside-toplevel,unused-argument
+    from music_matcher.compiled_taxonomy import compile_taxonomy as compile_yaml
+    taxonomy = compile_yaml(genres_yaml, output)
+    print(f'Compiled {len(taxonomy.genre_names)} genres of version {taxonomy.version} into {output}')
+
+
+@task(help={'scales': 'Comma separated numbers of users measured.',
+            'skew': 'Skew of the genres listened by the synthetic users, 0 for uniform.',
+            'queries': 'Number of queries whose latency is measured.',
+            'storage': 'Storage mode of the engines.',
+            'seed': 'Seed of the synthetic users.',
+            'output': 'Path of the JSON file with the results.',
+            'baseline': 'JSON file with the results of a previous run to compare with.',
+            'tolerance': 'Fraction a metric can grow over the baseline.',
+            'repeat': 'Times every step is measured, keeping the fastest one.'})
+def bench(ctx, scales='1000,10000,100000', skew=1.0, queries=200, storage='none', seed=0,
+          output='benchmark.json', baseline='', tolerance=0.25, repeat=3):
+    """
+    Measure how the engine scales with the number of users and compare with a baseline.
+
+    Parameters
+    ----------
+    scales : str
+        Comma separated numbers of users measured.
+    skew : float
+        Skew of the genres listened by the synthetic users.
+    queries : int
+        Number of queries whose latency is measured.
+    storage : str
+        Storage mode of the engines.
+    seed : int
+        Seed of the synthetic users.
+    output : str
+        Path where the results will be written as JSON.
+    baseline : str
+        If it's given, results of a previous run. The task fails if any
+        metric grew more than the tolerance over them.
+    tolerance : float
+        Fraction a metric can grow over the baseline before it's a regression.
+    repeat : int
+        Times the taxonomy loads, preferences and construction are measured,
+        keeping the fastest one.
+    """
+    # pylint: disable=import-outside-toplevel,unused-argument,too-many-arguments
+    from music_matcher import benchmark
+    results = benchmark.run_benchmark(scales=[int(scale) for scale in scales.split(',')],
+                                      skew=skew, queries=queries, storage=storage, seed=seed,
+                                      repeat=repeat)
+    benchmark.save_results(results, output)
+    regressions = []
+    if baseline:
+        regressions = benchmark.compare_results(results, benchmark.load_results(baseline),
+                                                tolerance)
+    print(benchmark.format_results(results, regressions))
+    print(f'Results written into {output}')
+    if regressions:
+        raise Exit(f'{len(regressions)} metrics regressed over {baseline}', code=1)
+
+
 @task(help={'tag': 'Tag that will be pulled from DockerHub'})
 def docker(ctx, tag='main'):
     """